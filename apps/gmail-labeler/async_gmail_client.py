@@ -0,0 +1,236 @@
+"""
+asyncio-native Gmail client for fetching.
+Mirrors GmailClient's read calls (profile, history, thread listing, thread and
+message fetches) on a pooled httpx.AsyncClient (keep-alive, HTTP/2 via h2), so
+one event loop can keep many Gmail requests in flight without a thread per
+request. It makes no label changes: those stay on GmailClient, which owns the
+StateDB label cache and its invalidation.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import httpx
+from google.auth.transport.requests import Request
+from config import Config
+from rate_limiter import RETRYABLE_STATUSES, RATE_LIMIT_REASONS, backoff_delay, get_default_limiter
+from gmail_client import (
+    build_credentials,
+    METADATA_HEADERS,
+    PROFILE_FIELDS,
+    THREAD_LIST_FIELDS,
+    HISTORY_LIST_FIELDS,
+    THREAD_METADATA_FIELDS,
+    MESSAGE_METADATA_FIELDS,
+    THREAD_PAGE_SIZE,
+)
+
+# httpx speaks HTTP/2 only with h2 installed (requirements.txt pulls it in via httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+GMAIL_API_BASE = "https://gmail.googleapis.com/gmail/v1/users/me"
+
+
+def _is_rate_limited(response):
+    if response.status_code == 429:
+        return True
+    if response.status_code != 403:
+        return False
+    try:
+        return response.json()['error']['errors'][0].get('reason') in RATE_LIMIT_REASONS
+    except (ValueError, KeyError, IndexError, TypeError):
+        return False
+
+
+class AsyncGmailClient:
+    def __init__(self, base_url=GMAIL_API_BASE, credentials=None, max_connections=None, max_inflight=None,
+                 limiter=None):
+        self.creds = credentials or build_credentials()
+        self.limiter = limiter or get_default_limiter()
+        self.logger = logging.getLogger("AsyncGmailClient")
+        max_connections = max_connections or Config.GMAIL_ASYNC_MAX_CONNECTIONS
+        self.http = httpx.AsyncClient(
+            base_url=base_url,
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=httpx.Timeout(30.0),
+        )
+        self._inflight = asyncio.Semaphore(max_inflight or Config.GMAIL_ASYNC_MAX_INFLIGHT)
+        self._token_lock = asyncio.Lock()
+
+    async def close(self):
+        await self.http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    # ── Transport ───────────────────────────────────────────────
+
+    async def _auth_headers(self):
+        """Bearer header, refreshing the access token off-loop when expired."""
+        if not self.creds.valid:
+            async with self._token_lock:
+                if not self.creds.valid:
+                    await asyncio.to_thread(self.creds.refresh, Request())
+        return {"Authorization": f"Bearer {self.creds.token}"}
+
+    async def _request(self, quota_method, method, path, params=None, json=None):
+        """
+        Send one API request within the quota budget and return the decoded
+        JSON body. Rate-limit and transient errors are retried with jittered
+        backoff (Retry-After wins). Raises httpx.HTTPStatusError.
+        """
+        attempt = 0
+        while True:
+            await self.limiter.acquire_async(quota_method)
+            async with self._inflight:
+                response = await self.http.request(
+                    method, path, params=params, json=json, headers=await self._auth_headers()
+                )
+            rate_limited = _is_rate_limited(response)
+            if attempt < Config.GMAIL_MAX_RETRIES and (rate_limited or response.status_code in RETRYABLE_STATUSES):
+                delay = backoff_delay(attempt, response.headers.get('retry-after'))
+                self.limiter.record_retry(rate_limited=rate_limited, pause=delay if rate_limited else None)
+                self.logger.warning(
+                    f"{quota_method} failed with HTTP {response.status_code}; retry {attempt + 1} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            response.raise_for_status()
+            return response.json() if response.content else {}
+
+    # ── History & listing ───────────────────────────────────────
+
+    async def get_current_history_id(self):
+        """Get current historyId from Gmail profile."""
+        try:
+            profile = await self._request("users.getProfile", "GET", "/profile", params={"fields": PROFILE_FIELDS})
+            return profile.get('historyId')
+        except httpx.HTTPError as error:
+            self.logger.error(f"Error getting profile/historyId: {error}")
+            return None
+
+    async def fetch_changed_threads_since(self, history_id):
+        """
+        Thread IDs changed since history_id, or None when the history cursor
+        expired (404) or the listing failed.
+        """
+        changed_thread_ids = set()
+        params = {
+            "startHistoryId": history_id,
+            "historyTypes": ['messageAdded', 'labelAdded', 'labelRemoved'],
+            "fields": HISTORY_LIST_FIELDS,
+        }
+        try:
+            while True:
+                results = await self._request("history.list", "GET", "/history", params=params)
+                for record in results.get('history', []):
+                    for entry in (record.get('messagesAdded', [])
+                                  + record.get('labelsAdded', [])
+                                  + record.get('labelsRemoved', [])):
+                        tid = entry.get('message', {}).get('threadId')
+                        if tid:
+                            changed_thread_ids.add(tid)
+
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+                params["pageToken"] = page_token
+
+        except httpx.HTTPStatusError as error:
+            if error.response.status_code == 404:
+                self.logger.warning(f"History ID {history_id} expired (404). Full sweep needed.")
+                return None
+            self.logger.error(f"Error fetching history: {error}")
+            return None
+        except httpx.HTTPError as error:
+            self.logger.error(f"Error fetching history: {error}")
+            return None
+
+        return list(changed_thread_ids)
+
+    async def fetch_recent_threads(self, days_lookback=14, limit=None):
+        """Fetch thread summaries newer than X days."""
+        threads = []
+        params = {"q": f"newer_than:{days_lookback}d", "fields": THREAD_LIST_FIELDS}
+        try:
+            while True:
+                params["maxResults"] = THREAD_PAGE_SIZE if not limit else min(THREAD_PAGE_SIZE, limit - len(threads))
+                results = await self._request("threads.list", "GET", "/threads", params=params)
+                threads.extend(results.get('threads', []))
+
+                if limit and len(threads) >= limit:
+                    threads = threads[:limit]
+                    break
+
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+                params["pageToken"] = page_token
+
+        except httpx.HTTPError as error:
+            self.logger.error(f"An error occurred fetching threads: {error}")
+
+        return threads
+
+    # ── Threads ─────────────────────────────────────────────────
+
+    async def get_thread_details(self, thread_id, full=False):
+        """Get thread with messages (metadata only unless full=True)."""
+        try:
+            return await self._get_thread(thread_id, full=full)
+        except httpx.HTTPError as error:
+            self.logger.error(f"Error fetching thread {thread_id}: {error}")
+            return None
+
+    async def _get_thread(self, thread_id, full=False):
+        if full:
+            params = {"format": "full"}
+        else:
+            params = {
+                "format": "metadata",
+                "metadataHeaders": METADATA_HEADERS,
+                "fields": THREAD_METADATA_FIELDS,
+            }
+        return await self._request("threads.get", "GET", f"/threads/{thread_id}", params=params)
+
+    async def get_thread_details_batch(self, thread_ids, full=False):
+        """
+        Fetch many threads concurrently over the pooled connection.
+        Returns (results, errors) dicts keyed by thread ID, like GmailClient.
+        """
+        return await self._gather(thread_ids, lambda t_id: self._get_thread(t_id, full=full))
+
+    async def _get_message(self, message_id):
+        params = {
+            "format": "metadata",
+            "metadataHeaders": METADATA_HEADERS,
+            "fields": MESSAGE_METADATA_FIELDS,
+        }
+        return await self._request("messages.get", "GET", f"/messages/{message_id}", params=params)
+
+    async def get_message_details_batch(self, message_ids):
+        """Fetch many messages (metadata only) concurrently. Returns (results, errors)."""
+        return await self._gather(message_ids, self._get_message)
+
+    async def _gather(self, ids, fetch):
+        unique_ids = list(dict.fromkeys(ids))
+        outcomes = await asyncio.gather(
+            *(fetch(item_id) for item_id in unique_ids),
+            return_exceptions=True
+        )
+        results = {}
+        errors = {}
+        for item_id, outcome in zip(unique_ids, outcomes):
+            if isinstance(outcome, Exception):
+                errors[item_id] = str(outcome)
+            else:
+                results[item_id] = outcome
+        return results, errors
@@ -23,21 +23,89 @@ class Config:
 
     # App Config
     DAYS_LOOKBACK = int(os.getenv("DAYS_LOOKBACK", 14))
+    LABEL_CACHE_TTL_HOURS = int(os.getenv("LABEL_CACHE_TTL_HOURS", 24))  # persisted label map lifetime
+    GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", 50))  # threads per batch request (max 100)
+    BATCH_LABEL_APPLY = os.getenv("BATCH_LABEL_APPLY", "true").lower() == "true"  # group label writes via batchModify
+
+    # Gmail quota pacing and retries
+    GMAIL_QUOTA_UNITS_PER_SECOND = int(os.getenv("GMAIL_QUOTA_UNITS_PER_SECOND", 250))
+    GMAIL_MAX_RETRIES = int(os.getenv("GMAIL_MAX_RETRIES", 5))
+
+    # Gmail HTTP transport: one pooled keep-alive session shared by all threads (false = httplib2 per thread)
+    GMAIL_POOLED_HTTP = os.getenv("GMAIL_POOLED_HTTP", "true").lower() == "true"
+    GMAIL_HTTP_POOL_SIZE = int(os.getenv("GMAIL_HTTP_POOL_SIZE", 10))
+
+    # Concurrency (1 worker = serial processing)
+    LABELER_WORKERS = int(os.getenv("LABELER_WORKERS", 1))
+    GMAIL_MAX_INFLIGHT = int(os.getenv("GMAIL_MAX_INFLIGHT", 4))
+    GEMINI_MAX_INFLIGHT = int(os.getenv("GEMINI_MAX_INFLIGHT", 4))
+    SWEEP_CHECKPOINT_EVERY = int(os.getenv("SWEEP_CHECKPOINT_EVERY", 100))  # threads between full-sweep checkpoints
+
+    # Multi-thread Gemini prompts: up to N threads share one system prompt (1 = one request per thread)
+    GEMINI_BATCH_THREADS = int(os.getenv("GEMINI_BATCH_THREADS", 10))
+    GEMINI_BATCH_MAX_PROMPT_TOKENS = int(os.getenv("GEMINI_BATCH_MAX_PROMPT_TOKENS", 8000))  # estimated, per request
+
+    # Full-sweep query pushdown: let Gmail drop threads we never need to re-check
+    SWEEP_SERVER_FILTER = os.getenv("SWEEP_SERVER_FILTER", "false").lower() == "true"
+    SWEEP_EXCLUDE_LABELS = [l.strip() for l in os.getenv("SWEEP_EXCLUDE_LABELS", "STATUS/Closed").split(",") if l.strip()]
+    SWEEP_EXCLUDE_CATEGORIES = [c.strip() for c in os.getenv("SWEEP_EXCLUDE_CATEGORIES", "").split(",") if c.strip()]
+    SWEEP_EXTRA_QUERY = os.getenv("SWEEP_EXTRA_QUERY", "")  # appended verbatim, e.g. "-from:noreply@shop.example"
+
+    # Historical backfill (--mode backfill): own budgets so it never starves incremental runs
+    BACKFILL_SINCE = os.getenv("BACKFILL_SINCE", "2004-04-01")
+    BACKFILL_SHARD_MAX_THREADS = int(os.getenv("BACKFILL_SHARD_MAX_THREADS", 500))  # split date shards above this
+    BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", 4))  # shards processed in parallel
+    BACKFILL_QUOTA_UNITS_PER_SECOND = int(os.getenv("BACKFILL_QUOTA_UNITS_PER_SECOND", 100))  # of Gmail's 250/user
+    BACKFILL_GEMINI_MAX_INFLIGHT = int(os.getenv("BACKFILL_GEMINI_MAX_INFLIGHT", 2))
+    BACKFILL_MAX_COST_USD = float(os.getenv("BACKFILL_MAX_COST_USD", 5.0))  # per run; re-run to continue
+
+    # asyncio Gmail client (httpx connection pool) for thread fetches
+    GMAIL_ASYNC = os.getenv("GMAIL_ASYNC", "false").lower() == "true"
+    GMAIL_ASYNC_MAX_CONNECTIONS = int(os.getenv("GMAIL_ASYNC_MAX_CONNECTIONS", 20))
+    GMAIL_ASYNC_MAX_INFLIGHT = int(os.getenv("GMAIL_ASYNC_MAX_INFLIGHT", 50))
     
     # Autonomous Runner Config
     INCREMENTAL_INTERVAL_MINUTES = int(os.getenv("INCREMENTAL_INTERVAL_MINUTES", 5))
     FULL_SWEEP_HOUR = int(os.getenv("FULL_SWEEP_HOUR", 3))  # 03:00 daily
+    # Scheduler HTTP server (health check, metrics, push receiver)
+    HTTP_HOST = os.getenv("HTTP_HOST", "localhost")
+    HTTP_PORT = int(os.getenv("HTTP_PORT", 3003))
+
+    # Push mode: users.watch → Pub/Sub push → POST {PUSH_PATH}
+    PUSH_ENABLED = os.getenv("PUSH_ENABLED", "false").lower() == "true"
+    PUBSUB_TOPIC = os.getenv("PUBSUB_TOPIC")  # projects/<project>/topics/<topic>
+    PUSH_PATH = os.getenv("PUSH_PATH", "/gmail/push")
+    PUSH_WEBHOOK_TOKEN = os.getenv("PUSH_WEBHOOK_TOKEN")  # expected ?token= on push requests
+    PUSH_DEBOUNCE_SECONDS = float(os.getenv("PUSH_DEBOUNCE_SECONDS", 5))
+    PUSH_MAX_DELAY_SECONDS = float(os.getenv("PUSH_MAX_DELAY_SECONDS", 30))  # a burst fires at the latest after this
+    PUSH_SAFETY_POLL_MINUTES = int(os.getenv("PUSH_SAFETY_POLL_MINUTES", 60))  # polling fallback in push mode
+    WATCH_RENEW_HOURS = int(os.getenv("WATCH_RENEW_HOURS", 24))  # watches expire after 7 days
+
+    # Draft outbox consumer API: POST /outbox/claim and /outbox/ack (disabled while no token is set)
+    OUTBOX_TOKEN = os.getenv("OUTBOX_TOKEN")  # expected ?token= on outbox requests
+    OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", 300))  # unacked claims are handed out again after this
+
     STATE_DB_PATH = os.getenv(
         "STATE_DB_PATH", 
         os.path.join(os.path.dirname(__file__), "data", "labeler_state.db")
     )
+
+    # Gmail filters compiled from thread_cache (--mode filters)
+    FILTER_MIN_THREADS = int(os.getenv("FILTER_MIN_THREADS", 20))  # threads a sender/subject needs before it gets a filter
+    FILTER_MIN_AGREEMENT = float(os.getenv("FILTER_MIN_AGREEMENT", 0.95))  # share of those threads that must carry a label
+    GMAIL_MANAGE_FILTERS = os.getenv("GMAIL_MANAGE_FILTERS", "false").lower() == "true"  # request gmail.settings.basic
+
+    # Multi-mailbox mode: JSON registry of inboxes (see mailboxes.py)
+    MAILBOXES_FILE = os.getenv("MAILBOXES_FILE")
+    MAILBOX_WORKERS = int(os.getenv("MAILBOX_WORKERS", 4))  # mailboxes processed concurrently
     
     @classmethod
     def validate(cls):
         missing = []
         if not cls.GOOGLE_CLIENT_ID: missing.append("GOOGLE_CLIENT_ID")
         if not cls.GOOGLE_CLIENT_SECRET: missing.append("GOOGLE_CLIENT_SECRET")
-        if not cls.GOOGLE_REFRESH_TOKEN: missing.append("GOOGLE_REFRESH_TOKEN")
+        # Registered mailboxes carry their own refresh tokens
+        if not cls.GOOGLE_REFRESH_TOKEN and not cls.MAILBOXES_FILE: missing.append("GOOGLE_REFRESH_TOKEN")
         if not cls.GEMINI_API_KEY: missing.append("GEMINI_API_KEY")
         
         if missing:
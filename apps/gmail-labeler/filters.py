@@ -0,0 +1,125 @@
+"""
+Native Gmail filters compiled from the labeler's own history.
+
+Many threads are deterministic: the same sender (optionally with the same
+subject wording) always ends up with the same taxonomy labels. Once
+thread_cache shows that consistently, a Gmail filter can apply those labels
+on arrival, and the labeler only has to recognise such threads to skip them.
+
+A filter is a dict {"from": address, "subject": words or None,
+"labels": [label names]} (plus "gmail_filter_id" once created).
+"""
+import re
+from collections import defaultdict
+from email.utils import parseaddr
+from config import Config
+
+# Decisions that need a human or the draft agent are never delegated to a filter
+_NEVER_FILTER = {"ACTION/Prepare-reply", "ACTION/Escalate"}
+# A filter stands in for a whole classification, so it must set one label of each
+REQUIRED_CATEGORIES = ("STATUS", "TYPE", "ACTION", "PRIORITY")
+_REPLY_PREFIX = re.compile(r"^\s*((re|fw|fwd|aw|odp)\s*:\s*)+", re.IGNORECASE)
+
+
+def sender_address(from_header):
+    """Lower-cased e-mail address of a From header, or None."""
+    address = parseaddr(from_header or "")[1].strip().lower()
+    return address or None
+
+
+def subject_pattern(subject):
+    """
+    The stable wording of a subject: reply prefixes and any word containing
+    a digit (order numbers, dates) dropped. 'Re: Nová objednávka č. 1042'
+    becomes 'Nová objednávka č.'.
+    """
+    words = _REPLY_PREFIX.sub("", subject or "").split()
+    return " ".join(word for word in words if not any(ch.isdigit() for ch in word))
+
+
+def _stable_labels(label_sets, min_agreement):
+    """Labels carried by at least min_agreement of the threads, in first-seen order."""
+    counts = defaultdict(int)
+    for labels in label_sets:
+        for label in dict.fromkeys(labels):
+            counts[label] += 1
+    return [label for label, count in counts.items() if count / len(label_sets) >= min_agreement]
+
+
+def is_complete(labels):
+    """True when labels hold exactly one label of each of REQUIRED_CATEGORIES."""
+    return all(
+        sum(1 for label in labels if label.startswith(f"{category}/")) == 1
+        for category in REQUIRED_CATEGORIES
+    )
+
+
+def _proposal(sender, subject, label_sets, min_agreement):
+    labels = _stable_labels(label_sets, min_agreement)
+    if not is_complete(labels) or _NEVER_FILTER & set(labels):
+        return None
+    return {"from": sender, "subject": subject, "labels": labels, "threads": len(label_sets)}
+
+
+def propose_filters(rows, min_threads=None, min_agreement=None):
+    """
+    Mine thread_cache rows ({sender, subject, applied_labels}) for filters.
+    A sender whose threads agree on a complete decision (see is_complete)
+    gets a from: filter; other senders are split by subject pattern and get
+    from:+subject: filters for the consistent groups. Groups smaller than
+    min_threads are ignored.
+    Returns proposals sorted by the number of threads they cover.
+    """
+    min_threads = min_threads or Config.FILTER_MIN_THREADS
+    min_agreement = min_agreement or Config.FILTER_MIN_AGREEMENT
+    by_sender = defaultdict(list)
+    for row in rows:
+        if row.get("sender") and row.get("applied_labels"):
+            by_sender[row["sender"]].append(row)
+
+    proposals = []
+    for sender, sender_rows in by_sender.items():
+        if len(sender_rows) < min_threads:
+            continue
+        proposal = _proposal(sender, None, [row["applied_labels"] for row in sender_rows], min_agreement)
+        if proposal:
+            proposals.append(proposal)
+            continue
+        by_subject = defaultdict(list)
+        for row in sender_rows:
+            by_subject[subject_pattern(row.get("subject"))].append(row["applied_labels"])
+        for subject, label_sets in by_subject.items():
+            if subject and len(label_sets) >= min_threads:
+                proposal = _proposal(sender, subject, label_sets, min_agreement)
+                if proposal:
+                    proposals.append(proposal)
+    return sorted(proposals, key=lambda p: p["threads"], reverse=True)
+
+
+def filter_criteria(gmail_filter):
+    """settings.filters criteria for a filter dict."""
+    criteria = {"from": gmail_filter["from"]}
+    if gmail_filter.get("subject"):
+        # Unquoted: Gmail matches every word, wherever the dropped numbers were
+        criteria["subject"] = gmail_filter["subject"]
+    return criteria
+
+
+def matching_filter(filters, from_header, subject, label_names):
+    """
+    The filter that evidently labeled a message: its sender and subject
+    wording match and every label it applies is on the message. None if
+    no filter accounts for the message.
+    """
+    sender = sender_address(from_header)
+    if not sender:
+        return None
+    subject_words = set((subject or "").lower().split())
+    for gmail_filter in filters:
+        if gmail_filter["from"] != sender:
+            continue
+        if not set((gmail_filter.get("subject") or "").lower().split()) <= subject_words:
+            continue
+        if set(gmail_filter["labels"]) <= set(label_names):
+            return gmail_filter
+    return None
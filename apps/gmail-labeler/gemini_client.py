@@ -3,7 +3,7 @@ from google import genai
 import json
 import logging
 from config import Config
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from typing import Optional
 from label_taxonomy import TAXONOMY, get_taxonomy_for_prompt
 
@@ -83,6 +83,23 @@ CRITICAL: DO use ACTION/Prepare-reply if a human customer replies to an automate
 """
 
 
+_BATCH_INSTRUCTIONS = """
+BATCH MODE:
+You will receive several email threads, each introduced by a line "=== THREAD <id> ===".
+Classify every thread independently of the others.
+A thread marked "(UPDATE)" was classified before: only its new message and its current labels are shown.
+Keep its current values unless the new message changes them.
+
+Return ONLY a JSON array with exactly one object per thread. Each object has a "thread_id" field
+(the id exactly as given) plus all fields of the schema above.
+"""
+
+
+def _estimate_tokens(text):
+    """Rough prompt-token estimate (about 4 characters per token)."""
+    return len(text) // 4 + 1
+
+
 class GeminiClient:
     def __init__(self):
         if not Config.GEMINI_API_KEY:
@@ -95,19 +112,44 @@ class GeminiClient:
         # Build prompts dynamically from taxonomy
         self.system_prompt = _build_system_prompt()
         self.update_system_prompt = _build_update_system_prompt()
+        self.batch_system_prompt = self.system_prompt + _BATCH_INSTRUCTIONS
 
-    def _parse_response(self, text):
-        """Parse and validate LLM JSON response."""
+    @staticmethod
+    def _load_json(text):
         # Clean markdown code blocks if present
         if text.startswith("```json"):
             text = text.replace("```json", "").replace("```", "")
         elif text.startswith("```"):
             text = text.replace("```", "")
+        return json.loads(text.strip())
 
-        data = json.loads(text.strip())
-        validated = ClassificationResult.model_validate(data)
+    def _parse_response(self, text):
+        """Parse and validate LLM JSON response."""
+        validated = ClassificationResult.model_validate(self._load_json(text))
         return validated.model_dump()
 
+    def _parse_batch_response(self, text, thread_ids):
+        """
+        Parse a batch response (a JSON array of objects keyed by thread_id).
+        Returns {thread_id: classification} for the entries that validate;
+        unknown, duplicate or invalid entries are left out.
+        """
+        data = self._load_json(text)
+        if not isinstance(data, list):
+            raise ValueError("batch response is not a JSON array")
+        results = {}
+        for entry in data:
+            if not isinstance(entry, dict):
+                continue
+            t_id = str(entry.get("thread_id"))
+            if t_id not in thread_ids or t_id in results:
+                continue
+            try:
+                results[t_id] = ClassificationResult.model_validate(entry).model_dump()
+            except ValidationError as e:
+                logger.warning(f"Invalid batch entry for thread {t_id}: {e}")
+        return results
+
     def classify_thread(self, subject, message_count, thread_text):
         """
         Full thread classification. Sends entire thread context to Gemini.
@@ -147,17 +189,19 @@ Return only JSON."""
             logger.error(f"Gemini API error: {e}")
             return None, None
 
-    def classify_thread_update(self, subject, new_message_text, current_labels):
+    def classify_thread_update(self, subject, new_message_text, current_labels, last_sender=None):
         """
         Minimal update classification. Only sends the new message + existing labels.
         Much more token-efficient than re-classifying the entire thread.
+        last_sender ("us"/"them") is who wrote the message before the new one, if known.
         """
         labels_str = ", ".join(current_labels)
+        sender_line = f"\nPrevious message was from: {last_sender}" if last_sender else ""
         
         user_prompt = f"""A new message arrived in this thread:
 
 Subject: {subject}
-Current labels: [{labels_str}]
+Current labels: [{labels_str}]{sender_line}
 
 --- NEW MESSAGE ---
 {new_message_text}
@@ -188,3 +232,136 @@ Should the classification change? Return the full JSON (updated or same)."""
         except Exception as e:
             logger.error(f"Gemini API error (update): {e}")
             return None, None
+
+    def classify_threads_batch(self, requests, max_prompt_tokens=None):
+        """
+        Classify several threads with as few requests as possible.
+
+        requests: dicts with a "thread_id" plus either the classify_thread
+        arguments (subject, message_count, thread_text) or, for an update,
+        the classify_thread_update ones (subject, new_message_text,
+        current_labels, last_sender). They are packed into prompts of at
+        most max_prompt_tokens (estimated; default
+        Config.GEMINI_BATCH_MAX_PROMPT_TOKENS), so the system prompt is sent
+        once per pack instead of once per thread. Entries missing from a
+        response or failing validation fall back to a per-thread call.
+
+        Returns {thread_id: (classification, tokens)}; classification is None
+        for threads that could not be classified. A pack's token usage is split
+        across its threads by their share of the prompt, and is kept even when
+        the reply fails to parse; a fallback call's usage is added on top.
+        """
+        budget = max_prompt_tokens or Config.GEMINI_BATCH_MAX_PROMPT_TOKENS
+        results = {}
+        for pack in self._pack_requests(requests, budget):
+            if len(pack) == 1:
+                request = pack[0][0]
+                results[request["thread_id"]] = self._classify_single(request)
+                continue
+
+            classified, shares = {}, {}
+            try:
+                response = self._generate_pack(pack)
+                # Billed whether or not the reply parses
+                shares = self._usage_shares(response, pack)
+                classified = self._parse_batch_response(response.text, set(shares))
+            except ValueError as e:  # includes json.JSONDecodeError
+                logger.error(f"Failed to parse JSON from Gemini (batch): {e}")
+            except Exception as e:
+                logger.error(f"Gemini API error (batch): {e}")
+
+            failed = [request for request, _ in pack if request["thread_id"] not in classified]
+            if failed:
+                logger.warning(f"Batch of {len(pack)} threads: {len(failed)} fall back to per-thread calls")
+            for request, _ in pack:
+                t_id = request["thread_id"]
+                tokens = shares.get(t_id)
+                classification = classified.get(t_id)
+                if classification is None:
+                    classification, single_tokens = self._classify_single(request)
+                    if single_tokens:
+                        tokens = {key: (tokens or {}).get(key, 0) + value for key, value in single_tokens.items()}
+                results[t_id] = (classification, tokens)
+        return results
+
+    @staticmethod
+    def _render_request(request):
+        """One thread's section of a batch prompt."""
+        if "current_labels" in request:
+            labels_str = ", ".join(request['current_labels'])
+            sender_line = f"\nPrevious message was from: {request['last_sender']}" if request.get("last_sender") else ""
+            return f"""=== THREAD {request['thread_id']} (UPDATE) ===
+Subject: {request['subject']}
+Current labels: [{labels_str}]{sender_line}
+--- NEW MESSAGE ---
+{request['new_message_text']}
+--- END ---
+"""
+        return f"""=== THREAD {request['thread_id']} ===
+Subject: {request['subject']}
+Number of messages: {request['message_count']}
+--- THREAD START ---
+{request['thread_text']}
+--- THREAD END ---
+"""
+
+    def _pack_requests(self, requests, budget):
+        """Group requests into packs of (request, rendered section) within the token budget."""
+        packs, current, size = [], [], 0
+        for request in requests:
+            section = self._render_request(request)
+            cost = _estimate_tokens(section)
+            if current and size + cost > budget:
+                packs.append(current)
+                current, size = [], 0
+            current.append((request, section))
+            size += cost
+        if current:
+            packs.append(current)
+        return packs
+
+    def _generate_pack(self, pack):
+        """Send one batch request for a pack and return the raw response."""
+        user_prompt = (
+            f"Classify the following {len(pack)} email threads:\n\n"
+            + "\n".join(section for _, section in pack)
+            + "\nReturn only the JSON array."
+        )
+        return self.client.models.generate_content(
+            model=self.model_name,
+            contents=user_prompt,
+            config={
+                "system_instruction": self.batch_system_prompt,
+            }
+        )
+
+    @staticmethod
+    def _usage_shares(response, pack):
+        """{thread_id: tokens}: a batch response's usage split by each thread's share of the prompt."""
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = usage.prompt_token_count if usage else 0
+        completion_tokens = usage.candidates_token_count if usage else 0
+        thread_ids = [request["thread_id"] for request, _ in pack]
+        weights = [_estimate_tokens(section) for _, section in pack]
+        prompt_shares = _split(prompt_tokens, weights)
+        completion_shares = _split(completion_tokens, [1] * len(pack))
+        return {
+            t_id: {"prompt_tokens": prompt_share, "completion_tokens": completion_share}
+            for t_id, prompt_share, completion_share in zip(thread_ids, prompt_shares, completion_shares)
+        }
+
+    def _classify_single(self, request):
+        if "current_labels" in request:
+            return self.classify_thread_update(
+                request["subject"], request["new_message_text"], request["current_labels"],
+                last_sender=request.get("last_sender")
+            )
+        return self.classify_thread(request["subject"], request["message_count"], request["thread_text"])
+
+
+def _split(total, weights):
+    """Split an integer total proportionally to weights; the shares add up to total."""
+    total_weight = sum(weights)
+    shares = [total * weight // total_weight for weight in weights]
+    shares[-1] += total - sum(shares)
+    return shares
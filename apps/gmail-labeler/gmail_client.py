@@ -1,36 +1,244 @@
 
+from google.auth.exceptions import TransportError
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from datetime import datetime, timedelta
+import json
 import logging
+import threading
+import time
+import google_auth_httplib2
+import httplib2
 from config import Config
+from http_transport import RequestsHttp
 from label_taxonomy import get_full_label_list
+from rate_limiter import RATE_LIMIT_REASONS, RETRYABLE_STATUSES, backoff_delay, get_default_limiter
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
+# Creating Gmail filters (Config.GMAIL_MANAGE_FILTERS); the refresh token must have been granted it
+FILTER_SCOPE = 'https://www.googleapis.com/auth/gmail.settings.basic'
+
+# Gmail rejects batch requests with more than 100 inner calls
+BATCH_LIMIT = 100
+
+# threads.list page size (Gmail's maximum)
+THREAD_PAGE_SIZE = 500
+
+# users.messages.batchModify accepts at most 1000 message IDs per call
+BATCH_MODIFY_LIMIT = 1000
+
+# Headers the labeler reads; metadata fetches return only these
+METADATA_HEADERS = ['From', 'Date', 'Subject']
+
+# Partial-response masks — request only the fields we actually read
+PROFILE_FIELDS = 'historyId'
+LABEL_LIST_FIELDS = 'labels(id,name)'
+THREAD_LIST_FIELDS = 'threads(id,historyId),nextPageToken'
+HISTORY_LIST_FIELDS = (
+    'history(messagesAdded/message(id,threadId),'
+    'labelsAdded(labelIds,message(id,threadId)),'
+    'labelsRemoved(labelIds,message(id,threadId))),'
+    'nextPageToken'
+)
+THREAD_METADATA_FIELDS = 'id,historyId,messages(id,threadId,labelIds,snippet,payload/headers)'
+MESSAGE_METADATA_FIELDS = 'id,threadId,historyId,labelIds,snippet,payload/headers'
+
+def _error_reason(error):
+    """First 'reason' from a Gmail HttpError body (e.g. rateLimitExceeded), or None."""
+    try:
+        body = json.loads(error.content.decode('utf-8') if isinstance(error.content, bytes) else error.content)
+        return body['error']['errors'][0].get('reason')
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+def _is_rate_limited(error):
+    status = getattr(error.resp, 'status', None)
+    return status == 429 or (status == 403 and _error_reason(error) in RATE_LIMIT_REASONS)
+
+
+def _is_retryable(error):
+    return _is_rate_limited(error) or getattr(error.resp, 'status', None) in RETRYABLE_STATUSES
+
+
+# Connection-level failures (reset, timeout, SSL, token refresh): retried like a 5xx
+TRANSPORT_ERRORS = (OSError, httplib2.HttpLib2Error, TransportError)
+
+
+def _is_transient(error):
+    """A batch failure worth retrying: a retryable HttpError or a transport error."""
+    if isinstance(error, HttpError):
+        return _is_retryable(error)
+    return isinstance(error, TRANSPORT_ERRORS)
+
+
+def _retry_after(error):
+    try:
+        return error.resp.get('retry-after')
+    except AttributeError:
+        return None
+
+
+def label_query_name(label_name):
+    """Gmail search spelling of a label name: 'STATUS/Waiting-for-reply' -> 'STATUS-Waiting-for-reply'."""
+    return label_name.replace('/', '-').replace(' ', '-')
+
+
+def build_sweep_query(days_lookback, exclude_labels=(), exclude_categories=(), extra_query=None):
+    """
+    Gmail search query for a full sweep: the date window, minus threads that
+    carry any of exclude_labels or sit in one of exclude_categories
+    (e.g. 'promotions'), plus any extra user-supplied terms.
+    """
+    terms = [f"newer_than:{days_lookback}d"]
+    terms.extend(f"-label:{label_query_name(label)}" for label in exclude_labels)
+    terms.extend(f"-category:{category}" for category in exclude_categories)
+    if extra_query:
+        terms.append(extra_query.strip())
+    return " ".join(terms)
+
+
+def build_any_label_query(label_names):
+    """Gmail search query for threads carrying at least one of label_names."""
+    return "{" + " ".join(f"label:{label_query_name(label)}" for label in label_names) + "}"
+
+
+def build_range_query(after, before):
+    """Gmail search query for threads in [after, before) given as epoch seconds."""
+    return f"after:{int(after)} before:{int(before)}"
+
+
+def build_credentials(refresh_token=None):
+    """OAuth user credentials from the given (default: configured) refresh token."""
+    return Credentials(
+        None, # No access token initially
+        refresh_token=refresh_token or Config.GOOGLE_REFRESH_TOKEN,
+        token_uri="https://oauth2.googleapis.com/token",
+        client_id=Config.GOOGLE_CLIENT_ID,
+        client_secret=Config.GOOGLE_CLIENT_SECRET,
+        scopes=SCOPES + [FILTER_SCOPE] if Config.GMAIL_MANAGE_FILTERS else SCOPES
+    )
 
 class GmailClient:
-    def __init__(self):
-        self.creds = Credentials(
-            None, # No access token initially
-            refresh_token=Config.GOOGLE_REFRESH_TOKEN,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=Config.GOOGLE_CLIENT_ID,
-            client_secret=Config.GOOGLE_CLIENT_SECRET,
-            scopes=SCOPES
-        )
-        self.service = build('gmail', 'v1', credentials=self.creds)
+    def __init__(self, limiter=None, state=None, refresh_token=None, credentials=None, api_endpoint=None):
+        self.creds = credentials or build_credentials(refresh_token)
+        self.limiter = limiter or get_default_limiter()
+        self.state = state  # optional StateDB for the persisted label map
+        self._client_options = {"api_endpoint": api_endpoint} if api_endpoint else None
+        self.http = None
+        self._shared_service = None
+        self._local = threading.local()
+        if Config.GMAIL_POOLED_HTTP:
+            # One thread-safe keep-alive pool shared by every worker thread
+            self.http = RequestsHttp(self.creds)
+            self._shared_service = self._build_service(http=self.http)
+        else:
+            # httplib2 is not thread-safe: every thread gets its own service/connection
+            self._local.service = self._build_service(credentials=self.creds)
         self.logger = logging.getLogger("GmailClient")
         self._label_map_cache = {}
+        self._label_map_loaded_at = 0.0
+        self._label_map_validated = False  # True once the in-memory map came from labels.list
         self._managed_label_ids = None
 
+    @property
+    def service(self):
+        """Gmail API service: the shared pooled one, or one bound to the calling thread."""
+        if self._shared_service is not None:
+            return self._shared_service
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            http = google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http())
+            service = self._build_service(http=http)
+            self._local.service = service
+        return service
+
+    def _build_service(self, **kwargs):
+        # The discovery document bundled with googleapiclient: no fetch, no disk cache
+        return build(
+            'gmail', 'v1', static_discovery=True, cache_discovery=False,
+            client_options=self._client_options, **kwargs
+        )
+
+    def close(self):
+        """Close pooled connections, if any."""
+        if self.http is not None:
+            self.http.close()
+
+    def _execute(self, request, method):
+        """
+        Execute a request within the quota budget, retrying rate-limit and
+        transient errors with jittered exponential backoff (Retry-After wins).
+        Raises the last HttpError once retries are exhausted.
+        """
+        attempt = 0
+        while True:
+            self.limiter.acquire(method)
+            try:
+                return request.execute()
+            except HttpError as error:
+                if attempt >= Config.GMAIL_MAX_RETRIES or not _is_retryable(error):
+                    raise
+                delay = self._backoff(error, attempt, method)
+                time.sleep(delay)
+                attempt += 1
+
+    def _backoff(self, error, attempt, method):
+        """Record a retry on the limiter and return the delay before it."""
+        rate_limited = isinstance(error, HttpError) and _is_rate_limited(error)
+        delay = backoff_delay(attempt, _retry_after(error))
+        self.limiter.record_retry(rate_limited=rate_limited, pause=delay if rate_limited else None)
+        failure = f"HTTP {error.resp.status}" if isinstance(error, HttpError) else repr(error)
+        self.logger.warning(f"{method} failed with {failure}; retry {attempt + 1} in {delay:.1f}s")
+        return delay
+
     def get_label_map(self):
-        """Returns Name->ID map, cached."""
+        """
+        Returns Name->ID map, cached in memory and (when a StateDB is
+        attached) persisted across runs for Config.LABEL_CACHE_TTL_HOURS.
+        A long-lived client drops its in-memory copy after the same TTL.
+        """
+        if self._label_map_cache and time.monotonic() - self._label_map_loaded_at > Config.LABEL_CACHE_TTL_HOURS * 3600:
+            self._label_map_cache = {}
+            self._managed_label_ids = None
+        if not self._label_map_cache and self.state is not None:
+            self._label_map_cache = self.state.get_label_map(max_age_hours=Config.LABEL_CACHE_TTL_HOURS) or {}
+            self._label_map_loaded_at = time.monotonic()
+            self._label_map_validated = False
         if not self._label_map_cache:
-            results = self.service.users().labels().list(userId='me').execute()
-            self._label_map_cache = {l['name']: l['id'] for l in results.get('labels', [])}
+            self.refresh_label_map()
         return self._label_map_cache
 
+    def refresh_label_map(self):
+        """Re-list labels from Gmail and update both caches."""
+        results = self._execute(
+            self.service.users().labels().list(userId='me', fields=LABEL_LIST_FIELDS), 'labels.list'
+        )
+        self._set_label_map({l['name']: l['id'] for l in results.get('labels', [])})
+        self._label_map_validated = True
+        return self._label_map_cache
+
+    def _set_label_map(self, label_map):
+        self._label_map_cache = label_map
+        self._label_map_loaded_at = time.monotonic()
+        self._managed_label_ids = None
+        if self.state is not None:
+            self.state.set_label_map(label_map)
+
+    def invalidate_label_cache(self):
+        """Drop cached label IDs, e.g. after Gmail rejected one as invalid."""
+        self._label_map_cache = {}
+        self._managed_label_ids = None
+        if self.state is not None:
+            self.state.set_label_map({})
+
+    def handle_label_write_error(self, error):
+        """A 400 on a label write usually means a cached label ID no longer exists."""
+        if getattr(error.resp, 'status', None) == 400:
+            self.logger.warning("Label write rejected (400); invalidating label cache.")
+            self.invalidate_label_cache()
+
     def get_managed_label_ids(self):
         """Returns set of label IDs that belong to our taxonomy."""
         if self._managed_label_ids is None:
@@ -44,39 +252,101 @@ class GmailClient:
     def get_current_history_id(self):
         """Get current historyId from Gmail profile."""
         try:
-            profile = self.service.users().getProfile(userId='me').execute()
+            profile = self._execute(
+                self.service.users().getProfile(userId='me', fields=PROFILE_FIELDS), 'users.getProfile'
+            )
             return profile.get('historyId')
         except HttpError as error:
             self.logger.error(f"Error getting profile/historyId: {error}")
             return None
 
+    def watch(self, topic_name):
+        """
+        Register (or renew) push notifications for the mailbox to a Pub/Sub topic.
+        Returns {'historyId', 'expiration'} or None on error.
+        """
+        try:
+            return self._execute(
+                self.service.users().watch(userId='me', body={'topicName': topic_name}), 'watch'
+            )
+        except HttpError as error:
+            self.logger.error(f"Error registering watch on {topic_name}: {error}")
+            return None
+
+    def list_filters(self):
+        """Existing Gmail filters (settings.filters.list), or None on error."""
+        try:
+            result = self._execute(self.service.users().settings().filters().list(userId='me'), 'settings.filters.list')
+            return result.get('filter', [])
+        except HttpError as error:
+            self.logger.error(f"Error listing filters: {error}")
+            return None
+
+    def create_filter(self, criteria, add_labels):
+        """
+        Create a Gmail filter adding the named labels to matching mail. Needs
+        Config.GMAIL_MANAGE_FILTERS (FILTER_SCOPE). Returns the filter or None.
+        """
+        add_ids, _ = self.resolve_label_ids(add_labels, [])
+        body = {'criteria': criteria, 'action': {'addLabelIds': add_ids}}
+        try:
+            return self._execute(
+                self.service.users().settings().filters().create(userId='me', body=body), 'settings.filters.create'
+            )
+        except HttpError as error:
+            self.logger.error(f"Error creating filter {criteria}: {error}")
+            return None
+
     def fetch_changed_threads_since(self, history_id):
         """
         Use Gmail history.list to find threads that changed since history_id.
         Returns a list of unique thread IDs.
         """
-        changed_thread_ids = set()
+        changes = self.fetch_history_changes(history_id)
+        return None if changes is None else list(changes)
+
+    def fetch_history_changes(self, history_id):
+        """
+        Use Gmail history.list to collect per-thread changes since history_id.
+        Returns {thread_id: {"messages_added": [message IDs],
+        "labels_added": {label IDs}, "labels_removed": {label IDs},
+        "label_records": int}}, or None if the history cursor expired.
+        """
+        changes = {}
+
+        def _thread_change(tid):
+            return changes.setdefault(tid, {
+                "messages_added": [],
+                "labels_added": set(),
+                "labels_removed": set(),
+                "label_records": 0,
+            })
+
         try:
             page_token = None
             while True:
-                results = self.service.users().history().list(
+                results = self._execute(self.service.users().history().list(
                     userId='me',
                     startHistoryId=history_id,
                     historyTypes=['messageAdded', 'labelAdded', 'labelRemoved'],
-                    pageToken=page_token
-                ).execute()
+                    pageToken=page_token,
+                    fields=HISTORY_LIST_FIELDS
+                ), 'history.list')
 
                 for record in results.get('history', []):
                     # messagesAdded contains new messages with threadId
                     for msg_added in record.get('messagesAdded', []):
-                        tid = msg_added.get('message', {}).get('threadId')
-                        if tid:
-                            changed_thread_ids.add(tid)
-                    # Also check labelsAdded/labelsRemoved for thread changes
-                    for msg_changed in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
-                        tid = msg_changed.get('message', {}).get('threadId')
-                        if tid:
-                            changed_thread_ids.add(tid)
+                        message = msg_added.get('message', {})
+                        if message.get('threadId'):
+                            _thread_change(message['threadId'])["messages_added"].append(message.get('id'))
+                    # labelsAdded/labelsRemoved carry the label deltas per message
+                    for key, delta in (('labelsAdded', 'labels_added'), ('labelsRemoved', 'labels_removed')):
+                        for msg_changed in record.get(key, []):
+                            tid = msg_changed.get('message', {}).get('threadId')
+                            if tid:
+                                change = _thread_change(tid)
+                                change[delta].update(msg_changed.get('labelIds', []))
+                                change["label_records"] += 1
 
                 page_token = results.get('nextPageToken')
                 if not page_token:
@@ -90,18 +360,23 @@ class GmailClient:
             self.logger.error(f"Error fetching history: {error}")
             return None
 
-        return list(changed_thread_ids)
+        return changes
 
     def ensure_labels_exist(self, taxonomy_labels):
         """
         Idempotently create labels from the taxonomy list.
         taxonomy_labels: list of strings like "STATUS/New"
+        Uses the cached label map; Gmail is only re-listed when a taxonomy
+        label is missing from it, and created labels are added to the cache.
         """
         try:
-            results = self.service.users().labels().list(userId='me').execute()
-            existing_labels = {l['name']: l['id'] for l in results.get('labels', [])}
+            existing_labels = self.get_label_map()
+            missing = any(name not in existing_labels for name in taxonomy_labels)
+            if missing and not self._label_map_validated:
+                # Validate the persisted map against Gmail before creating anything
+                existing_labels = self.refresh_label_map()
             
-            created_count = 0
+            created = {}
             for label_name in taxonomy_labels:
                 if label_name not in existing_labels:
                     try:
@@ -110,17 +385,17 @@ class GmailClient:
                             'labelListVisibility': 'labelShow',
                             'messageListVisibility': 'show'
                         }
-                        self.service.users().labels().create(userId='me', body=label_object).execute()
-                        created_count += 1
+                        label = self._execute(
+                            self.service.users().labels().create(userId='me', body=label_object), 'labels.create'
+                        )
+                        created[label_name] = label['id']
                         print(f"Created label: {label_name}")
                     except HttpError as error:
                         print(f"Error creating label {label_name}: {error}")
                         
-            if created_count > 0:
-                print(f"✅ Initialized {created_count} new labels.")
-                # Invalidate cache since we created new labels
-                self._label_map_cache = {}
-                self._managed_label_ids = None
+            if created:
+                print(f"✅ Initialized {len(created)} new labels.")
+                self._set_label_map({**existing_labels, **created})
                 
         except HttpError as error:
             print(f"An error occurred listing labels: {error}")
@@ -129,49 +404,168 @@ class GmailClient:
         """
         Fetch threads newer than X days.
         """
-        query = f"newer_than:{days_lookback}d"
-        
-        threads = []
+        return list(self.iter_recent_threads(days_lookback=days_lookback, limit=limit))
+
+    def estimate_thread_count(self, query):
+        """Gmail's resultSizeEstimate for a threads.list query (one cheap call), or None on error."""
         try:
-            page_token = None
-            while True:
-                results = self.service.users().threads().list(
-                    userId='me', 
-                    q=query, 
-                    pageToken=page_token
-                ).execute()
-                
-                batch = results.get('threads', [])
-                threads.extend(batch)
-                
-                if limit and len(threads) >= limit:
-                    threads = threads[:limit]
-                    break
-                    
-                page_token = results.get('nextPageToken')
-                if not page_token:
-                    break
-                    
+            results = self._execute(self.service.users().threads().list(
+                userId='me', q=query, maxResults=1, fields='resultSizeEstimate'
+            ), 'threads.list')
+            return results.get('resultSizeEstimate', 0)
         except HttpError as error:
-            self.logger.error(f"An error occurred fetching threads: {error}")
+            self.logger.error(f"Error estimating thread count for '{query}': {error}")
+            return None
+
+    def iter_recent_threads(self, days_lookback=14, limit=None, query=None):
+        """
+        Yield thread summaries (id, historyId) newer than X days (or matching
+        `query`, if given) as each page arrives. Pages ask for up to
+        THREAD_PAGE_SIZE threads, but never more than `limit` still needs.
+        A page that still fails after retries raises, so callers can tell a
+        cut-short listing from a complete one.
+        """
+        query = query or f"newer_than:{days_lookback}d"
+        
+        yielded = 0
+        page_token = None
+        while True:
+            page_size = THREAD_PAGE_SIZE if not limit else min(THREAD_PAGE_SIZE, limit - yielded)
+            results = self._execute(self.service.users().threads().list(
+                userId='me', 
+                q=query, 
+                maxResults=page_size,
+                pageToken=page_token,
+                fields=THREAD_LIST_FIELDS
+            ), 'threads.list')
             
-        return threads
+            for thread in results.get('threads', []):
+                yield thread
+                yielded += 1
+                if limit and yielded >= limit:
+                    return
+                
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return
+
+    def _thread_get_request(self, thread_id, full=False):
+        """
+        Build a threads.get request. The default metadata profile returns only
+        labelIds, snippet and METADATA_HEADERS; full=True downloads every MIME
+        part (bodies, attachments) for callers that need them.
+        """
+        if full:
+            return self.service.users().threads().get(userId='me', id=thread_id, format='full')
+        return self.service.users().threads().get(
+            userId='me',
+            id=thread_id,
+            format='metadata',
+            metadataHeaders=METADATA_HEADERS,
+            fields=THREAD_METADATA_FIELDS
+        )
 
-    def get_thread_details(self, thread_id):
-        """Get full thread with messages."""
+    def get_thread_details(self, thread_id, full=False):
+        """Get thread with messages (metadata only unless full=True)."""
         try:
-            thread = self.service.users().threads().get(userId='me', id=thread_id, format='full').execute()
+            thread = self._execute(self._thread_get_request(thread_id, full=full), 'threads.get')
             return thread
         except HttpError as error:
             self.logger.error(f"Error fetching thread {thread_id}: {error}")
             return None
 
-    def modify_thread_labels(self, thread_id, add_labels, remove_labels):
-        """Add and remove labels (by Name)."""
-        if not add_labels and not remove_labels:
-            return
+    def _message_get_request(self, message_id):
+        """Build a metadata-only messages.get request."""
+        return self.service.users().messages().get(
+            userId='me',
+            id=message_id,
+            format='metadata',
+            metadataHeaders=METADATA_HEADERS,
+            fields=MESSAGE_METADATA_FIELDS
+        )
+
+    def get_thread_details_batch(self, thread_ids, batch_size=None, full=False):
+        """
+        Fetch many threads through the Gmail batch endpoint.
+        Returns (results, errors): dicts keyed by thread ID, holding the thread
+        resource or the error message respectively. Inner calls that hit rate
+        limits or transient errors are retried in a later batch with backoff.
+        """
+        return self._execute_batch(
+            thread_ids, lambda t_id: self._thread_get_request(t_id, full=full), 'threads.get', batch_size
+        )
+
+    def get_message_details_batch(self, message_ids, batch_size=None):
+        """
+        Fetch individual messages (metadata only) through the Gmail batch
+        endpoint. Returns (results, errors) keyed by message ID, like
+        get_thread_details_batch.
+        """
+        return self._execute_batch(message_ids, self._message_get_request, 'messages.get', batch_size)
+
+    def _execute_batch(self, ids, build_request, method, batch_size=None):
+        """
+        Run build_request(id) for each unique ID in batches, retrying transient
+        failures, including a transport error that fails a whole chunk. IDs
+        still failing after the retries are returned in errors.
+        """
+        batch_size = min(batch_size or Config.GMAIL_BATCH_SIZE, BATCH_LIMIT)
+        pending = list(dict.fromkeys(ids))
+        results = {}
+        errors = {}
+        attempt = 0
+
+        while pending:
+            retry = {}
+            for start in range(0, len(pending), batch_size):
+                chunk = pending[start:start + batch_size]
+                chunk_errors = {}
+
+                def _callback(request_id, response, exception, chunk_errors=chunk_errors):
+                    if exception is not None:
+                        chunk_errors[request_id] = exception
+                    else:
+                        results[request_id] = response
 
+                batch = self.service.new_batch_http_request(callback=_callback)
+                for t_id in chunk:
+                    batch.add(build_request(t_id), request_id=t_id)
+                self.limiter.acquire(method, count=len(chunk))
+                try:
+                    batch.execute()
+                except (HttpError, *TRANSPORT_ERRORS) as error:
+                    self.logger.error(f"Error executing {method} batch: {error!r}")
+                    for t_id in chunk:
+                        if t_id not in results and t_id not in chunk_errors:
+                            chunk_errors[t_id] = error
+
+                for t_id, error in chunk_errors.items():
+                    if attempt < Config.GMAIL_MAX_RETRIES and _is_transient(error):
+                        retry[t_id] = error
+                    else:
+                        errors[t_id] = str(error) or repr(error)
+
+            if not retry:
+                break
+            # One backoff per round; a rate-limited item sets the pace if there is one
+            error = next(
+                (e for e in retry.values() if isinstance(e, HttpError) and _is_rate_limited(e)),
+                next(iter(retry.values()))
+            )
+            time.sleep(self._backoff(error, attempt, method))
+            pending = list(retry)
+            attempt += 1
+
+        return results, errors
+
+    def resolve_label_ids(self, add_labels, remove_labels):
+        """Map label names to IDs. Returns (add_ids, remove_ids); unknown names are skipped."""
         label_map = self.get_label_map()
+        taxonomy_names = set(get_full_label_list())
+        missing = any(name not in label_map and name in taxonomy_names for name in list(add_labels) + list(remove_labels))
+        if missing and not self._label_map_validated:
+            # Lookup miss on a taxonomy label: the cached map may be stale, re-list once
+            label_map = self.refresh_label_map()
         
         add_ids = []
         for name in add_labels:
@@ -186,9 +580,36 @@ class GmailClient:
                 remove_ids.append(label_map[name])
             else:
                 self.logger.warning(f"Label '{name}' to remove not found in map.")
-                
+
+        return add_ids, remove_ids
+
+    def batch_modify_messages(self, message_ids, add_ids, remove_ids):
+        """
+        Apply one add/remove label-ID set to up to BATCH_MODIFY_LIMIT messages
+        via users.messages.batchModify. Raises HttpError on failure.
+        """
+        if len(message_ids) > BATCH_MODIFY_LIMIT:
+            raise ValueError(f"batchModify accepts at most {BATCH_MODIFY_LIMIT} message IDs")
+        body = {
+            'ids': list(message_ids),
+            'addLabelIds': list(add_ids),
+            'removeLabelIds': list(remove_ids)
+        }
+        self._execute(self.service.users().messages().batchModify(userId='me', body=body), 'messages.batchModify')
+
+    def modify_thread_labels(self, thread_id, add_labels, remove_labels):
+        """
+        Add and remove labels (by Name).
+        Returns the modified thread resource (id, historyId), or None if nothing was sent.
+        Raises the HttpError once retries are exhausted, so callers never take
+        a failed write for an applied one.
+        """
+        if not add_labels and not remove_labels:
+            return None
+
+        add_ids, remove_ids = self.resolve_label_ids(add_labels, remove_labels)
         if not add_ids and not remove_ids:
-            return
+            return None
 
         body = {
             'addLabelIds': add_ids,
@@ -196,7 +617,95 @@ class GmailClient:
         }
         
         try:
-            self.service.users().threads().modify(userId='me', id=thread_id, body=body).execute()
+            return self._execute(self.service.users().threads().modify(
+                userId='me', id=thread_id, body=body, fields='id,historyId'
+            ), 'threads.modify')
         except HttpError as error:
             self.logger.error(f"Error modifying labels for thread {thread_id}: {error}")
+            self.handle_label_write_error(error)
+            raise
+
+
+
+class LabelApplyQueue:
+    """
+    Deferred label application. Decisions are collected during a run, grouped
+    by identical (add_ids, remove_ids) sets and flushed with
+    users.messages.batchModify in chunks of BATCH_MODIFY_LIMIT message IDs.
+    """
+
+    def __init__(self, gmail):
+        self.gmail = gmail
+        self._groups = {}       # (add_ids, remove_ids) -> {thread_id: [message_ids]}
+        self._thread_keys = {}  # thread_id -> group key
+
+    def __len__(self):
+        return len(self._thread_keys)
+
+    def enqueue(self, thread_id, message_ids, add_labels, remove_labels):
+        """
+        Queue a thread's label change (by Name). Returns False when nothing
+        resolvable is left to apply, in which case nothing is queued.
+        """
+        add_ids, remove_ids = self.gmail.resolve_label_ids(add_labels, remove_labels)
+        if not add_ids and not remove_ids:
+            return False
+
+        # A later decision for the same thread replaces the earlier one
+        previous_key = self._thread_keys.pop(thread_id, None)
+        if previous_key is not None:
+            self._groups[previous_key].pop(thread_id, None)
+
+        key = (tuple(sorted(add_ids)), tuple(sorted(remove_ids)))
+        self._groups.setdefault(key, {})[thread_id] = list(message_ids)
+        self._thread_keys[thread_id] = key
+        return True
+
+    def flush(self, thread_ids=None):
+        """
+        Apply every queued group and empty the queue. With thread_ids, only
+        those threads are applied and dequeued; the rest stay queued.
+        Returns one report per group with the threads applied/failed,
+        the number of batchModify calls made and the last error, if any.
+        """
+        selected = None if thread_ids is None else set(thread_ids)
+        reports = []
+        for (add_ids, remove_ids), threads in self._groups.items():
+            if selected is not None:
+                threads = {t_id: m_ids for t_id, m_ids in threads.items() if t_id in selected}
+            if not threads:
+                continue
+            pairs = [(t_id, m_id) for t_id, m_ids in threads.items() for m_id in m_ids]
+            failed = set()
+            error = None
+            calls = 0
+            for start in range(0, len(pairs), BATCH_MODIFY_LIMIT):
+                chunk = pairs[start:start + BATCH_MODIFY_LIMIT]
+                calls += 1
+                try:
+                    self.gmail.batch_modify_messages([m_id for _, m_id in chunk], add_ids, remove_ids)
+                except HttpError as e:
+                    self.gmail.handle_label_write_error(e)
+                    error = str(e)
+                    failed.update(t_id for t_id, _ in chunk)
+                    self.gmail.logger.error(f"batchModify failed for {len(chunk)} messages: {e}")
+
+            reports.append({
+                "add_label_ids": list(add_ids),
+                "remove_label_ids": list(remove_ids),
+                "message_count": len(pairs),
+                "api_calls": calls,
+                "applied_threads": [t_id for t_id in threads if t_id not in failed],
+                "failed_threads": [t_id for t_id in threads if t_id in failed],
+                "error": error,
+            })
 
+        if selected is None:
+            self._groups = {}
+            self._thread_keys = {}
+        else:
+            for t_id in selected:
+                key = self._thread_keys.pop(t_id, None)
+                if key is not None:
+                    self._groups[key].pop(t_id, None)
+        return reports
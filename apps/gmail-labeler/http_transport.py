@@ -0,0 +1,44 @@
+"""
+Thread-safe pooled HTTP transport for googleapiclient.
+
+googleapiclient talks to an httplib2.Http, which is neither thread-safe
+nor pooled. RequestsHttp offers the same request() interface on top of an
+authorized requests session: urllib3 keeps a sized pool of keep-alive
+connections that any number of threads can share, so one Gmail service
+serves every worker thread without a TLS handshake per thread.
+"""
+import httplib2
+import requests
+from google.auth.transport.requests import AuthorizedSession
+from config import Config
+
+
+class RequestsHttp:
+    """httplib2.Http stand-in backed by an AuthorizedSession with a connection pool."""
+
+    def __init__(self, credentials, pool_size=None, timeout=60):
+        pool_size = pool_size or Config.GMAIL_HTTP_POOL_SIZE
+        self.credentials = None  # auth is handled by the session, not by googleapiclient
+        self.timeout = timeout
+        self.session = AuthorizedSession(credentials)
+        # pool_block: threads wait for a free connection instead of opening throwaway ones
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=0
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        """Perform a request; returns (httplib2.Response, content) like httplib2.Http.request."""
+        response = self.session.request(
+            method, uri, data=body, headers=headers,
+            allow_redirects=redirections > 0, timeout=self.timeout
+        )
+        info = {key.lower(): value for key, value in response.headers.items()}
+        info["status"] = str(response.status_code)
+        result = httplib2.Response(info)
+        result.reason = response.reason
+        return result, response.content
+
+    def close(self):
+        self.session.close()
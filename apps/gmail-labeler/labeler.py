@@ -1,26 +1,161 @@
 
+import asyncio
 import logging
-from gmail_client import GmailClient
+import threading
+import time
+import uuid
+from collections import Counter
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from googleapiclient.errors import HttpError
+from gmail_client import GmailClient, LabelApplyQueue, build_any_label_query, build_range_query, build_sweep_query
+from async_gmail_client import AsyncGmailClient
+from rate_limiter import get_default_limiter
 from gemini_client import GeminiClient
+from filters import filter_criteria, is_complete, matching_filter, propose_filters, sender_address
 from logger import StructuredLogger
 from label_taxonomy import TAXONOMY, get_full_label_list
 from state import StateDB
 from config import Config
-from datetime import datetime
+from datetime import date, datetime, time as dt_time, timedelta
 
 logger = logging.getLogger("Labeler")
 
+# Sentinel: thread state was not looked up by the caller (None means "not cached")
+_STATE_NOT_LOADED = object()
+
+_DAY_SECONDS = 24 * 3600
+
+# Per-listing sweep counters: a resumed sweep reports its final part's, not a sum
+_SWEEP_LISTING_COUNTERS = ("threads_scanned", "sweep_resume_skips", "server_filtered_estimate")
+
+class LabelerClients:
+    """
+    The expensive, reusable part of a Labeler: state DB, Gmail client
+    (credentials with their cached access token, discovery, connection
+    pool) and Gemini client. Long-lived processes such as the scheduler
+    build one per mailbox and hand it to every Labeler they create, so a
+    job only pays for its own logger and counters.
+    """
+
+    def __init__(self, mailbox=None, gemini=None, limiter=None):
+        started = time.monotonic()
+        self.mailbox = mailbox
+        # One quota budget per mailbox, shared by every Gmail client in the process
+        self.limiter = limiter or (mailbox.limiter if mailbox else get_default_limiter())
+        self.state = StateDB(mailbox.state_db_path if mailbox else Config.STATE_DB_PATH)
+        self.gmail = GmailClient(
+            limiter=self.limiter, state=self.state,
+            refresh_token=mailbox.refresh_token if mailbox else None
+        )
+        self.gemini = gemini or GeminiClient()
+        # What a Labeler building its own clients would pay; a warm job saves about this much
+        self.setup_seconds = time.monotonic() - started
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.setup_saved_seconds = 0.0
+
+    def record_job(self, setup_seconds):
+        """Count a job that reused these clients; returns the setup time it saved."""
+        saved = max(0.0, self.setup_seconds - setup_seconds)
+        with self._lock:
+            self.jobs += 1
+            self.setup_saved_seconds += saved
+        return saved
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "setup_seconds": round(self.setup_seconds, 3),
+                "jobs": self.jobs,
+                "setup_saved_seconds": round(self.setup_saved_seconds, 3),
+            }
+
+    def close(self):
+        self.gmail.close()
+
+
 class Labeler:
-    def __init__(self, run_id=None, trigger="manual"):
-        self.gmail = GmailClient()
-        self.gemini = GeminiClient()
+    def __init__(self, run_id=None, trigger="manual", workers=None, mailbox=None, gemini=None, limiter=None,
+                 clients=None):
+        """
+        mailbox: a registered Mailbox (see mailboxes.py) to work on instead
+        of the configured one; it brings its own credentials, state DB and
+        quota budget. gemini: an existing GeminiClient to share between
+        labelers. limiter: a separate quota budget (e.g. for backfills).
+        clients: warm LabelerClients to reuse instead of building new ones
+        (mailbox, gemini and limiter then come from it).
+        """
+        started = time.monotonic()
+        self._owns_clients = clients is None
+        if clients is None:
+            clients = LabelerClients(mailbox=mailbox, gemini=gemini, limiter=limiter)
+        self.clients = clients
+        self.mailbox = clients.mailbox
+        self.limiter = clients.limiter
+        self._quota_at_start = self.limiter.metrics()
+        self.state = clients.state
+        self.gmail = clients.gmail
+        self.gemini = clients.gemini
         self.logger = StructuredLogger(run_id, trigger)
-        self.state = StateDB(Config.STATE_DB_PATH)
+        if self.mailbox:
+            self.logger.set_mailbox(self.mailbox.name)
+        self._label_names_by_id = None
+        self._gmail_filters = None  # tracked Gmail filters, loaded on first use
+        
+        # Deferred label application (flushed via batchModify at the end of a run)
+        self.apply_queue = LabelApplyQueue(self.gmail) if Config.BATCH_LABEL_APPLY else None
+        self._pending_applies = {}
+        self._apply_lock = threading.RLock()  # re-entered by _record_applied during a flush
+        # Threads applied since the last sweep checkpoint (None when not checkpointing)
+        self._completed_thread_ids = None
+        
+        # Concurrency: worker pool size plus separate in-flight caps per API
+        self.workers = max(1, workers or Config.LABELER_WORKERS)
+        self._gmail_slots = threading.BoundedSemaphore(Config.GMAIL_MAX_INFLIGHT)
+        self._gemini_slots = threading.BoundedSemaphore(Config.GEMINI_MAX_INFLIGHT)
+        # Threads classified together in one multi-thread Gemini prompt (1 = per-thread prompts)
+        self.gemini_batch_size = max(1, Config.GEMINI_BATCH_THREADS)
+        
+        # Optional asyncio Gmail client for thread fetches, driven by a private event loop
+        # running in its own thread, so parallel workers (e.g. backfill shards) can all
+        # submit fetches to it. It is per run but reuses the Gmail client's credentials,
+        # and with them the cached access token.
+        self.async_gmail = None
+        self._loop = None
+        self._loop_thread = None
+        if Config.GMAIL_ASYNC:
+            self._start_async_loop()
+            self.async_gmail = AsyncGmailClient(credentials=self.gmail.creds, limiter=self.limiter)
+
+        self._setup_saved_seconds = None
+        if not self._owns_clients:
+            self._setup_saved_seconds = clients.record_job(time.monotonic() - started)
         
         # Cache full taxonomy list for easy lookup
         self.all_labels = get_full_label_list()
 
-    def run(self, days_lookback=None, force_rescan=False, limit=None, dry_run=False):
+    def close(self):
+        """Release the async client's event loop and, unless shared, the Gmail connection pool."""
+        if self._owns_clients:
+            self.clients.close()
+        if self._loop is not None:
+            self._run_async(self.async_gmail.close())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+            self._loop.close()
+            self._loop = None
+
+    def _start_async_loop(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="labeler-async", daemon=True)
+        self._loop_thread.start()
+
+    def _run_async(self, coro):
+        """Run a coroutine on the async client's loop from any thread and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def run(self, days_lookback=None, force_rescan=False, limit=None, dry_run=False, resume=False, server_filter=None):
         """
         Legacy full-sweep entry point. Now delegates to run_full_sweep.
         """
@@ -28,7 +163,9 @@ class Labeler:
             days_lookback=days_lookback, 
             force_rescan=force_rescan, 
             limit=limit,
-            dry_run=dry_run
+            dry_run=dry_run,
+            resume=resume,
+            server_filter=server_filter
         )
 
     def run_incremental(self, dry_run=False):
@@ -40,6 +177,7 @@ class Labeler:
         
         # 1. Ensure labels exist
         self.gmail.ensure_labels_exist(self.all_labels)
+        self._build_label_index()
         
         # 2. Get last history ID
         last_hid = self.state.get_last_history_id()
@@ -48,10 +186,10 @@ class Labeler:
             self.logger.log("No history ID found. Falling back to full sweep (14-day window, limit 50).")
             return self.run_full_sweep(days_lookback=Config.DAYS_LOOKBACK, limit=50, dry_run=dry_run)
         
-        # 3. Fetch changed thread IDs
-        changed_ids = self.gmail.fetch_changed_threads_since(last_hid)
+        # 3. Fetch per-thread changes
+        changes = self.gmail.fetch_history_changes(last_hid)
         
-        if changed_ids is None:
+        if changes is None:
             # History expired (404) → full sweep
             self.logger.log("History ID expired. Falling back to full sweep.")
             return self.run_full_sweep(days_lookback=Config.DAYS_LOOKBACK, limit=50, dry_run=dry_run)
@@ -61,100 +199,866 @@ class Labeler:
         if new_hid:
             self.state.set_last_history_id(new_hid)
         
-        if not changed_ids:
+        stats = self._new_stats("incremental", threads_scanned=len(changes))
+        
+        # 5. Drop label churn caused by our own previous writes
+        cached_states = self._filter_history_changes(changes, stats)
+        
+        if not cached_states:
             self.logger.log("No changed threads since last run. Done.")
-            return self.logger.finish({
-                "threads_scanned": 0,
-                "threads_modified": 0,
-                "threads_skipped": 0,
-                "threads_requiring_draft": 0,
-                "errors": 0,
-                "mode": "incremental"
-            })
+            return self._finish(stats)
         
-        self.logger.log(f"Found {len(changed_ids)} changed threads to check.")
+        self.logger.log(f"Found {len(cached_states)} changed threads to check.")
         
-        stats = {
-            "threads_scanned": len(changed_ids),
-            "threads_modified": 0,
-            "threads_skipped": 0,
-            "threads_requiring_draft": 0,
-            "errors": 0,
-            "total_tokens_spent": 0,
-            "total_cost_usd": 0.0,
-            "mode": "incremental"
+        # 6. Threads we already labeled only need their new messages; the rest
+        #    (and any whose message fetch failed) are fetched whole
+        message_updates = {
+            t_id: changes[t_id]["messages_added"]
+            for t_id, cached in cached_states.items()
+            if self._can_update_from_messages(cached, changes[t_id])
         }
+        thread_ids = [t_id for t_id in cached_states if t_id not in message_updates]
+        fallback_ids = []
+        message_jobs = (
+            (t_id, None, cached_states[t_id], new_messages)
+            for t_id, new_messages in self._iter_new_messages(message_updates, fallback_ids)
+        )
+        # Consumed after message_jobs is exhausted, so fallback_ids is complete by then
+        thread_jobs = (
+            (t_id, thread_details, cached_states.get(t_id, _STATE_NOT_LOADED))
+            for t_id, thread_details in self._iter_thread_details(chain(thread_ids, fallback_ids), stats)
+        )
+        self._process_jobs(chain(message_jobs, thread_jobs), stats, dry_run=dry_run)
         
-        for t_id in changed_ids:
+        self._flush_label_queue(stats)
+        return self._finish(stats)
+
+    def _filter_history_changes(self, changes, stats):
+        """
+        Return {thread_id: cached state or _STATE_NOT_LOADED} for the threads
+        that really need processing. A thread with no new messages whose label
+        changes touch only our taxonomy, and match the labels we last applied
+        to it, is our own write echoing back: it is skipped without a fetch
+        or an LLM call and its history records are counted as suppressed.
+        """
+        managed_ids = self.gmail.get_managed_label_ids()
+        id_to_name = self._label_names_by_id or {}
+        to_process = {}
+        for t_id, change in changes.items():
+            added = change["labels_added"]
+            removed = change["labels_removed"]
+            label_only = not change["messages_added"] and (added or removed) and (added | removed) <= managed_ids
+            if not label_only and not change["messages_added"]:
+                to_process[t_id] = _STATE_NOT_LOADED
+                continue
+
+            # Needed both to recognise our own writes and for message-level updates
             try:
-                self._process_thread(t_id, stats, dry_run=dry_run)
+                cached = self.state.get_thread_state(t_id)
             except Exception as e:
                 self.logger.log_error(t_id, str(e))
                 stats["errors"] += 1
-        
-        return self.logger.finish(stats)
+                continue
+
+            if not label_only:
+                to_process[t_id] = cached
+                continue
+
+            applied = set(cached["applied_labels"]) if cached else set()
+            added_names = {id_to_name.get(lid) for lid in added}
+            removed_names = {id_to_name.get(lid) for lid in removed}
+            if cached and added_names <= applied and not (removed_names & applied):
+                stats["threads_skipped"] += 1
+                stats["self_induced_skips"] += 1
+                stats["history_records_suppressed"] += change["label_records"]
+                continue
+
+            # Someone else changed our taxonomy labels on this thread; re-check it
+            to_process[t_id] = cached
+        return to_process
+
+    @staticmethod
+    def _can_update_from_messages(cached, change):
+        """A thread we labeled before, with its subject stored, can be updated from its new messages alone."""
+        return bool(
+            change["messages_added"]
+            and cached and cached is not _STATE_NOT_LOADED
+            and cached['applied_labels']
+            and cached.get('subject')
+        )
+
+    def _iter_new_messages(self, message_updates, fallback_ids):
+        """
+        Yield (thread_id, [message resources]) for {thread_id: [message IDs]},
+        fetching messages in batches of about Config.GMAIL_BATCH_SIZE. Threads
+        with a message that could not be fetched (e.g. a deleted draft) are
+        appended to fallback_ids for a whole-thread fetch instead.
+        """
+        pending = iter(message_updates.items())
+        while True:
+            group = []
+            message_ids = []
+            for t_id, ids in pending:
+                ids = list(dict.fromkeys(ids))
+                group.append((t_id, ids))
+                message_ids.extend(ids)
+                if len(message_ids) >= Config.GMAIL_BATCH_SIZE:
+                    break
+            if not group:
+                break
+            try:
+                with self._gmail_slots:
+                    if self.async_gmail is not None:
+                        results, errors = self._run_async(self.async_gmail.get_message_details_batch(message_ids))
+                    else:
+                        results, errors = self.gmail.get_message_details_batch(message_ids)
+            except Exception as e:
+                # Never abort the run (the history cursor has already moved on)
+                self.logger.log(f"Message fetch failed ({e!r}); fetching {len(group)} threads whole instead.")
+                results = {}
+            for t_id, ids in group:
+                new_messages = [results.get(m_id) for m_id in ids]
+                if all(new_messages):
+                    yield t_id, new_messages
+                else:
+                    fallback_ids.append(t_id)
 
-    def run_full_sweep(self, days_lookback=None, force_rescan=False, limit=None, dry_run=False):
+    def run_full_sweep(self, days_lookback=None, force_rescan=False, limit=None, dry_run=False, resume=False,
+                       server_filter=None):
         """
         Full sweep mode: fetches all threads in date window.
         With "unlabeled only" filtering unless force_rescan is True.
+        With server_filter (default Config.SWEEP_SERVER_FILTER) the listing
+        query itself excludes threads Gmail can rule out (closed threads,
+        excluded categories, extra query terms); ignored with force_rescan.
+        Unless dry_run, progress is checkpointed to StateDB every
+        Config.SWEEP_CHECKPOINT_EVERY threads; resume=True continues the
+        last interrupted sweep with its original parameters.
         """
+        if server_filter is None:
+            server_filter = Config.SWEEP_SERVER_FILTER
+        sweep = None
+        if resume and dry_run:
+            self.logger.log("Dry-run sweeps are not checkpointed; starting a new dry-run sweep.")
+        elif resume:
+            sweep = self.state.get_active_sweep()
+            if sweep is None:
+                self.logger.log("No interrupted sweep to resume; starting a new one.")
+            else:
+                days_lookback = sweep["params"].get("days_lookback")
+                force_rescan = sweep["params"].get("force_rescan", False)
+                limit = sweep["params"].get("limit")
+                server_filter = sweep["params"].get("server_filter", False)
+
         days = days_lookback or Config.DAYS_LOOKBACK
         self.logger.log(f"Starting FULL SWEEP. Days={days}, Force={force_rescan}, Limit={limit}, DryRun={dry_run}")
         
         # 1. Ensure labels exist
         self.gmail.ensure_labels_exist(self.all_labels)
+        self._build_label_index()
         
-        # 2. Fetch threads
-        threads = self.gmail.fetch_recent_threads(days_lookback=days, limit=limit)
-        self.logger.log(f"Fetched {len(threads)} threads to scan.")
+        stats = self._new_stats("full_sweep")
+
+        # 2. Open (or pick up) the sweep checkpoint
+        sweep_id = None
+        completed_ids = set()
+        if sweep is not None:
+            sweep_id = sweep["sweep_id"]
+            completed_ids = self.state.get_sweep_completed_threads(sweep_id)
+            self.state.add_sweep_part(sweep_id, self.logger.run_id)
+            self.logger.log(
+                f"Resuming sweep {sweep_id}: {len(completed_ids)} threads done in "
+                f"{len(sweep['parts'])} earlier part(s)."
+            )
+        elif not dry_run:
+            sweep_id = uuid.uuid4().hex
+            self.state.start_sweep(
+                sweep_id,
+                {"days_lookback": days, "force_rescan": force_rescan, "limit": limit, "server_filter": server_filter},
+                self.logger.run_id
+            )
+        checkpoint = None
+        if sweep_id is not None:
+            self._completed_thread_ids = []
+            checkpoint = lambda: self._checkpoint_sweep(sweep_id, stats)
+
+        # 3. Stream thread listings page by page; processing starts with the first page
+        query = self._sweep_query(days, stats) if server_filter and not force_rescan else None
+        listing = {"complete": True}
+        summaries = self._guard_listing(
+            self.gmail.iter_recent_threads(days_lookback=days, limit=limit, query=query), stats, listing
+        )
+        if completed_ids:
+            summaries = self._skip_completed(summaries, completed_ids, stats)
+        cached_states = {}
+        candidates = self._sweep_candidates(summaries, cached_states, stats, force_rescan=force_rescan)
+
+        # 4. Fetch and process the candidates
+        jobs = self._sweep_jobs(candidates, cached_states, stats, dry_run=dry_run)
+        self._process_jobs(jobs, stats, dry_run=dry_run, checkpoint=checkpoint)
+        self.logger.log(f"Listed {stats['threads_scanned']} threads.")
+
+        self._flush_label_queue(stats)
+
+        if not listing["complete"]:
+            # Threads past the failed page were never seen: the sweep is not done
+            stats["sweep_incomplete"] = True
+            if sweep_id is not None:
+                self._checkpoint_sweep(sweep_id, stats)
+                self._completed_thread_ids = None
+                self.logger.log(f"Sweep {sweep_id} left open; continue it with --resume.")
+            return self._finish(stats)
+
+        # Save history ID and sweep timestamp
+        new_hid = self.gmail.get_current_history_id()
+        if new_hid:
+            self.state.set_last_history_id(new_hid)
+        self.state.set_last_full_sweep()
+
+        if sweep_id is not None:
+            self._completed_thread_ids = None
+            self.state.finish_sweep(sweep_id)
+            if sweep is not None:
+                stats = self._combine_sweep_parts(sweep_id, sweep["parts"], stats)
         
-        stats = {
-            "threads_scanned": len(threads),
+        return self._finish(stats)
+
+    def _sweep_query(self, days, stats):
+        """
+        Build the pushed-down listing query and record how many threads
+        Gmail filters out compared with the plain date window (from
+        Gmail's resultSizeEstimate, so approximate).
+        """
+        query = build_sweep_query(
+            days,
+            exclude_labels=Config.SWEEP_EXCLUDE_LABELS,
+            exclude_categories=Config.SWEEP_EXCLUDE_CATEGORIES,
+            extra_query=Config.SWEEP_EXTRA_QUERY,
+        )
+        baseline = self.gmail.estimate_thread_count(f"newer_than:{days}d")
+        filtered = self.gmail.estimate_thread_count(query)
+        stats["server_query"] = query
+        if baseline is not None and filtered is not None:
+            stats["server_filtered_estimate"] = max(0, baseline - filtered)
+            self.logger.log(
+                f"Server-side filter: '{query}' lists ~{filtered} of ~{baseline} threads "
+                f"(~{stats['server_filtered_estimate']} filtered by Gmail)."
+            )
+        return query
+
+    def _guard_listing(self, summaries, stats, listing):
+        """
+        Pass listed threads through. A listing that fails part-way is logged,
+        counted as an error and flagged in listing["complete"] rather than
+        ending the stream as if every thread had been listed.
+        """
+        try:
+            yield from summaries
+        except Exception as e:
+            self.logger.log_error("threads.list", f"Listing failed part-way: {e}")
+            stats["errors"] += 1
+            listing["complete"] = False
+
+    @staticmethod
+    def _skip_completed(summaries, completed_ids, stats):
+        """Drop listed threads that an earlier part of the sweep already finished."""
+        for thread_summary in summaries:
+            if thread_summary['id'] in completed_ids:
+                stats["sweep_resume_skips"] += 1
+                continue
+            yield thread_summary
+
+    def _checkpoint_sweep(self, sweep_id, stats):
+        """
+        Apply queued labels, then persist this part's stats and the threads
+        applied since the last checkpoint. Called with no jobs in flight.
+        """
+        self._flush_label_queue(stats)
+        with self._apply_lock:
+            completed, self._completed_thread_ids = self._completed_thread_ids, []
+        self.state.checkpoint_sweep(sweep_id, dict(stats), completed)
+
+    def _mark_completed(self, t_id):
+        """Record a thread as done for the running sweep or plan, if any."""
+        with self._apply_lock:
+            if self._completed_thread_ids is not None:
+                self._completed_thread_ids.append(t_id)
+
+    def _combine_sweep_parts(self, sweep_id, earlier_parts, stats):
+        """
+        Summary for a resumed sweep, with each part's own stats kept in the
+        run log. Every thread a part finishes (applied, unchanged or skipped)
+        is left out of later parts, so per-thread counters are summed; the
+        final part lists the whole window, so threads_scanned is its listing
+        (threads handled now plus those finished earlier) and the other
+        listing-level counters are taken from it alone.
+        """
+        parts = earlier_parts + [{
+            "run_id": self.logger.run_id,
+            "started_at": self.logger.start_time.isoformat(),
+            "stats": dict(stats),
+        }]
+        self.logger.log_sweep_parts(sweep_id, parts)
+        combined = dict(stats)
+        for part in earlier_parts:
+            for key, value in part["stats"].items():
+                if isinstance(value, (int, float)) and key in combined and key not in _SWEEP_LISTING_COUNTERS:
+                    combined[key] += value
+        combined["threads_scanned"] = stats["threads_scanned"] + stats["sweep_resume_skips"]
+        combined["sweep_parts"] = len(parts)
+        return combined
+
+    def _sweep_candidates(self, summaries, cached_states, stats, force_rescan=False):
+        """
+        Yield IDs of listed threads that need a fetch, recording their cached
+        state in cached_states. Threads whose listed historyId matches the
+        cache are skipped without a fetch.
+        """
+        for thread_summary in summaries:
+            t_id = thread_summary['id']
+            stats["threads_scanned"] += 1
+            if force_rescan:
+                cached_states[t_id] = _STATE_NOT_LOADED
+                yield t_id
+                continue
+            try:
+                cached = self.state.get_thread_state(t_id)
+            except Exception as e:
+                self.logger.log_error(t_id, str(e))
+                stats["errors"] += 1
+                continue
+            if cached and cached['history_id'] and cached['history_id'] == thread_summary.get('historyId'):
+                stats["threads_skipped"] += 1
+                stats["history_id_skips"] += 1
+                self._mark_completed(t_id)
+                continue
+            cached_states[t_id] = cached
+            yield t_id
+
+    def _sweep_jobs(self, thread_ids, cached_states, stats, dry_run=False):
+        """
+        Yield (t_id, thread_details, cached) jobs for the full sweep, skipping
+        cached threads whose message count has not changed.
+        """
+        for t_id, thread_details in self._iter_thread_details(thread_ids, stats):
+            cached = cached_states.pop(t_id, _STATE_NOT_LOADED)
+            try:
+                if cached and cached is not _STATE_NOT_LOADED:
+                    # Thread was processed before — check if new messages arrived
+                    current_msg_count = len(thread_details.get('messages', []))
+                    if current_msg_count == cached['message_count']:
+                        # No new messages, skip — but remember the current historyId
+                        # so the next sweep can skip it without a fetch
+                        if not dry_run and thread_details.get('historyId'):
+                            self.state.set_thread_history_id(t_id, thread_details['historyId'])
+                        stats["threads_skipped"] += 1
+                        self._mark_completed(t_id)
+                        continue
+            except Exception as e:
+                self.logger.log_error(t_id, str(e))
+                stats["errors"] += 1
+                continue
+
+            # Hand the fetched thread and its state over — no second lookup
+            yield t_id, thread_details, cached
+
+    def run_apply_plan(self, plan_id=None):
+        """
+        Apply mode: carry out the label changes a dry run saved as its plan
+        (default: the latest plan with pending entries) without calling
+        Gemini again. Planned threads are re-fetched in batches; a thread
+        whose historyId moved since the dry run is marked stale and left
+        alone, the rest are applied in bulk through the label queue.
+        """
+        plan_id = plan_id or self.state.get_latest_plan_id()
+        stats = self._new_stats("apply")
+        if not plan_id:
+            self.logger.log("No saved plan with pending entries. Run with --dry-run first.")
+            return self._finish(stats)
+
+        entries = {entry["thread_id"]: entry for entry in self.state.get_plan_entries(plan_id)}
+        self.logger.log(f"Starting APPLY of plan {plan_id}: {len(entries)} pending threads.")
+        stats.update({"plan_id": plan_id, "plan_applied": 0, "plan_stale": 0})
+        self.gmail.ensure_labels_exist(self.all_labels)
+        self._build_label_index()
+
+        stale = []
+        self._completed_thread_ids = []
+        for t_id, thread_details in self._iter_thread_details(entries, stats):
+            stats["threads_scanned"] += 1
+            entry = entries[t_id]
+            if str(thread_details.get('historyId')) != str(entry["history_id"]):
+                self.logger.log(f"STALE thread {t_id}: historyId {entry['history_id']} → {thread_details.get('historyId')}; not applied")
+                stale.append(t_id)
+                continue
+            applied = {
+                "subject": entry["subject"],
+                "add_labels": entry["add_labels"],
+                "remove_labels": entry["remove_labels"],
+                "reason": entry["reason"],
+                "state": {
+                    "message_count": entry["message_count"],
+                    "labels": entry["labels"],
+                    "history_id": entry["history_id"],
+                    "prompt_tokens": entry["prompt_tokens"],
+                    "completion_tokens": entry["completion_tokens"],
+                    "cost_usd": entry["cost_usd"],
+                    "subject": entry["subject"],
+                    "last_sender": entry["last_sender"],
+                },
+                "draft": self._draft_snapshot(entry["labels"], (thread_details.get('messages') or [None])[-1]),
+            }
+            message_ids = [msg['id'] for msg in thread_details.get('messages', [])]
+            with self._apply_lock:
+                queued = self.apply_queue is not None and self.apply_queue.enqueue(
+                    t_id, message_ids, entry["labels"], entry["remove_labels"]
+                )
+                if queued:
+                    self._pending_applies[t_id] = applied
+            if not queued:
+                try:
+                    modified = self.gmail.modify_thread_labels(
+                        t_id, add_labels=entry["add_labels"], remove_labels=entry["remove_labels"]
+                    )
+                except HttpError as e:
+                    # Left pending in the plan; nothing is cached or published
+                    self.logger.log_error(t_id, f"threads.modify failed: {e}")
+                    stats["errors"] += 1
+                    continue
+                if (modified or {}).get('historyId'):
+                    applied["state"]["history_id"] = modified['historyId']
+                self._record_applied(t_id, applied)
+            stats["threads_modified"] += 1
+
+        self._flush_label_queue(stats)
+        self.state.set_plan_status(plan_id, self._completed_thread_ids, "applied")
+        self.state.set_plan_status(plan_id, stale, "stale")
+        stats["plan_applied"] = len(self._completed_thread_ids)
+        stats["plan_stale"] = len(stale)
+        self._completed_thread_ids = None
+        return self._finish(stats)
+
+    def run_rebuild_state(self, limit=None, dry_run=False):
+        """
+        Rebuild-state mode: repopulate thread_cache and the history cursor
+        from the labels already on Gmail threads, e.g. after the state DB was
+        lost. Threads carrying any managed label are listed and fetched in
+        batches; their managed labels, message counts, historyIds, subjects,
+        senders and last senders are cached as if this labeler had just applied them.
+        Makes no Gemini calls and changes no labels.
+        """
+        self.logger.log(f"Starting REBUILD-STATE run. Limit={limit}, DryRun={dry_run}")
+        id_to_name = self._build_label_index()
+        stats = self._new_stats("rebuild-state")
+        stats["threads_rebuilt"] = 0
+
+        # Taken before listing: changes made while we rebuild are picked up by the next incremental run
+        start_hid = self.gmail.get_current_history_id()
+        existing = set(id_to_name.values())
+        managed = [label for label in self.all_labels if label in existing]
+        if not managed:
+            self.logger.log("No managed labels exist in this mailbox; nothing to rebuild.")
+            return self._finish(stats)
+
+        def listed_ids():
+            for thread in self.gmail.iter_recent_threads(limit=limit, query=build_any_label_query(managed)):
+                stats["threads_scanned"] += 1
+                yield thread['id']
+
+        for t_id, thread_details in self._iter_thread_details(listed_ids(), stats):
+            messages = thread_details.get('messages', [])
+            if not messages:
+                continue
+            current_label_names, _ = self._label_names_on(messages, id_to_name)
+            labels = [label for label in self.all_labels if label in current_label_names]
+            if not dry_run:
+                headers = {h['name']: h['value'] for h in messages[0]['payload']['headers']}
+                self.state.update_thread_state(
+                    t_id, len(messages), labels, thread_details.get('historyId'),
+                    subject=headers.get('Subject', 'No Subject'),
+                    last_sender=self._sender_of(messages[-1]),
+                    sender=sender_address(headers.get('From')),
+                )
+            stats["threads_rebuilt"] += 1
+
+        if start_hid and not dry_run:
+            self.state.set_last_history_id(start_hid)
+        self.logger.log(
+            f"Rebuilt {stats['threads_rebuilt']} cached threads from Gmail labels; history cursor at {start_hid}."
+        )
+        return self._finish(stats)
+
+    def run_compile_filters(self, create=False):
+        """
+        Filters mode: mine thread_cache for senders (and sender + subject
+        wordings) whose threads consistently got the same taxonomy labels,
+        and propose native Gmail filters applying them on arrival. With
+        create, the proposals become Gmail filters (reusing an existing one
+        with the same criteria) and are tracked in StateDB, so later runs
+        recognise filter-labeled threads and skip classifying them.
+        """
+        self.logger.log(f"Starting FILTERS run. Create={create}")
+        stats = self._new_stats("filters")
+        tracked = {(f["from"], f.get("subject")) for f in self.state.get_gmail_filters()}
+        proposals = [
+            p for p in propose_filters(self.state.get_labeled_senders())
+            if (p["from"], p.get("subject")) not in tracked
+        ]
+        stats.update({"filter_proposals": proposals, "filters_created": 0})
+        for proposal in proposals:
+            self.logger.log(
+                f"FILTER PROPOSAL | {filter_criteria(proposal)} → {proposal['labels']} ({proposal['threads']} threads)"
+            )
+        if not create or not proposals:
+            return self._finish(stats)
+        if not Config.GMAIL_MANAGE_FILTERS:
+            self.logger.log("Creating filters needs GMAIL_MANAGE_FILTERS=true and a token granted gmail.settings.basic.")
+            stats["errors"] += 1
+            return self._finish(stats)
+
+        self.gmail.ensure_labels_exist(self.all_labels)
+        existing = {
+            (f.get('criteria', {}).get('from'), f.get('criteria', {}).get('subject')): f['id']
+            for f in self.gmail.list_filters() or []
+        }
+        for proposal in proposals:
+            criteria = filter_criteria(proposal)
+            filter_id = existing.get((criteria["from"], criteria.get("subject")))
+            if filter_id is None:
+                created = self.gmail.create_filter(criteria, proposal["labels"])
+                if not created:
+                    stats["errors"] += 1
+                    continue
+                filter_id = created['id']
+                stats["filters_created"] += 1
+            self.state.save_gmail_filter({**proposal, "gmail_filter_id": filter_id})
+        return self._finish(stats)
+
+    def run_backfill(self, since, until=None, dry_run=False, max_cost_usd=None):
+        """
+        Backfill mode: label the mailbox history between the dates since and
+        until (default: tomorrow). The range is split into after:/before:
+        shards of at most Config.BACKFILL_SHARD_MAX_THREADS threads (by
+        Gmail's estimate), processed self.workers shards at a time, newest
+        first. Finished shards are recorded in StateDB, so re-running the
+        same range continues with the pending ones; without until, so does
+        the latest unfinished backfill from the same since, whatever day it
+        was planned on. No new thread is started once max_cost_usd (default
+        Config.BACKFILL_MAX_COST_USD) is spent.
+        """
+        backfill_id = None if until else self.state.get_unfinished_backfill_id(since.isoformat())
+        if backfill_id:
+            until = date.fromisoformat(backfill_id.split("..")[1])
+        else:
+            until = until or (date.today() + timedelta(days=1))
+            backfill_id = f"{since.isoformat()}..{until.isoformat()}"
+        budget = Config.BACKFILL_MAX_COST_USD if max_cost_usd is None else max_cost_usd
+        self.logger.log(f"Starting BACKFILL {backfill_id}. Shards in parallel={self.workers}, Budget=${budget:.2f}, DryRun={dry_run}")
+        # Backfills get their own, smaller Gemini concurrency cap
+        self._gemini_slots = threading.BoundedSemaphore(Config.BACKFILL_GEMINI_MAX_INFLIGHT)
+
+        self.gmail.ensure_labels_exist(self.all_labels)
+        self._build_label_index()
+        stats = self._new_stats("backfill")
+
+        shards = self.state.get_backfill_shards(backfill_id)
+        if not shards:
+            shards = self._plan_backfill_shards(_epoch(since), _epoch(until))
+            if not dry_run:
+                self.state.save_backfill_plan(backfill_id, shards)
+        pending = [shard for shard in shards if shard.get("status") != "done"]
+        stats.update({
+            "backfill_id": backfill_id,
+            "backfill_shards_total": len(shards),
+            "backfill_shards_done": len(shards) - len(pending),
+            "backfill_shards_pending": 0,
+            "backfill_budget_exhausted": False,
+        })
+        self.logger.log(f"{len(shards)} shards planned, {len(pending)} pending.")
+
+        self._backfill_spent = 0.0
+        self._backfill_budget = budget
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="backfill") as pool:
+            futures = [pool.submit(self._run_backfill_shard, backfill_id, shard, dry_run) for shard in pending]
+            for future in as_completed(futures):
+                shard_stats, finished = future.result()
+                self._merge_stats(stats, {k: v for k, v in shard_stats.items() if isinstance(v, (int, float))})
+                stats["backfill_shards_done" if finished else "backfill_shards_pending"] += 1
+
+        if self._backfill_spent >= budget:
+            stats["backfill_budget_exhausted"] = True
+            self.logger.log(f"Backfill budget of ${budget:.2f} spent; re-run the same range to continue.")
+        return self._finish(stats)
+
+    def _plan_backfill_shards(self, after, before):
+        """
+        Split [after, before) (epoch seconds) in halves until each shard's
+        estimated thread count fits Config.BACKFILL_SHARD_MAX_THREADS or it
+        spans a single day. Empty ranges are dropped.
+        """
+        shards = []
+        ranges = [(after, before)]
+        while ranges:
+            start, end = ranges.pop()
+            estimate = self.gmail.estimate_thread_count(build_range_query(start, end))
+            if estimate == 0:
+                continue
+            if (estimate is None or estimate > Config.BACKFILL_SHARD_MAX_THREADS) and end - start > _DAY_SECONDS:
+                middle = start + (end - start) // 2
+                ranges.extend([(start, middle), (middle, end)])
+                continue
+            shards.append({"after": start, "before": end, "estimate": estimate, "status": "pending"})
+        shards.sort(key=lambda shard: shard["after"], reverse=True)
+        return shards
+
+    def _run_backfill_shard(self, backfill_id, shard, dry_run=False):
+        """
+        List and process one shard serially on a backfill worker. Returns
+        (shard stats, finished); a shard is recorded as done only when every
+        thread in it went through without errors or budget stop.
+        """
+        stats = self._new_stats("backfill")
+        finished = False
+        try:
+            summaries = self.gmail.iter_recent_threads(query=build_range_query(shard["after"], shard["before"]))
+            cached_states = {}
+            candidates = self._sweep_candidates(summaries, cached_states, stats)
+            finished = True
+            jobs = self._sweep_jobs(candidates, cached_states, stats, dry_run=dry_run)
+            shard_thread_ids = set()
+            for unit in _chunks(jobs, self.gemini_batch_size):
+                with self._apply_lock:
+                    over_budget = self._backfill_spent >= self._backfill_budget
+                if over_budget:
+                    finished = False
+                    break
+                shard_thread_ids.update(job[0] for job in unit)
+                delta = self._run_jobs(unit, dry_run)
+                self._merge_stats(stats, delta)
+                with self._apply_lock:
+                    self._backfill_spent += delta.get("total_cost_usd", 0.0)
+            # This shard's labels must be applied before it counts as done; other
+            # shards' queued threads are left to (and counted by) their own flush
+            self._flush_label_queue(stats, thread_ids=shard_thread_ids)
+            finished = finished and not stats["errors"]
+            if finished and not dry_run:
+                self.state.complete_backfill_shard(backfill_id, shard["after"], stats)
+        except Exception as e:
+            self.logger.log_error(build_range_query(shard["after"], shard["before"]), str(e))
+            stats["errors"] += 1
+            finished = False
+        return stats, finished
+
+    def _process_jobs(self, jobs, stats, dry_run=False, checkpoint=None):
+        """
+        Run each (t_id, thread_details, cached) job, in units of
+        gemini_batch_size jobs whose threads share one Gemini prompt.
+        With workers > 1 units run on a bounded thread pool while the next
+        Gmail batch is fetched; each unit counts into its own delta, which is
+        merged into the run stats on this thread only. checkpoint, if given,
+        is called every Config.SWEEP_CHECKPOINT_EVERY jobs once all jobs
+        submitted so far have finished.
+        """
+        every = max(1, Config.SWEEP_CHECKPOINT_EVERY)
+        units = _chunks(jobs, self.gemini_batch_size)
+        count = 0
+        if self.workers <= 1:
+            for unit in units:
+                self._merge_stats(stats, self._run_jobs(unit, dry_run))
+                count, before = count + len(unit), count
+                if checkpoint and count // every > before // every:
+                    checkpoint()
+            return
+
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="labeler") as pool:
+            for unit in units:
+                if len(pending) >= self.workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._merge_stats(stats, future.result())
+                pending.add(pool.submit(self._run_jobs, unit, dry_run))
+                count, before = count + len(unit), count
+                if checkpoint and count // every > before // every:
+                    for future in wait(pending).done:
+                        self._merge_stats(stats, future.result())
+                    pending = set()
+                    checkpoint()
+            for future in wait(pending).done:
+                self._merge_stats(stats, future.result())
+
+    def _run_jobs(self, jobs, dry_run=False):
+        """
+        Process a unit of threads and return their stats delta. Never raises.
+        Jobs are (t_id, thread_details, cached), or (t_id, None, cached,
+        new_messages) for a message-level update. The threads that need
+        Gemini are classified together via classify_threads_batch (a lone
+        thread keeps its per-thread prompt), then applied one by one.
+        """
+        delta = Counter()
+        prepared = []
+        for job in jobs:
+            try:
+                ready = self._prepare_job(job, delta, dry_run)
+            except Exception as e:
+                self.logger.log_error(job[0], str(e))
+                delta["errors"] += 1
+                continue
+            if ready is not None:
+                prepared.append(ready)
+
+        results = {}
+        try:
+            if len(prepared) == 1:
+                request = prepared[0][0]
+                results[request["thread_id"]] = self._classify(request)
+            elif prepared:
+                with self._gemini_slots:
+                    results = self.gemini.classify_threads_batch([request for request, _ in prepared])
+                delta["batched_classifications"] += len(prepared)
+        except Exception as e:
+            for request, _ in prepared:
+                self.logger.log_error(request["thread_id"], str(e))
+            delta["errors"] += len(prepared)
+            return delta
+
+        for request, apply_kwargs in prepared:
+            t_id = request["thread_id"]
+            classification, tokens = results.get(t_id, (None, None))
+            try:
+                self._apply_classification(t_id, delta, classification, tokens, dry_run=dry_run, **apply_kwargs)
+            except Exception as e:
+                self.logger.log_error(t_id, str(e))
+                delta["errors"] += 1
+        return delta
+
+    def _prepare_job(self, job, stats, dry_run=False):
+        t_id, thread_details, cached = job[:3]
+        if len(job) > 3:
+            return self._prepare_new_messages(t_id, stats, job[3], cached, dry_run=dry_run)
+        return self._prepare_thread(t_id, stats, dry_run=dry_run, thread_details=thread_details, cached=cached)
+
+    def _classify(self, request):
+        """Per-thread Gemini call for one classification request."""
+        with self._gemini_slots:
+            if "current_labels" in request:
+                return self.gemini.classify_thread_update(
+                    request["subject"], request["new_message_text"], request["current_labels"],
+                    last_sender=request["last_sender"]
+                )
+            return self.gemini.classify_thread(request["subject"], request["message_count"], request["thread_text"])
+
+    @staticmethod
+    def _merge_stats(stats, delta):
+        for key, value in delta.items():
+            stats[key] = stats.get(key, 0) + value
+
+    def _build_label_index(self):
+        """Build the label ID->Name map once per run (after labels are ensured)."""
+        with self._gmail_slots:
+            label_map = self.gmail.get_label_map()
+        self._label_names_by_id = {v: k for k, v in label_map.items()}
+        return self._label_names_by_id
+
+    def _finish(self, stats):
+        """Attach this run's Gmail quota usage to the summary and write the run log."""
+        quota = self.limiter.metrics()
+        stats.update({
+            "gmail_quota_units": quota["units_consumed"] - self._quota_at_start["units_consumed"],
+            "gmail_retries": quota["retries"] - self._quota_at_start["retries"],
+            "gmail_rate_limited": quota["rate_limited_responses"] - self._quota_at_start["rate_limited_responses"],
+            "gmail_throttled_seconds": round(quota["throttled_seconds"] - self._quota_at_start["throttled_seconds"], 3),
+        })
+        if self._setup_saved_seconds is not None:
+            stats["client_setup_saved_seconds"] = round(self._setup_saved_seconds, 3)
+        if stats.get("plan_entries"):
+            stats["plan_id"] = self.logger.run_id
+            self.logger.log(
+                f"Plan {self.logger.run_id} saved ({stats['plan_entries']} threads); "
+                f"carry it out with --mode apply --plan-id {self.logger.run_id}"
+            )
+        return self.logger.finish(stats)
+
+    def _new_stats(self, mode, threads_scanned=0):
+        """Fresh per-run summary counters."""
+        return {
+            "threads_scanned": threads_scanned,
             "threads_modified": 0,
+            "threads_unchanged": 0,
             "threads_skipped": 0,
             "threads_requiring_draft": 0,
             "errors": 0,
             "total_tokens_spent": 0,
             "total_cost_usd": 0.0,
-            "mode": "full_sweep"
+            "thread_fetches_saved": 0,
+            "state_lookups_saved": 0,
+            "history_id_skips": 0,
+            "sweep_resume_skips": 0,
+            "self_induced_skips": 0,
+            "message_level_updates": 0,
+            "history_records_suppressed": 0,
+            "label_groups_applied": 0,
+            "label_groups_failed": 0,
+            "label_api_calls": 0,
+            "plan_entries": 0,
+            "filter_skips": 0,
+            "batched_classifications": 0,
+            "mode": mode
         }
 
-        for thread_summary in threads:
-            t_id = thread_summary['id']
+    def _iter_thread_details(self, thread_ids, stats):
+        """
+        Yield (thread_id, thread_details) pairs for any iterable of thread IDs
+        (consumed lazily), fetching threads in Gmail batch requests of
+        Config.GMAIL_BATCH_SIZE (or concurrently on the
+        async client when enabled). Failed fetches are logged and counted
+        as errors.
+        """
+        chunk_size = Config.GMAIL_BATCH_SIZE
+        pending_ids = iter(thread_ids)
+        while True:
+            chunk = list(islice(pending_ids, chunk_size))
+            if not chunk:
+                break
             try:
-                # Check cache for skip optimization
-                if not force_rescan:
-                    cached = self.state.get_thread_state(t_id)
-                    if cached:
-                        # Thread was processed before — check if new messages arrived
-                        thread_details = self.gmail.get_thread_details(t_id)
-                        if thread_details:
-                            current_msg_count = len(thread_details.get('messages', []))
-                            if current_msg_count == cached['message_count']:
-                                # No new messages, skip
-                                stats["threads_skipped"] += 1
-                                continue
-                
-                self._process_thread(t_id, stats, dry_run=dry_run)
-                
+                with self._gmail_slots:
+                    if self.async_gmail is not None:
+                        results, errors = self._run_async(self.async_gmail.get_thread_details_batch(chunk))
+                    else:
+                        results, errors = self.gmail.get_thread_details_batch(chunk)
             except Exception as e:
-                self.logger.log_error(t_id, str(e))
-                stats["errors"] += 1
+                # Counted per thread, like a failed fetch, instead of aborting the run
+                results, errors = {}, {t_id: f"Batch fetch failed: {e!r}" for t_id in chunk}
+            for t_id in chunk:
+                thread_details = results.get(t_id)
+                if not thread_details:
+                    self.logger.log_error(t_id, errors.get(t_id, "Thread not returned by batch fetch"))
+                    stats["errors"] += 1
+                    continue
+                yield t_id, thread_details
 
-        # Save history ID and sweep timestamp
-        new_hid = self.gmail.get_current_history_id()
-        if new_hid:
-            self.state.set_last_history_id(new_hid)
-        self.state.set_last_full_sweep()
-        
-        return self.logger.finish(stats)
-
-    def _process_thread(self, t_id, stats, dry_run=False):
+    def _process_thread(self, t_id, stats, dry_run=False, thread_details=None, cached=_STATE_NOT_LOADED):
         """
         Process a single thread — handles both new and update classification.
+        Callers that already fetched the thread or looked up its cached state
+        hand them over via thread_details / cached so neither is repeated.
         """
-        thread_details = self.gmail.get_thread_details(t_id)
+        prepared = self._prepare_thread(t_id, stats, dry_run, thread_details, cached)
+        if prepared is not None:
+            request, apply_kwargs = prepared
+            classification, tokens = self._classify(request)
+            self._apply_classification(t_id, stats, classification, tokens, dry_run=dry_run, **apply_kwargs)
+
+    def _prepare_thread(self, t_id, stats, dry_run=False, thread_details=None, cached=_STATE_NOT_LOADED):
+        """
+        Everything in _process_thread up to the Gemini call. Returns
+        (classification request, _apply_classification keyword arguments),
+        or None when the thread needs no classification.
+        """
+        handed_over = thread_details is not None
+        if not handed_over:
+            with self._gmail_slots:
+                thread_details = self.gmail.get_thread_details(t_id)
         if not thread_details:
             stats["errors"] += 1
             return
@@ -166,7 +1070,13 @@ class Labeler:
         current_msg_count = len(messages)
         
         # Check cached state for this thread
-        cached = self.state.get_thread_state(t_id)
+        if cached is _STATE_NOT_LOADED:
+            cached = self.state.get_thread_state(t_id)
+        else:
+            stats["state_lookups_saved"] += 1
+        if handed_over and cached:
+            # Only cached threads used to be fetched twice (skip check, then here)
+            stats["thread_fetches_saved"] += 1
         
         # Determine if this is an update or new classification
         is_update = (
@@ -176,24 +1086,27 @@ class Labeler:
         )
         
         # Build context
-        formatted_messages = []
-        last_sender = "unknown"
-        
-        for msg in messages:
-            headers = {h['name']: h['value'] for h in msg['payload']['headers']}
-            sender = headers.get('From', 'Unknown')
-            date = headers.get('Date', 'Unknown')
-            snippet = msg.get('snippet', '')
-            formatted_messages.append(f"[MSG {date} - FROM: {sender}]\n{snippet}\n")
-            
-            if 'SENT' in msg.get('labelIds', []):
-                last_sender = "us"
-            else:
-                last_sender = "them"
+        formatted_messages = [self._format_message(msg) for msg in messages]
+        last_sender = self._sender_of(messages[-1])
+        headers = {h['name']: h['value'] for h in messages[0]['payload']['headers']}
+        subject = headers.get('Subject', 'No Subject')
+        state = {
+            "message_count": current_msg_count,
+            "history_id": thread_details.get('historyId'),
+            "subject": subject,
+            "last_sender": last_sender,
+            "sender": sender_address(headers.get('From')),
+        }
 
-        subject = {h['name']: h['value'] for h in messages[0]['payload']['headers']}.get('Subject', 'No Subject')
+        # Labels currently on the thread, for the diff (and to spot our Gmail filters' work)
+        id_to_name = self._label_names_by_id
+        if id_to_name is None:
+            id_to_name = self._build_label_index()
+        current_label_names, labels_on_all_messages = self._label_names_on(messages, id_to_name)
+        if self._skip_filtered(t_id, stats, messages[-1], current_label_names, state, dry_run):
+            return None
         
-        # Classify
+        # Classification request
         if is_update:
             # Only send the new message(s) + existing labels → token efficient
             new_messages = messages[cached['message_count']:]
@@ -201,27 +1114,166 @@ class Labeler:
                 msg.get('snippet', '') for msg in new_messages
             )
             self.logger.log(f"UPDATE mode for thread {t_id} ({cached['message_count']} → {current_msg_count} msgs)")
-            classification, tokens = self.gemini.classify_thread_update(
-                subject, new_msg_text, cached['applied_labels']
-            )
+            request = {
+                "thread_id": t_id,
+                "subject": subject,
+                "new_message_text": new_msg_text,
+                "current_labels": cached['applied_labels'],
+                "last_sender": self._sender_of(messages[cached['message_count'] - 1]) if cached['message_count'] else None,
+            }
         else:
             # Full classification
-            thread_text = "\n".join(formatted_messages)
-            classification, tokens = self.gemini.classify_thread(subject, len(messages), thread_text)
-        
-        if not classification:
-            self.logger.log_error(t_id, "Gemini returned None")
-            stats["errors"] += 1
-            return
-            
+            request = {
+                "thread_id": t_id,
+                "subject": subject,
+                "message_count": len(messages),
+                "thread_text": "\n".join(formatted_messages),
+            }
+
+        return request, dict(
+            subject=subject,
+            current_label_names=current_label_names,
+            labels_on_all_messages=labels_on_all_messages,
+            message_ids=[msg['id'] for msg in messages],
+            latest_message=messages[-1],
+            state=state,
+        )
+
+    def _skip_filtered(self, t_id, stats, latest_message, current_label_names, state, dry_run):
+        """
+        True (and the thread is cached with current_label_names, without
+        classifying it) when the latest message was labeled by one of our
+        tracked Gmail filters. Only filters setting a complete decision count;
+        labels from a partial one stay on the thread as a hint while the
+        thread is classified as usual.
+        """
+        if self._gmail_filters is None:
+            self._gmail_filters = [f for f in self.state.get_gmail_filters() if is_complete(f["labels"])]
+        if not self._gmail_filters:
+            return False
+        headers = {h['name']: h['value'] for h in latest_message.get('payload', {}).get('headers', [])}
+        message_labels, _ = self._label_names_on([latest_message], self._label_names_by_id)
+        gmail_filter = matching_filter(self._gmail_filters, headers.get('From'), headers.get('Subject'), message_labels)
+        if gmail_filter is None:
+            return False
+        self.logger.log(f"FILTERED thread {t_id} | labeled on arrival by Gmail filter from:{gmail_filter['from']}")
+        stats["filter_skips"] += 1
+        if not dry_run:
+            labels = [label for label in self.all_labels if label in current_label_names]
+            self.state.update_thread_state(t_id, labels=labels, **state)
+            self._mark_completed(t_id)
+        return True
+
+    def _process_new_messages(self, t_id, stats, new_messages, cached, dry_run=False):
+        """
+        Message-level update: classify only the messages added since the last
+        run, using the subject and last sender stored in thread_cache instead
+        of re-downloading the whole thread.
+        """
+        prepared = self._prepare_new_messages(t_id, stats, new_messages, cached, dry_run)
+        if prepared is not None:
+            request, apply_kwargs = prepared
+            classification, tokens = self._classify(request)
+            self._apply_classification(t_id, stats, classification, tokens, dry_run=dry_run, **apply_kwargs)
+
+    def _prepare_new_messages(self, t_id, stats, new_messages, cached, dry_run=False):
+        """_process_new_messages up to the Gemini call; see _prepare_thread."""
+        new_messages = sorted(new_messages, key=lambda msg: int(msg.get('historyId') or 0))
+        message_count = cached['message_count'] + len(new_messages)
+        state = {
+            "message_count": message_count,
+            "history_id": new_messages[-1].get('historyId'),
+            "last_sender": self._sender_of(new_messages[-1]),
+        }
+        id_to_name = self._label_names_by_id
+        if id_to_name is None:
+            id_to_name = self._build_label_index()
+        new_label_names, labels_on_all_messages = self._label_names_on(new_messages, id_to_name)
+        current_label_names = set(cached['applied_labels']) | new_label_names
+        if self._skip_filtered(t_id, stats, new_messages[-1], current_label_names, state, dry_run):
+            return None
+
+        self.logger.log(f"UPDATE mode for thread {t_id} ({cached['message_count']} → {message_count} msgs, message-level)")
+        request = {
+            "thread_id": t_id,
+            "subject": cached['subject'],
+            "new_message_text": "\n".join(self._format_message(msg) for msg in new_messages),
+            "current_labels": cached['applied_labels'],
+            "last_sender": cached.get('last_sender'),
+        }
+
+        stats["message_level_updates"] += 1
+        return request, dict(
+            subject=cached['subject'],
+            current_label_names=current_label_names,
+            labels_on_all_messages=labels_on_all_messages,
+            # Older messages only carry our previous labels; removals must go through threads.modify
+            message_ids=[msg['id'] for msg in new_messages],
+            latest_message=new_messages[-1],
+            thread_wide_removals=True,
+            state=state,
+        )
+
+    @staticmethod
+    def _format_message(msg):
+        headers = {h['name']: h['value'] for h in msg['payload']['headers']}
+        sender = headers.get('From', 'Unknown')
+        date = headers.get('Date', 'Unknown')
+        return f"[MSG {date} - FROM: {sender}]\n{msg.get('snippet', '')}\n"
+
+    @staticmethod
+    def _draft_snapshot(labels, msg):
+        """Latest-message snapshot for the draft outbox, or None unless a reply is to be prepared."""
+        if msg is None or "ACTION/Prepare-reply" not in labels:
+            return None
+        headers = {h['name']: h['value'] for h in msg.get('payload', {}).get('headers', [])}
+        return {
+            "message_id": msg.get('id'),
+            "from": headers.get('From'),
+            "date": headers.get('Date'),
+            "snippet": msg.get('snippet', ''),
+        }
+
+    @staticmethod
+    def _label_names_on(messages, id_to_name):
+        """Label names found on any of the messages, and those found on all of them."""
+        per_message = [{id_to_name[lid] for lid in msg.get('labelIds', []) if lid in id_to_name} for msg in messages]
+        if not per_message:
+            return set(), set()
+        return set().union(*per_message), set.intersection(*per_message)
+
+    @staticmethod
+    def _sender_of(msg):
+        return "us" if 'SENT' in msg.get('labelIds', []) else "them"
+
+    def _apply_classification(self, t_id, stats, classification, tokens, dry_run, subject,
+                              current_label_names, labels_on_all_messages, message_ids, state,
+                              thread_wide_removals=False, latest_message=None):
+        """
+        Turn a Gemini classification into a label diff and apply it (queued or
+        directly), recording tokens, cost and the new thread state. Labels on
+        any message are removal candidates (current_label_names); labels on
+        every message in message_ids need no adding (labels_on_all_messages).
+        An empty diff counts as unchanged and makes no Gmail call. With
+        thread_wide_removals, message_ids cover only part of the thread, so
+        a diff that removes labels is applied with threads.modify instead.
+        Once applied, a Prepare-reply decision is published to the draft
+        outbox with a snapshot of latest_message.
+        """
         prompt_tokens = tokens.get("prompt_tokens", 0) if tokens else 0
         completion_tokens = tokens.get("completion_tokens", 0) if tokens else 0
         
         # Calculate cost for Gemini 2.0 Flash: $0.10/1M input, $0.40/1M output
         cost_usd = (prompt_tokens / 1_000_000 * 0.10) + (completion_tokens / 1_000_000 * 0.40)
         
+        # Counted even without a classification (e.g. an unparseable batch reply): it was billed
         stats["total_tokens_spent"] += (prompt_tokens + completion_tokens)
         stats["total_cost_usd"] += cost_usd
+
+        if not classification:
+            self.logger.log_error(t_id, "Gemini returned None")
+            stats["errors"] += 1
+            return
         
         # Determine labels to apply
         proposed_labels = []
@@ -232,53 +1284,134 @@ class Labeler:
         if classification['finance']:
             proposed_labels.append(f"FINANCE/{classification['finance']}")
         
-        # Calculate diff — remove old taxonomy labels not in proposed set
-        label_map = self.gmail.get_label_map()
-        id_to_name = {v: k for k, v in label_map.items()}
-        
-        thread_label_ids = set()
-        for msg in messages:
-            thread_label_ids.update(msg.get('labelIds', []))
-            
-        current_label_names = set()
-        for lid in thread_label_ids:
-            if lid in id_to_name:
-                current_label_names.add(id_to_name[lid])
-        
+        # Remove old taxonomy labels not in proposed set
         remove_labels = []
         for label in current_label_names:
             if label in self.all_labels and label not in proposed_labels:
                 remove_labels.append(label)
+        # Only labels missing from at least one target message need adding
+        add_labels = [label for label in proposed_labels if label not in labels_on_all_messages]
 
-        if dry_run:
+        if not add_labels and not remove_labels:
+            # Labels are already correct: no modify call, no history records
+            stats["threads_unchanged"] += 1
+            if dry_run:
+                self.logger.log(f"[DRY-RUN] Thread {t_id} | Subject: \"{subject[:40]}\" | Labels already correct")
+            else:
+                self.logger.log(f"UNCHANGED thread {t_id} | labels already correct")
+                self.state.update_thread_state(t_id, **{
+                    **state,
+                    "labels": proposed_labels,
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "cost_usd": cost_usd,
+                })
+                self._mark_completed(t_id)
+        elif dry_run:
             self.logger.log(
                 f"[DRY-RUN] Thread {t_id} | Subject: \"{subject[:40]}\" | "
-                f"Would ADD: {proposed_labels} | Would REMOVE: {remove_labels} | "
+                f"Would ADD: {add_labels} | Would REMOVE: {remove_labels} | "
                 f"Reason: {classification['reason']}"
             )
+            # Kept as this run's plan, so --mode apply can carry it out without re-classifying
+            self.state.save_plan_entry(self.logger.run_id, t_id, {
+                "history_id": state.get("history_id"),
+                "message_count": state["message_count"],
+                "subject": subject,
+                "last_sender": state.get("last_sender"),
+                "add_labels": add_labels,
+                "remove_labels": remove_labels,
+                "labels": proposed_labels,
+                "reason": classification['reason'],
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cost_usd": cost_usd,
+            })
+            stats["plan_entries"] += 1
+            stats["threads_modified"] += 1
         else:
-            self.gmail.modify_thread_labels(t_id, add_labels=proposed_labels, remove_labels=remove_labels)
-
-            # Log action
-            self.logger.log_action(
-                t_id, subject, proposed_labels, remove_labels, [], classification['reason']
-            )
-            
-            # Update state cache
-            self.state.update_thread_state(
-                t_id, 
-                current_msg_count, 
-                proposed_labels, 
-                prompt_tokens=prompt_tokens, 
-                cost_usd=cost_usd,
-                completion_tokens=completion_tokens
-            )
-        
-        stats["threads_modified"] += 1
+            applied = {
+                "subject": subject,
+                "add_labels": add_labels,
+                "remove_labels": remove_labels,
+                "reason": classification['reason'],
+                "state": {
+                    **state,
+                    "labels": proposed_labels,
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "cost_usd": cost_usd,
+                },
+                "draft": self._draft_snapshot(proposed_labels, latest_message),
+            }
+            queueable = not (thread_wide_removals and remove_labels)
+            with self._apply_lock:
+                # The queue gets the full proposed set: re-adding present labels is free
+                # in batchModify and keeps threads with the same decision in one group
+                queued = queueable and self.apply_queue is not None and self.apply_queue.enqueue(
+                    t_id, message_ids, proposed_labels, remove_labels
+                )
+                if queued:
+                    # Logged and cached once the queue is flushed at the end of the run
+                    self._pending_applies[t_id] = applied
+            if not queued:
+                try:
+                    with self._gmail_slots:
+                        modified = self.gmail.modify_thread_labels(t_id, add_labels=add_labels, remove_labels=remove_labels)
+                except HttpError as e:
+                    # Not cached, so the next run classifies the thread again
+                    self.logger.log_error(t_id, f"threads.modify failed: {e}")
+                    stats["errors"] += 1
+                    return
+                # Modifying labels bumps the thread's historyId; prefer the post-modify value
+                if (modified or {}).get('historyId'):
+                    applied["state"]["history_id"] = modified['historyId']
+                self._record_applied(t_id, applied)
+            stats["threads_modified"] += 1
         
         if "Prepare-reply" in classification['action']:
             stats["threads_requiring_draft"] += 1
 
+    def _record_applied(self, t_id, applied):
+        """Log an applied labeling action, update the state cache and publish any draft request."""
+        self.logger.log_action(
+            t_id, applied["subject"], applied["add_labels"], applied["remove_labels"], [], applied["reason"]
+        )
+        self.state.update_thread_state(t_id, **applied["state"])
+        if applied.get("draft"):
+            # Only after Gmail has the labels, so the draft agent never races the label write
+            self.state.enqueue_draft(
+                t_id, applied["state"]["labels"], applied["reason"], applied["subject"], applied["draft"]
+            )
+        self._mark_completed(t_id)
+
+    def _flush_label_queue(self, stats, thread_ids=None):
+        """
+        Apply queued label decisions grouped via batchModify, then record
+        applied threads and count failed ones as errors. thread_ids limits
+        the flush to those threads (one backfill shard's).
+        """
+        with self._apply_lock:
+            # Held for the whole flush: parallel backfill shards keep enqueuing
+            if self.apply_queue is None or not len(self.apply_queue):
+                return
+
+            for group in self.apply_queue.flush(thread_ids):
+                self.logger.log_label_group(group)
+                stats["label_api_calls"] += group["api_calls"]
+                if group["failed_threads"]:
+                    stats["label_groups_failed"] += 1
+                else:
+                    stats["label_groups_applied"] += 1
+
+                for t_id in group["applied_threads"]:
+                    self._record_applied(t_id, self._pending_applies.pop(t_id))
+                for t_id in group["failed_threads"]:
+                    self._pending_applies.pop(t_id, None)
+                    self.logger.log_error(t_id, f"batchModify failed: {group['error']}")
+                    stats["threads_modified"] -= 1
+                    stats["errors"] += 1
+
     def test_thread_update(self, thread_id, dry_run=True):
         """
         Test mode: force re-check a specific thread by resetting its cached message count.
@@ -286,22 +1419,14 @@ class Labeler:
         """
         self.logger.log(f"TEST-UPDATE mode for thread {thread_id}")
         self.gmail.ensure_labels_exist(self.all_labels)
+        self._build_label_index()
         
         # Reset the cached count to force an "update" detection
         cached = self.state.get_thread_state(thread_id)
         if cached:
             self.state.reset_thread_message_count(thread_id, max(0, cached['message_count'] - 1))
         
-        stats = {
-            "threads_scanned": 1,
-            "threads_modified": 0,
-            "threads_skipped": 0,
-            "threads_requiring_draft": 0,
-            "errors": 0,
-            "total_tokens_spent": 0,
-            "total_cost_usd": 0.0,
-            "mode": "test-update"
-        }
+        stats = self._new_stats("test-update", threads_scanned=1)
         
         try:
             self._process_thread(thread_id, stats, dry_run=dry_run)
@@ -309,4 +1434,17 @@ class Labeler:
             self.logger.log_error(thread_id, str(e))
             stats["errors"] += 1
         
-        return self.logger.finish(stats)
+        self._flush_label_queue(stats)
+        return self._finish(stats)
+
+
+def _chunks(items, size):
+    """Lists of up to size consecutive items from an iterable."""
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def _epoch(day):
+    """Epoch seconds of local midnight at the start of a date."""
+    return int(datetime.combine(day, dt_time.min).timestamp())
@@ -2,6 +2,7 @@
 import logging
 import json
 import os
+import threading
 import uuid
 from datetime import datetime
 from pathlib import Path
@@ -18,6 +19,7 @@ class StructuredLogger:
     def __init__(self, run_id=None, trigger="manual"):
         self.run_id = run_id or str(uuid.uuid4())
         self.trigger = trigger
+        self._lock = threading.Lock()  # log_data is appended to from worker threads
         self.start_time = datetime.now()
         self.date_str = self.start_time.strftime("%Y-%m-%d")
         self.json_path, self.txt_path = get_log_paths(self.run_id, self.date_str)
@@ -29,6 +31,7 @@ class StructuredLogger:
             "started_at": self.start_time.isoformat(),
             "actions_required": [],
             "errors": [],
+            "label_groups": [],
             "summary": ""
         }
 
@@ -65,7 +68,8 @@ class StructuredLogger:
             "labels_kept": labels_kept,
             "classification_reason": reason
         }
-        self.log_data["actions_required"].append(action)
+        with self._lock:
+            self.log_data["actions_required"].append(action)
         
         # Human readable log
         added_str = ",".join(labels_added) if labels_added else "None"
@@ -78,9 +82,37 @@ class StructuredLogger:
             "error": str(error),
             "skipped": skipped
         }
-        self.log_data["errors"].append(err_entry)
+        with self._lock:
+            self.log_data["errors"].append(err_entry)
         self.log(f"ERROR | thread={thread_id} | msg={error}")
 
+    def set_mailbox(self, name):
+        """Tag the run with the registered mailbox it works on."""
+        self.log_data["mailbox"] = name
+        self.log(f"MAILBOX | {name}")
+
+    def log_label_group(self, group):
+        """Record the outcome of one grouped batchModify label application."""
+        with self._lock:
+            self.log_data["label_groups"].append(group)
+        status = "FAILED" if group["failed_threads"] else "OK"
+        self.log(
+            f"LABEL GROUP {status} | threads={len(group['applied_threads']) + len(group['failed_threads'])} | "
+            f"messages={group['message_count']} | calls={group['api_calls']} | "
+            f"add={','.join(group['add_label_ids']) or 'None'} | remove={','.join(group['remove_label_ids']) or 'None'}"
+        )
+
+    def log_sweep_parts(self, sweep_id, parts):
+        """Record the parts (one per run) of a full sweep that was resumed after an interruption."""
+        self.log_data["sweep"] = {"sweep_id": sweep_id, "parts": parts}
+        for index, part in enumerate(parts, 1):
+            stats = part["stats"]
+            self.log(
+                f"SWEEP PART {index}/{len(parts)} | run_id={part['run_id']} | started_at={part['started_at']} | "
+                f"scanned={stats.get('threads_scanned', 0)} | modified={stats.get('threads_modified', 0)} | "
+                f"cost=${stats.get('total_cost_usd', 0.0):.5f}"
+            )
+
     def finish(self, summary_stats):
         """Finalize the run and write JSON log."""
         self.end_time = datetime.now()
@@ -99,8 +131,14 @@ class StructuredLogger:
         cost_str = f" | Cost: ${summary_stats.get('total_cost_usd', 0.0):.5f} ({summary_stats.get('total_tokens_spent', 0)} tokens)" if 'total_cost_usd' in summary_stats else ""
         self.log(f"RUN COMPLETE | duration={duration_ms}ms{cost_str} | summary={self.log_data.get('summary', '')}")
         
-        self.log(f"\n[{self.log_data.get('mode', 'RUN').upper()}] Run Complete. Scanned {summary_stats.get('threads_scanned', 0)} threads. Modified: {summary_stats.get('threads_modified', 0)}, Skipped: {summary_stats.get('threads_skipped', 0)}")
+        self.log(f"\n[{self.log_data.get('mode', 'RUN').upper()}] Run Complete. Scanned {summary_stats.get('threads_scanned', 0)} threads. Modified: {summary_stats.get('threads_modified', 0)}, Unchanged: {summary_stats.get('threads_unchanged', 0)}, Skipped: {summary_stats.get('threads_skipped', 0)}")
         if 'total_cost_usd' in summary_stats:
             self.log(f"   ↳ Cost: ${summary_stats['total_cost_usd']:.5f} ({summary_stats['total_tokens_spent']} tokens spent via Gemini)")
+        if summary_stats.get('thread_fetches_saved') or summary_stats.get('state_lookups_saved'):
+            self.log(f"   ↳ Saved: {summary_stats.get('thread_fetches_saved', 0)} thread fetches, {summary_stats.get('state_lookups_saved', 0)} state lookups")
+        if summary_stats.get('server_filtered_estimate') is not None:
+            self.log(f"   ↳ Server-side filter: ~{summary_stats['server_filtered_estimate']} threads excluded by Gmail")
+        if summary_stats.get('history_records_suppressed'):
+            self.log(f"   ↳ Suppressed: {summary_stats['history_records_suppressed']} self-induced history records ({summary_stats.get('self_induced_skips', 0)} threads)")
         
         return self.log_data
@@ -0,0 +1,76 @@
+"""
+Mailbox registry for running one labeler process over many inboxes.
+
+The registry is a JSON file (Config.MAILBOXES_FILE) holding a list of
+mailboxes, each with its own refresh token, state DB and quota budget:
+
+    [
+      {"name": "shop-a", "email": "orders@shop-a.example",
+       "refresh_token_env": "SHOP_A_REFRESH_TOKEN"},
+      {"name": "shop-b", "refresh_token": "...",
+       "state_db_path": "data/shop-b.db", "quota_units_per_second": 100}
+    ]
+
+The OAuth client (GOOGLE_CLIENT_ID/SECRET) and the Gemini key are shared.
+"""
+import json
+import os
+import re
+from config import Config
+from rate_limiter import get_mailbox_limiter
+
+
+class Mailbox:
+    """One registered inbox: its credentials, state DB path and quota budget."""
+
+    def __init__(self, name, refresh_token, email=None, state_db_path=None, quota_units_per_second=None):
+        if not re.fullmatch(r"[A-Za-z0-9_.-]+", name or ""):
+            raise ValueError(f"Invalid mailbox name: {name!r}")
+        if not refresh_token:
+            raise ValueError(f"Mailbox '{name}' has no refresh token")
+        self.name = name
+        self.email = email
+        self.refresh_token = refresh_token
+        self.state_db_path = state_db_path or os.path.join(
+            os.path.dirname(Config.STATE_DB_PATH), f"labeler_state_{name}.db"
+        )
+        self.quota_units_per_second = quota_units_per_second or Config.GMAIL_QUOTA_UNITS_PER_SECOND
+
+    @property
+    def limiter(self):
+        """This mailbox's quota budget, shared by every client working on it."""
+        return get_mailbox_limiter(self.name, self.quota_units_per_second)
+
+    def __repr__(self):
+        return f"Mailbox({self.name!r})"
+
+
+def load_mailboxes(path=None):
+    """
+    Read the registry file. Raises ValueError on a malformed entry,
+    a duplicate name or a refresh_token_env variable that is not set.
+    """
+    path = path or Config.MAILBOXES_FILE
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    if not isinstance(entries, list):
+        raise ValueError(f"{path}: expected a list of mailboxes")
+
+    mailboxes = []
+    seen = set()
+    for entry in entries:
+        refresh_token = entry.get("refresh_token")
+        if not refresh_token and entry.get("refresh_token_env"):
+            refresh_token = os.getenv(entry["refresh_token_env"])
+        mailbox = Mailbox(
+            entry.get("name"),
+            refresh_token,
+            email=entry.get("email"),
+            state_db_path=entry.get("state_db_path"),
+            quota_units_per_second=entry.get("quota_units_per_second"),
+        )
+        if mailbox.name in seen:
+            raise ValueError(f"{path}: duplicate mailbox '{mailbox.name}'")
+        seen.add(mailbox.name)
+        mailboxes.append(mailbox)
+    return mailboxes
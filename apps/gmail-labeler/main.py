@@ -2,6 +2,7 @@
 import argparse
 import sys
 import json
+from datetime import date
 from labeler import Labeler
 from scheduler import run_scheduler
 from label_taxonomy import get_taxonomy_dict
@@ -9,13 +10,23 @@ from label_taxonomy import get_taxonomy_dict
 def main():
     parser = argparse.ArgumentParser(description="Gmail Labeler Agent")
     parser.add_argument("--mode", choices=[
-        "scheduler", "mcp", "manual", "incremental", "test-update", "taxonomy"
+        "scheduler", "mcp", "manual", "incremental", "test-update", "taxonomy", "backfill", "rebuild-state", "apply", "filters"
     ], default="manual", help="Execution mode")
     parser.add_argument("--days", type=int, help="Lookback window in days (overrides config)")
     parser.add_argument("--limit", type=int, help="Limit number of threads to process")
     parser.add_argument("--force", action="store_true", help="Force rescan of already labeled threads")
     parser.add_argument("--dry-run", action="store_true", help="Log proposed changes without applying them")
     parser.add_argument("--thread-id", type=str, help="Thread ID for test-update mode")
+    parser.add_argument("--workers", type=int, help="Concurrent thread workers (overrides LABELER_WORKERS)")
+    parser.add_argument("--resume", action="store_true", help="Continue the last interrupted full sweep")
+    parser.add_argument("--server-filter", action="store_true", default=None,
+                        help="Let Gmail exclude closed/excluded threads from the sweep listing (SWEEP_SERVER_FILTER)")
+    parser.add_argument("--since", type=date.fromisoformat, help="Backfill start date, YYYY-MM-DD (default BACKFILL_SINCE)")
+    parser.add_argument("--until", type=date.fromisoformat, help="Backfill end date, YYYY-MM-DD (default tomorrow)")
+    parser.add_argument("--max-cost", type=float, help="Backfill Gemini budget in USD for this run (default BACKFILL_MAX_COST_USD)")
+    parser.add_argument("--mailbox", type=str, help="Registered mailbox to run on (see MAILBOXES_FILE)")
+    parser.add_argument("--create", action="store_true", help="Filters mode: create the proposed Gmail filters")
+    parser.add_argument("--plan-id", type=str, help="Dry-run plan to carry out in apply mode (default: the latest)")
     
     args = parser.parse_args()
     
@@ -31,30 +42,93 @@ def main():
         run_scheduler()
         return
 
+    mailbox = None
+    if args.mailbox:
+        from mailboxes import load_mailboxes
+        mailbox = next((m for m in load_mailboxes() if m.name == args.mailbox), None) if Config.MAILBOXES_FILE else None
+        if mailbox is None:
+            print(f"❌ Mailbox '{args.mailbox}' is not registered in MAILBOXES_FILE")
+            sys.exit(1)
+
     if args.mode == "incremental":
-        labeler = Labeler(trigger="incremental")
+        labeler = Labeler(trigger="incremental", workers=args.workers, mailbox=mailbox)
         result = labeler.run_incremental(dry_run=args.dry_run)
         print(f"\nIncremental run complete. Scanned {result.get('threads_scanned', 0)} threads.")
         return
 
+    if args.mode == "backfill":
+        from rate_limiter import QuotaRateLimiter
+        # Own quota budget: leaves Gmail headroom for the scheduler's incremental runs
+        labeler = Labeler(
+            trigger="backfill",
+            workers=args.workers or Config.BACKFILL_WORKERS,
+            mailbox=mailbox,
+            limiter=QuotaRateLimiter(Config.BACKFILL_QUOTA_UNITS_PER_SECOND),
+        )
+        try:
+            result = labeler.run_backfill(
+                since=args.since or date.fromisoformat(Config.BACKFILL_SINCE),
+                until=args.until,
+                dry_run=args.dry_run,
+                max_cost_usd=args.max_cost,
+            )
+        finally:
+            labeler.close()
+        print(f"\nBackfill {result.get('backfill_id')}: {result.get('backfill_shards_done')}/"
+              f"{result.get('backfill_shards_total')} shards done, ${result.get('total_cost_usd', 0.0):.4f} spent.")
+        return
+
+    if args.mode == "apply":
+        labeler = Labeler(trigger="apply", mailbox=mailbox)
+        try:
+            result = labeler.run_apply_plan(plan_id=args.plan_id)
+        finally:
+            labeler.close()
+        print(f"\nPlan {result.get('plan_id')}: applied {result.get('plan_applied', 0)} threads, "
+              f"skipped {result.get('plan_stale', 0)} changed since the dry run.")
+        return
+
+    if args.mode == "filters":
+        labeler = Labeler(trigger="filters", mailbox=mailbox)
+        try:
+            result = labeler.run_compile_filters(create=args.create)
+        finally:
+            labeler.close()
+        print(json.dumps(result.get("filter_proposals", []), indent=2, ensure_ascii=False))
+        print(f"\n{len(result.get('filter_proposals', []))} filters proposed, {result.get('filters_created', 0)} created.")
+        return
+
+    if args.mode == "rebuild-state":
+        labeler = Labeler(trigger="rebuild-state", mailbox=mailbox)
+        try:
+            result = labeler.run_rebuild_state(limit=args.limit, dry_run=args.dry_run)
+        finally:
+            labeler.close()
+        prefix = "[DRY-RUN] " if args.dry_run else ""
+        print(f"\n{prefix}Rebuilt state for {result.get('threads_rebuilt', 0)} threads "
+              f"({result.get('errors', 0)} errors, 0 Gemini tokens).")
+        return
+
     if args.mode == "test-update":
         if not args.thread_id:
             print("❌ --thread-id is required for test-update mode")
             sys.exit(1)
-        labeler = Labeler(trigger="test-update")
+        labeler = Labeler(trigger="test-update", mailbox=mailbox)
         result = labeler.test_thread_update(args.thread_id, dry_run=True)
         print(f"\nTest-update complete for thread {args.thread_id}.")
         return
 
     # Full sweep modes (manual or mcp)
     trigger = "mcp_call" if args.mode == "mcp" else "manual"
-    labeler = Labeler(trigger=trigger)
+    labeler = Labeler(trigger=trigger, workers=args.workers, mailbox=mailbox)
     
     result = labeler.run(
         days_lookback=args.days,
         limit=args.limit,
         force_rescan=args.force,
-        dry_run=args.dry_run
+        dry_run=args.dry_run,
+        resume=args.resume,
+        server_filter=args.server_filter
     )
     
     if args.mode == "mcp":
@@ -62,9 +136,10 @@ def main():
     elif args.mode == "manual":
         skipped = result.get('threads_skipped', 0)
         modified = result.get('threads_modified', 0)
+        unchanged = result.get('threads_unchanged', 0)
         prefix = "[DRY-RUN] " if args.dry_run else ""
         print(f"\n{prefix}Run Complete. Scanned {result.get('threads_scanned')} threads. "
-              f"Modified: {modified}, Skipped: {skipped}")
+              f"Modified: {modified}, Unchanged: {unchanged}, Skipped: {skipped}")
 
 if __name__ == "__main__":
     main()
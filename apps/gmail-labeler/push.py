@@ -0,0 +1,80 @@
+"""
+Gmail push notifications (users.watch → Cloud Pub/Sub → HTTP push).
+Pub/Sub POSTs an envelope whose base64 `data` is {"emailAddress", "historyId"}.
+Bursts of notifications are coalesced by PushDebouncer into a single
+incremental run.
+"""
+
+import base64
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger("Push")
+
+
+def parse_push_notification(body):
+    """
+    Decode a Pub/Sub push request body.
+    Returns (email_address, history_id) or raises ValueError if malformed.
+    """
+    try:
+        envelope = json.loads(body)
+        data = base64.b64decode(envelope["message"]["data"])
+        payload = json.loads(data)
+        return payload.get("emailAddress"), str(payload["historyId"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Malformed push notification: {e}") from e
+
+
+class PushDebouncer:
+    """
+    Collapse notification bursts: every notify() restarts a `delay`-second
+    timer and the callback runs once with the highest historyId seen. A
+    burst that never goes quiet (e.g. notifications caused by our own label
+    writes) still fires `max_delay` seconds after its first notification.
+    """
+
+    def __init__(self, callback, delay, max_delay=None):
+        self.callback = callback
+        self.delay = delay
+        self.max_delay = max(delay, max_delay if max_delay is not None else delay * 6)
+        self._lock = threading.Lock()
+        self._timer = None
+        self._history_id = None
+        self._burst_started = None
+        self.notifications = 0
+        self.triggers = 0
+
+    def notify(self, history_id):
+        with self._lock:
+            self.notifications += 1
+            if self._history_id is None or int(history_id) > int(self._history_id):
+                self._history_id = history_id
+            now = time.monotonic()
+            if self._burst_started is None:
+                self._burst_started = now
+            if self._timer is not None:
+                self._timer.cancel()
+            wait = min(self.delay, max(0.0, self._burst_started + self.max_delay - now))
+            self._timer = threading.Timer(wait, self._fire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _fire(self):
+        with self._lock:
+            history_id, self._history_id = self._history_id, None
+            self._timer = None
+            self._burst_started = None
+            self.triggers += 1
+        try:
+            self.callback(history_id)
+        except Exception as e:
+            logger.error(f"Push-triggered run failed: {e}")
+
+    def cancel(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
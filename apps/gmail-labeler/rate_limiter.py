@@ -0,0 +1,172 @@
+"""
+Quota-unit-aware pacing for Gmail API calls.
+Gmail meters every user against a per-second budget of quota units, and
+each method costs a different number of units. QuotaRateLimiter is a token
+bucket over those units, shared by every client that talks to one mailbox,
+plus the retry/backoff policy used when Gmail still answers 429 / 5xx.
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+# Cost of each Gmail API method in quota units
+# (https://developers.google.com/gmail/api/reference/quota)
+QUOTA_UNITS = {
+    'users.getProfile': 1,
+    'labels.list': 1,
+    'labels.create': 5,
+    'history.list': 2,
+    'threads.list': 10,
+    'threads.get': 10,
+    'threads.modify': 10,
+    'messages.get': 5,
+    'messages.batchModify': 50,
+    'watch': 100,
+    'settings.filters.list': 1,
+    'settings.filters.create': 5,
+}
+DEFAULT_UNITS = 5
+
+# Gmail's per-user limit is 250 quota units per second (moving average)
+DEFAULT_UNITS_PER_SECOND = 250
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+
+def quota_cost(method):
+    return QUOTA_UNITS.get(method, DEFAULT_UNITS)
+
+
+def backoff_delay(attempt, retry_after=None, base=1.0, cap=32.0):
+    """
+    Seconds to wait before retry number `attempt` (0-based).
+    Honours a server-sent Retry-After; otherwise full-jitter exponential backoff.
+    """
+    if retry_after is not None:
+        try:
+            return max(0.0, float(retry_after))
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class QuotaRateLimiter:
+    def __init__(self, units_per_second=DEFAULT_UNITS_PER_SECOND, burst=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(units_per_second)
+        self.capacity = float(burst or units_per_second)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+
+        # Metrics
+        self._units_consumed = 0
+        self._calls = {}
+        self._throttled_waits = 0
+        self._wait_seconds = 0.0
+        self._retries = 0
+        self._rate_limited = 0
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def _reserve(self, method, units):
+        """
+        Take `units` from the bucket (going into debt if needed) and return the
+        wait in seconds. Requests larger than the bucket (e.g. a 50-thread
+        batch) are charged in full; the debt delays them and later callers.
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens -= units
+            wait = max(0.0, -self._tokens / self.rate, self._paused_until - now)
+            self._units_consumed += units
+            self._calls[method] = self._calls.get(method, 0) + 1
+            if wait > 0:
+                self._throttled_waits += 1
+                self._wait_seconds += wait
+            return wait
+
+    def acquire(self, method, count=1):
+        """Block until `count` calls of `method` fit in the quota budget. Returns seconds waited."""
+        wait = self._reserve(method, quota_cost(method) * count)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    async def acquire_async(self, method, count=1):
+        """acquire() for event-loop callers."""
+        wait = self._reserve(method, quota_cost(method) * count)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def record_retry(self, rate_limited=False, pause=None):
+        """
+        Note a retried call. A rate-limit answer pauses every caller sharing
+        this limiter for `pause` seconds and drains the bucket.
+        """
+        with self._lock:
+            self._retries += 1
+            if rate_limited:
+                self._rate_limited += 1
+                self._tokens = min(self._tokens, 0.0)
+                if pause:
+                    self._paused_until = max(self._paused_until, self._clock() + pause)
+
+    def metrics(self):
+        """Live budget metrics (cumulative since the limiter was created)."""
+        with self._lock:
+            self._refill(self._clock())
+            return {
+                "units_per_second": self.rate,
+                "available_units": round(max(self._tokens, 0.0), 1),
+                "units_consumed": self._units_consumed,
+                "calls_by_method": dict(self._calls),
+                "throttled_waits": self._throttled_waits,
+                "throttled_seconds": round(self._wait_seconds, 3),
+                "retries": self._retries,
+                "rate_limited_responses": self._rate_limited,
+            }
+
+
+_default_limiter = None
+_default_lock = threading.Lock()
+
+
+def get_default_limiter():
+    """Process-wide limiter for the configured mailbox."""
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            from config import Config
+            _default_limiter = QuotaRateLimiter(Config.GMAIL_QUOTA_UNITS_PER_SECOND)
+        return _default_limiter
+
+
+_mailbox_limiters = {}
+
+
+def get_mailbox_limiter(name, units_per_second=None):
+    """Process-wide limiter for a registered mailbox (created on first use)."""
+    with _default_lock:
+        if name not in _mailbox_limiters:
+            from config import Config
+            _mailbox_limiters[name] = QuotaRateLimiter(units_per_second or Config.GMAIL_QUOTA_UNITS_PER_SECOND)
+        return _mailbox_limiters[name]
+
+
+def get_mailbox_limiters():
+    """Snapshot of {mailbox name: limiter} created so far."""
+    with _default_lock:
+        return dict(_mailbox_limiters)
@@ -1,58 +1,362 @@
+import json
 import logging
 import signal
 import sys
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
 from apscheduler.schedulers.blocking import BlockingScheduler
-from labeler import Labeler
+from labeler import Labeler, LabelerClients
+from gemini_client import GeminiClient
 from config import Config
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from mailboxes import load_mailboxes
+from push import PushDebouncer, parse_push_notification
+from rate_limiter import get_default_limiter, get_mailbox_limiters
+from state import StateDB
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 
 logger = logging.getLogger("Scheduler")
 
+# Serializes incremental runs between the interval job and push triggers
+_incremental_lock = threading.Lock()
+
+# Warm clients per mailbox ("default" for the configured one), kept for the scheduler's lifetime
+_warm_clients = {}
+_warm_clients_lock = threading.Lock()
+
+def get_warm_clients(mailbox=None, gemini=None):
+    """The long-lived LabelerClients for a mailbox, built on first use."""
+    name = mailbox.name if mailbox else "default"
+    with _warm_clients_lock:
+        clients = _warm_clients.get(name)
+        if clients is None:
+            clients = LabelerClients(mailbox=mailbox, gemini=gemini)
+            _warm_clients[name] = clients
+            logger.info(f"[{name}] Clients ready in {clients.setup_seconds:.2f}s; reused by every job.")
+        return clients
+
 class HealthCheckHandler(BaseHTTPRequestHandler):
     def do_HEAD(self):
         self.send_response(200)
         self.end_headers()
     def do_GET(self):
+        if self.path == "/metrics":
+            # Live Gmail quota budget (units, throttling, retries)
+            metrics = {"gmail_quota": get_default_limiter().metrics()}
+            mailbox_limiters = get_mailbox_limiters()
+            if mailbox_limiters:
+                metrics["mailboxes"] = {name: limiter.metrics() for name, limiter in mailbox_limiters.items()}
+            with _warm_clients_lock:
+                warm_clients = dict(_warm_clients)
+            if warm_clients:
+                # Setup time saved by reusing clients instead of rebuilding them each tick
+                metrics["warm_clients"] = {name: clients.metrics() for name, clients in warm_clients.items()}
+            body = json.dumps(metrics).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+            return
         self.send_response(200)
         self.end_headers()
         self.wfile.write(b"OK")
+    def do_POST(self):
+        """Pub/Sub push endpoint: any 2xx acks the message, anything else is redelivered."""
+        url = urlparse(self.path)
+        if url.path.startswith("/outbox/"):
+            self._handle_outbox(url)
+            return
+        debouncer = getattr(self.server, "push_debouncer", None)
+        if url.path != Config.PUSH_PATH or debouncer is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        if Config.PUSH_WEBHOOK_TOKEN and parse_qs(url.query).get("token") != [Config.PUSH_WEBHOOK_TOKEN]:
+            self.send_response(403)
+            self.end_headers()
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            email, history_id = parse_push_notification(body)
+        except ValueError as e:
+            logger.warning(str(e))
+            self.send_response(400)
+            self.end_headers()
+            return
+        logger.info(f"Push notification for {email}: historyId={history_id}")
+        debouncer.notify(history_id)
+        self.send_response(204)
+        self.end_headers()
+    def _handle_outbox(self, url):
+        """
+        Draft outbox consumer API (query parameters; add mailbox=<name> with a registry):
+        POST /outbox/claim?consumer=<id>&limit=N → 200 {"drafts": [...]} (claimed for OUTBOX_LEASE_SECONDS)
+        POST /outbox/ack?consumer=<id>&id=<outbox id> → 204, or 409 if the claim was lost
+        """
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if not Config.OUTBOX_TOKEN or url.path not in ("/outbox/claim", "/outbox/ack"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        if params.get("token") != Config.OUTBOX_TOKEN:
+            self.send_response(403)
+            self.end_headers()
+            return
+        state = self.server.outbox_state(params.get("mailbox"))
+        consumer = params.get("consumer")
+        if state is None or not consumer:
+            self.send_response(404 if state is None else 400)
+            self.end_headers()
+            return
+        try:
+            limit = int(params.get("limit", 10))
+            outbox_id = int(params["id"]) if url.path == "/outbox/ack" else None
+        except (KeyError, ValueError):
+            self.send_response(400)
+            self.end_headers()
+            return
+        if outbox_id is not None:
+            self.send_response(204 if state.ack_draft(outbox_id, consumer) else 409)
+            self.end_headers()
+            return
+        drafts = state.claim_drafts(consumer, limit, Config.OUTBOX_LEASE_SECONDS)
+        body = json.dumps({"drafts": drafts}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
     def log_message(self, format, *args):
         pass
 
-def run_health_server():
-    server = HTTPServer(('localhost', 3003), HealthCheckHandler)
+class LabelerHTTPServer(ThreadingHTTPServer):
+    """Scheduler HTTP server; knows the mailboxes whose draft outboxes it serves."""
+
+    daemon_threads = True
+
+    def __init__(self, address, push_debouncer=None, mailboxes=None):
+        super().__init__(address, HealthCheckHandler)
+        self.push_debouncer = push_debouncer
+        self.mailboxes = {mailbox.name: mailbox for mailbox in mailboxes or []}
+        self._state_dbs = {}
+        self._state_lock = threading.Lock()
+
+    def outbox_state(self, mailbox_name=None):
+        """StateDB holding the outbox of the named (default: the configured) mailbox, or None if unknown."""
+        if mailbox_name is None and self.mailboxes:
+            return None
+        if mailbox_name is not None and mailbox_name not in self.mailboxes:
+            return None
+        with self._state_lock:
+            state = self._state_dbs.get(mailbox_name)
+            if state is None:
+                mailbox = self.mailboxes.get(mailbox_name)
+                state = StateDB(mailbox.state_db_path if mailbox else Config.STATE_DB_PATH)
+                self._state_dbs[mailbox_name] = state
+            return state
+
+def make_http_server(host=None, port=None, push_debouncer=None, mailboxes=None):
+    """Health/metrics server and draft outbox API; also receives Pub/Sub pushes when a debouncer is given."""
+    return LabelerHTTPServer(
+        (host or Config.HTTP_HOST, Config.HTTP_PORT if port is None else port),
+        push_debouncer=push_debouncer, mailboxes=mailboxes
+    )
+
+def run_health_server(push_debouncer=None, mailboxes=None):
+    server = make_http_server(push_debouncer=push_debouncer, mailboxes=mailboxes)
     server.serve_forever()
 
-def incremental_job():
-    """Runs every few minutes — checks only changed threads."""
+def incremental_job(notified_history_id=None, trigger="scheduler-incremental"):
+    """Runs every few minutes (or on push) — checks only changed threads."""
+    with _incremental_lock:
+        try:
+            if notified_history_id:
+                last_hid = get_warm_clients().state.get_last_history_id()
+                if last_hid and int(notified_history_id) <= int(last_hid):
+                    logger.info(f"Push historyId {notified_history_id} already synced (cursor {last_hid}).")
+                    return
+            logger.info("Starting INCREMENTAL scheduled run...")
+            labeler = Labeler(trigger=trigger, workers=Config.LABELER_WORKERS, clients=get_warm_clients())
+            try:
+                labeler.run_incremental()
+            finally:
+                labeler.close()
+        except Exception as e:
+            logger.error(f"Error in incremental job: {e}")
+
+def push_incremental_job(history_id):
+    """Debounced push trigger — incremental run up to the notified historyId."""
+    incremental_job(notified_history_id=history_id, trigger="push")
+
+def watch_job():
+    """Registers/renews users.watch so Gmail keeps publishing to the Pub/Sub topic."""
     try:
-        logger.info("Starting INCREMENTAL scheduled run...")
-        labeler = Labeler(trigger="scheduler-incremental")
-        labeler.run_incremental()
+        response = get_warm_clients().gmail.watch(Config.PUBSUB_TOPIC)
+        if response:
+            logger.info(f"Gmail watch active until {response.get('expiration')} (historyId={response.get('historyId')})")
     except Exception as e:
-        logger.error(f"Error in incremental job: {e}")
+        logger.error(f"Error in watch job: {e}")
 
 def full_sweep_job():
     """Runs daily — catches anything missed by incremental sync."""
     try:
         logger.info("Starting FULL SWEEP scheduled run...")
-        labeler = Labeler(trigger="scheduler-sweep")
-        labeler.run_full_sweep()
+        labeler = Labeler(trigger="scheduler-sweep", workers=Config.LABELER_WORKERS, clients=get_warm_clients())
+        try:
+            # Picks up a sweep cut short by a restart instead of paying for it twice
+            labeler.run_full_sweep(resume=True)
+        finally:
+            labeler.close()
     except Exception as e:
         logger.error(f"Error in full sweep job: {e}")
 
+class MailboxPool:
+    """
+    Runs labeler jobs for many registered mailboxes on one shared worker
+    pool with one shared GeminiClient; each mailbox keeps its warm clients
+    between jobs. A mailbox has at most one job queued
+    or running, so a slow inbox never holds more than one worker, and the
+    submission order rotates every round so each mailbox gets its turn.
+    A job of another mode (e.g. the nightly sweep during an incremental
+    run) is deferred until the mailbox's current job has finished.
+    """
+
+    def __init__(self, mailboxes, workers=None, gemini=None):
+        self.mailboxes = list(mailboxes)
+        self.gemini = gemini or GeminiClient()
+        self.workers = max(1, workers or Config.MAILBOX_WORKERS)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="mailbox")
+        self._busy = {}      # mailbox name -> mode of its queued or running job
+        self._deferred = {}  # mailbox name -> modes to run once that job is done
+        self._lock = threading.Lock()
+        self._round = 0
+
+    def submit_all(self, mode):
+        """Queue one job per idle mailbox; returns the futures of the queued jobs."""
+        with self._lock:
+            start = self._round % len(self.mailboxes) if self.mailboxes else 0
+            self._round += 1
+        order = self.mailboxes[start:] + self.mailboxes[:start]
+        return [future for future in (self.submit(mailbox, mode) for mailbox in order) if future is not None]
+
+    def submit(self, mailbox, mode):
+        """
+        Queue a job for one mailbox. Returns the future, or None when the
+        mailbox already has a job pending: a job of the same mode is skipped,
+        one of another mode runs after it.
+        """
+        with self._lock:
+            busy_mode = self._busy.get(mailbox.name)
+            if busy_mode is not None:
+                deferred = self._deferred.setdefault(mailbox.name, [])
+                if mode == busy_mode or mode in deferred:
+                    logger.info(f"[{mailbox.name}] previous {mode} job still pending; skipping this round.")
+                else:
+                    deferred.append(mode)
+                    logger.info(f"[{mailbox.name}] {busy_mode} job still pending; {mode} will run after it.")
+                return None
+            self._busy[mailbox.name] = mode
+        return self._pool.submit(self._run, mailbox, mode)
+
+    def _run(self, mailbox, mode):
+        try:
+            labeler = Labeler(
+                trigger=f"scheduler-{mode}", workers=Config.LABELER_WORKERS,
+                clients=get_warm_clients(mailbox, gemini=self.gemini)
+            )
+            try:
+                if mode == "incremental":
+                    return labeler.run_incremental()
+                # Picks up a sweep cut short by a restart instead of paying for it twice
+                return labeler.run_full_sweep(resume=True)
+            finally:
+                labeler.close()
+        except Exception as e:
+            logger.error(f"[{mailbox.name}] Error in {mode} job: {e}")
+        finally:
+            with self._lock:
+                self._busy.pop(mailbox.name, None)
+                deferred = self._deferred.get(mailbox.name)
+                next_mode = deferred.pop(0) if deferred else None
+            if next_mode is not None:
+                try:
+                    self.submit(mailbox, next_mode)
+                except RuntimeError as e:  # pool shut down without waiting
+                    logger.warning(f"[{mailbox.name}] deferred {next_mode} job dropped: {e}")
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+def run_mailbox_scheduler(mailboxes):
+    """Scheduler for the mailbox registry: polling incremental runs plus a daily sweep per mailbox."""
+    if Config.PUSH_ENABLED:
+        logger.warning("Push mode is not available with a mailbox registry; polling every mailbox instead.")
+    pool = MailboxPool(mailboxes)
+
+    health_thread = threading.Thread(target=run_health_server, kwargs={"mailboxes": mailboxes}, daemon=True)
+    health_thread.start()
+
+    scheduler = BlockingScheduler()
+    scheduler.add_job(
+        pool.submit_all, 'interval', args=("incremental",),
+        minutes=Config.INCREMENTAL_INTERVAL_MINUTES,
+        id='incremental_job',
+        name='Incremental Sync (all mailboxes)'
+    )
+    scheduler.add_job(
+        pool.submit_all, 'cron', args=("full_sweep",),
+        hour=Config.FULL_SWEEP_HOUR,
+        id='full_sweep_job',
+        name='Daily Full Sweep (all mailboxes)'
+    )
+    scheduler.add_job(pool.submit_all, 'date', args=("incremental",), id='startup_check', name='Startup Check')
+
+    logger.info(
+        f"Scheduler started for {len(mailboxes)} mailboxes "
+        f"({', '.join(m.name for m in mailboxes)}) | "
+        f"Incremental: every {Config.INCREMENTAL_INTERVAL_MINUTES} min | "
+        f"Full sweep: daily at {Config.FULL_SWEEP_HOUR}:00 | "
+        f"Mailbox workers: {pool.workers}"
+    )
+
+    def signal_handler(sig, frame):
+        logger.info("Stopping scheduler...")
+        scheduler.shutdown(wait=False)
+        pool.shutdown(wait=False)
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
 def run_scheduler():
-    # Start health check server
-    health_thread = threading.Thread(target=run_health_server, daemon=True)
+    if Config.MAILBOXES_FILE:
+        run_mailbox_scheduler(load_mailboxes())
+        return
+
+    # Push mode: Gmail notifies us, polling becomes a slow safety net
+    push_mode = Config.PUSH_ENABLED and bool(Config.PUBSUB_TOPIC)
+    if Config.PUSH_ENABLED and not push_mode:
+        logger.warning("PUSH_ENABLED is set but PUBSUB_TOPIC is missing; staying in polling mode.")
+    debouncer = PushDebouncer(
+        push_incremental_job, Config.PUSH_DEBOUNCE_SECONDS, max_delay=Config.PUSH_MAX_DELAY_SECONDS
+    ) if push_mode else None
+    poll_minutes = Config.PUSH_SAFETY_POLL_MINUTES if push_mode else Config.INCREMENTAL_INTERVAL_MINUTES
+
+    # Start health check server (and push receiver)
+    health_thread = threading.Thread(target=run_health_server, args=(debouncer,), daemon=True)
     health_thread.start()
     
     scheduler = BlockingScheduler()
     
-    # Incremental job: every N minutes (default 5)
+    # Incremental job: every N minutes (default 5; safety-net interval in push mode)
     scheduler.add_job(
         incremental_job, 'interval', 
-        minutes=Config.INCREMENTAL_INTERVAL_MINUTES,
+        minutes=poll_minutes,
         id='incremental_job',
         name='Incremental Sync'
     )
@@ -71,16 +375,30 @@ def run_scheduler():
         id='startup_check',
         name='Startup Check'
     )
+
+    if push_mode:
+        # Register the watch now and renew it well before its 7-day expiry
+        scheduler.add_job(watch_job, 'date', id='watch_startup', name='Gmail Watch')
+        scheduler.add_job(
+            watch_job, 'interval',
+            hours=Config.WATCH_RENEW_HOURS,
+            id='watch_renew',
+            name='Gmail Watch Renewal'
+        )
     
     logger.info(
         f"Scheduler started. "
-        f"Incremental: every {Config.INCREMENTAL_INTERVAL_MINUTES} min | "
-        f"Full sweep: daily at {Config.FULL_SWEEP_HOUR}:00"
+        f"Mode: {'push' if push_mode else 'polling'} | "
+        f"Incremental: every {poll_minutes} min | "
+        f"Full sweep: daily at {Config.FULL_SWEEP_HOUR}:00 | "
+        f"Workers: {Config.LABELER_WORKERS}"
     )
     
     # Handle graceful shutdown
     def signal_handler(sig, frame):
         logger.info("Stopping scheduler...")
+        if debouncer is not None:
+            debouncer.cancel()
         scheduler.shutdown(wait=False)
         sys.exit(0)
         
@@ -3,12 +3,15 @@ State tracking for incremental Gmail sync.
 Uses SQLite to persist:
 - last_history_id (Gmail's incremental cursor)
 - thread processing cache (msg count, applied labels)
+- Gmail label name->ID map (with TTL)
 """
 
 import sqlite3
 import json
 import os
 import logging
+import threading
+from functools import wraps
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -17,9 +20,19 @@ logger = logging.getLogger("State")
 DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), "data", "labeler_state.db")
 
 
+def _synchronized(method):
+    """Serialize writes from labeler worker threads."""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class StateDB:
     def __init__(self, db_path=None):
         self.db_path = db_path or DEFAULT_DB_PATH
+        self._lock = threading.RLock()
         # Ensure directory exists
         Path(os.path.dirname(self.db_path)).mkdir(parents=True, exist_ok=True)
         self._init_db()
@@ -47,6 +60,85 @@ class StateDB:
                     last_processed_at TEXT NOT NULL,
                     history_id TEXT
                 );
+
+                CREATE TABLE IF NOT EXISTS label_cache (
+                    name TEXT PRIMARY KEY,
+                    label_id TEXT NOT NULL,
+                    cached_at TEXT NOT NULL
+                );
+
+                CREATE TABLE IF NOT EXISTS sweep_checkpoint (
+                    sweep_id TEXT PRIMARY KEY,
+                    params TEXT NOT NULL DEFAULT '{}',
+                    parts TEXT NOT NULL DEFAULT '[]',
+                    status TEXT NOT NULL DEFAULT 'running',
+                    started_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                );
+
+                CREATE TABLE IF NOT EXISTS sweep_completed (
+                    sweep_id TEXT NOT NULL,
+                    thread_id TEXT NOT NULL,
+                    PRIMARY KEY (sweep_id, thread_id)
+                );
+
+                CREATE TABLE IF NOT EXISTS backfill_shards (
+                    backfill_id TEXT NOT NULL,
+                    after_ts INTEGER NOT NULL,
+                    before_ts INTEGER NOT NULL,
+                    estimate INTEGER,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    threads_scanned INTEGER NOT NULL DEFAULT 0,
+                    threads_modified INTEGER NOT NULL DEFAULT 0,
+                    cost_usd REAL NOT NULL DEFAULT 0.0,
+                    completed_at TEXT,
+                    PRIMARY KEY (backfill_id, after_ts)
+                );
+
+                CREATE TABLE IF NOT EXISTS label_plan (
+                    plan_id TEXT NOT NULL,
+                    thread_id TEXT NOT NULL,
+                    history_id TEXT,
+                    message_count INTEGER NOT NULL,
+                    subject TEXT,
+                    last_sender TEXT,
+                    add_labels TEXT NOT NULL,
+                    remove_labels TEXT NOT NULL,
+                    labels TEXT NOT NULL,
+                    reason TEXT,
+                    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                    completion_tokens INTEGER NOT NULL DEFAULT 0,
+                    cost_usd REAL NOT NULL DEFAULT 0.0,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    created_at TEXT NOT NULL,
+                    PRIMARY KEY (plan_id, thread_id)
+                );
+
+                CREATE TABLE IF NOT EXISTS draft_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    thread_id TEXT NOT NULL,
+                    labels TEXT NOT NULL,
+                    reason TEXT,
+                    subject TEXT,
+                    message TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    claimed_by TEXT,
+                    lease_expires_at TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    acked_at TEXT
+                );
+                -- At most one unclaimed entry per thread; newer decisions refresh it
+                CREATE UNIQUE INDEX IF NOT EXISTS draft_outbox_pending
+                    ON draft_outbox (thread_id) WHERE status = 'pending';
+
+                CREATE TABLE IF NOT EXISTS gmail_filters (
+                    gmail_filter_id TEXT PRIMARY KEY,
+                    sender TEXT NOT NULL,
+                    subject TEXT,
+                    labels TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                );
             """)
             
             # Simple schema migration for v1 to v2 (adding token/cost tracking)
@@ -56,6 +148,13 @@ class StateDB:
                 conn.execute("ALTER TABLE thread_cache ADD COLUMN prompt_tokens INTEGER DEFAULT 0")
                 conn.execute("ALTER TABLE thread_cache ADD COLUMN completion_tokens INTEGER DEFAULT 0")
                 conn.execute("ALTER TABLE thread_cache ADD COLUMN cost_usd REAL DEFAULT 0.0")
+            # v3: thread context for message-level updates
+            if 'subject' not in columns:
+                conn.execute("ALTER TABLE thread_cache ADD COLUMN subject TEXT")
+                conn.execute("ALTER TABLE thread_cache ADD COLUMN last_sender TEXT")
+            # v4: original sender address, mined for Gmail filter proposals
+            if 'sender' not in columns:
+                conn.execute("ALTER TABLE thread_cache ADD COLUMN sender TEXT")
                 
             conn.commit()
             logger.info(f"State DB initialized at {self.db_path}")
@@ -75,6 +174,7 @@ class StateDB:
         finally:
             conn.close()
 
+    @_synchronized
     def set_last_history_id(self, history_id):
         """Save the current Gmail historyId."""
         now = datetime.now().isoformat()
@@ -103,6 +203,7 @@ class StateDB:
         finally:
             conn.close()
 
+    @_synchronized
     def set_last_full_sweep(self):
         """Record that a full sweep just completed."""
         now = datetime.now().isoformat()
@@ -130,8 +231,8 @@ class StateDB:
     def get_thread_state(self, thread_id):
         """
         Get cached state for a thread.
-        Returns dict with message_count, applied_labels, last_processed_at
-        or None if not cached.
+        Returns dict with message_count, applied_labels, last_processed_at,
+        history_id, subject, last_sender and sender, or None if not cached.
         """
         conn = self._get_conn()
         try:
@@ -146,31 +247,66 @@ class StateDB:
                     "applied_labels": json.loads(row["applied_labels"]),
                     "last_processed_at": row["last_processed_at"],
                     "history_id": row["history_id"],
+                    "subject": row["subject"],
+                    "last_sender": row["last_sender"],
+                    "sender": row["sender"],
                 }
             return None
         finally:
             conn.close()
 
-    def update_thread_state(self, thread_id, message_count, labels, history_id=None, prompt_tokens=0, completion_tokens=0, cost_usd=0.0):
-        """Update or insert thread processing state."""
+    @_synchronized
+    def update_thread_state(self, thread_id, message_count, labels, history_id=None, prompt_tokens=0, completion_tokens=0, cost_usd=0.0,
+                            subject=None, last_sender=None, sender=None):
+        """
+        Update or insert thread processing state. A None subject/last_sender/
+        sender keeps the stored value. A row whose fields would not change and that
+        gains no tokens is left untouched. Returns True when a row was written.
+        """
         now = datetime.now().isoformat()
         labels_json = json.dumps(labels)
         conn = self._get_conn()
         try:
-            conn.execute(
+            cursor = conn.execute(
                 """INSERT INTO thread_cache 
-                   (thread_id, message_count, applied_labels, last_processed_at, history_id, prompt_tokens, completion_tokens, cost_usd)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   (thread_id, message_count, applied_labels, last_processed_at, history_id, prompt_tokens, completion_tokens, cost_usd,
+                    subject, last_sender, sender)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                    ON CONFLICT(thread_id) DO UPDATE SET 
                        message_count = ?, applied_labels = ?, last_processed_at = ?, history_id = ?,
-                       prompt_tokens = prompt_tokens + ?, completion_tokens = completion_tokens + ?, cost_usd = cost_usd + ?""",
+                       prompt_tokens = prompt_tokens + ?, completion_tokens = completion_tokens + ?, cost_usd = cost_usd + ?,
+                       subject = COALESCE(?, subject), last_sender = COALESCE(?, last_sender), sender = COALESCE(?, sender)
+                   WHERE message_count IS NOT excluded.message_count
+                       OR applied_labels IS NOT excluded.applied_labels
+                       OR history_id IS NOT excluded.history_id
+                       OR subject IS NOT COALESCE(excluded.subject, subject)
+                       OR last_sender IS NOT COALESCE(excluded.last_sender, last_sender)
+                       OR sender IS NOT COALESCE(excluded.sender, sender)
+                       OR excluded.prompt_tokens + excluded.completion_tokens > 0""",
                 (thread_id, message_count, labels_json, now, history_id, prompt_tokens, completion_tokens, cost_usd,
-                 message_count, labels_json, now, history_id, prompt_tokens, completion_tokens, cost_usd)
+                 subject, last_sender, sender,
+                 message_count, labels_json, now, history_id, prompt_tokens, completion_tokens, cost_usd,
+                 subject, last_sender, sender)
+            )
+            conn.commit()
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    @_synchronized
+    def set_thread_history_id(self, thread_id, history_id):
+        """Refresh the cached historyId of an unchanged thread."""
+        conn = self._get_conn()
+        try:
+            conn.execute(
+                "UPDATE thread_cache SET history_id = ? WHERE thread_id = ? AND history_id IS NOT ?",
+                (str(history_id), thread_id, str(history_id))
             )
             conn.commit()
         finally:
             conn.close()
 
+    @_synchronized
     def reset_thread_message_count(self, thread_id, new_count=0):
         """
         For testing: reset a thread's cached message count to force re-check.
@@ -187,6 +323,414 @@ class StateDB:
         finally:
             conn.close()
 
+    # ── Label Cache ─────────────────────────────────────────────
+
+    def get_label_map(self, max_age_hours=24):
+        """
+        Get the persisted label Name->ID map, or None if it is empty or
+        older than max_age_hours.
+        """
+        conn = self._get_conn()
+        try:
+            rows = conn.execute("SELECT name, label_id, cached_at FROM label_cache").fetchall()
+            if not rows:
+                return None
+            cached_at = min(datetime.fromisoformat(row["cached_at"]) for row in rows)
+            if datetime.now() - cached_at > timedelta(hours=max_age_hours):
+                return None
+            return {row["name"]: row["label_id"] for row in rows}
+        finally:
+            conn.close()
+
+    @_synchronized
+    def set_label_map(self, label_map):
+        """Replace the persisted label map (pass {} to invalidate it)."""
+        now = datetime.now().isoformat()
+        conn = self._get_conn()
+        try:
+            conn.execute("DELETE FROM label_cache")
+            conn.executemany(
+                "INSERT INTO label_cache (name, label_id, cached_at) VALUES (?, ?, ?)",
+                [(name, label_id, now) for name, label_id in label_map.items()]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ── Sweep Checkpoints ───────────────────────────────────────
+
+    @_synchronized
+    def start_sweep(self, sweep_id, params, run_id):
+        """
+        Record a new full sweep (abandoning any unfinished one) with its
+        parameters and a first part for run_id.
+        """
+        now = datetime.now().isoformat()
+        parts = [{"run_id": run_id, "started_at": now, "stats": {}}]
+        conn = self._get_conn()
+        try:
+            conn.execute("DELETE FROM sweep_completed WHERE sweep_id IN (SELECT sweep_id FROM sweep_checkpoint WHERE status = 'running')")
+            conn.execute("DELETE FROM sweep_checkpoint WHERE status = 'running'")
+            conn.execute(
+                """INSERT INTO sweep_checkpoint (sweep_id, params, parts, status, started_at, updated_at)
+                   VALUES (?, ?, ?, 'running', ?, ?)""",
+                (sweep_id, json.dumps(params), json.dumps(parts), now, now)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_active_sweep(self):
+        """
+        The unfinished full sweep, if any: dict with sweep_id, params, parts
+        (one {run_id, started_at, stats} per run that worked on it) and
+        started_at/updated_at. None if the last sweep completed.
+        """
+        conn = self._get_conn()
+        try:
+            row = conn.execute(
+                "SELECT * FROM sweep_checkpoint WHERE status = 'running' ORDER BY started_at DESC LIMIT 1"
+            ).fetchone()
+            if not row:
+                return None
+            return {
+                "sweep_id": row["sweep_id"],
+                "params": json.loads(row["params"]),
+                "parts": json.loads(row["parts"]),
+                "started_at": row["started_at"],
+                "updated_at": row["updated_at"],
+            }
+        finally:
+            conn.close()
+
+    @_synchronized
+    def add_sweep_part(self, sweep_id, run_id):
+        """Start a new part of an interrupted sweep for the resuming run."""
+        now = datetime.now().isoformat()
+        conn = self._get_conn()
+        try:
+            row = conn.execute("SELECT parts FROM sweep_checkpoint WHERE sweep_id = ?", (sweep_id,)).fetchone()
+            parts = json.loads(row["parts"]) if row else []
+            parts.append({"run_id": run_id, "started_at": now, "stats": {}})
+            conn.execute(
+                "UPDATE sweep_checkpoint SET parts = ?, updated_at = ? WHERE sweep_id = ?",
+                (json.dumps(parts), now, sweep_id)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    @_synchronized
+    def checkpoint_sweep(self, sweep_id, stats, completed_thread_ids=()):
+        """Save the current part's stats and mark threads as done for this sweep."""
+        now = datetime.now().isoformat()
+        conn = self._get_conn()
+        try:
+            row = conn.execute("SELECT parts FROM sweep_checkpoint WHERE sweep_id = ?", (sweep_id,)).fetchone()
+            if not row:
+                return
+            parts = json.loads(row["parts"])
+            parts[-1]["stats"] = stats
+            conn.execute(
+                "UPDATE sweep_checkpoint SET parts = ?, updated_at = ? WHERE sweep_id = ?",
+                (json.dumps(parts), now, sweep_id)
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO sweep_completed (sweep_id, thread_id) VALUES (?, ?)",
+                [(sweep_id, t_id) for t_id in completed_thread_ids]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_sweep_completed_threads(self, sweep_id):
+        """Set of thread IDs already finished by earlier parts of a sweep."""
+        conn = self._get_conn()
+        try:
+            rows = conn.execute("SELECT thread_id FROM sweep_completed WHERE sweep_id = ?", (sweep_id,)).fetchall()
+            return {row["thread_id"] for row in rows}
+        finally:
+            conn.close()
+
+    @_synchronized
+    def finish_sweep(self, sweep_id):
+        """Mark a sweep completed and drop its per-thread progress."""
+        now = datetime.now().isoformat()
+        conn = self._get_conn()
+        try:
+            conn.execute(
+                "UPDATE sweep_checkpoint SET status = 'completed', updated_at = ? WHERE sweep_id = ?",
+                (now, sweep_id)
+            )
+            conn.execute("DELETE FROM sweep_completed WHERE sweep_id = ?", (sweep_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ── Backfill Shards ─────────────────────────────────────────
+
+    @_synchronized
+    def save_backfill_plan(self, backfill_id, shards):
+        """Record the shards ({after, before, estimate}) planned for a backfill range."""
+        conn = self._get_conn()
+        try:
+            conn.executemany(
+                """INSERT OR IGNORE INTO backfill_shards (backfill_id, after_ts, before_ts, estimate)
+                   VALUES (?, ?, ?, ?)""",
+                [(backfill_id, s["after"], s["before"], s.get("estimate")) for s in shards]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_backfill_shards(self, backfill_id):
+        """Planned shards of a backfill range, newest first, as dicts with after/before/estimate/status."""
+        conn = self._get_conn()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM backfill_shards WHERE backfill_id = ? ORDER BY after_ts DESC",
+                (backfill_id,)
+            ).fetchall()
+            return [{
+                "after": row["after_ts"],
+                "before": row["before_ts"],
+                "estimate": row["estimate"],
+                "status": row["status"],
+                "threads_scanned": row["threads_scanned"],
+                "threads_modified": row["threads_modified"],
+                "cost_usd": row["cost_usd"],
+                "completed_at": row["completed_at"],
+            } for row in rows]
+        finally:
+            conn.close()
+
+    def get_unfinished_backfill_id(self, since):
+        """Latest backfill ID starting at since (ISO date) that still has pending shards, or None."""
+        conn = self._get_conn()
+        try:
+            row = conn.execute(
+                """SELECT backfill_id FROM backfill_shards
+                   WHERE backfill_id LIKE ? AND status != 'done'
+                   GROUP BY backfill_id ORDER BY MAX(rowid) DESC LIMIT 1""",
+                (f"{since}..%",)
+            ).fetchone()
+            return row["backfill_id"] if row else None
+        finally:
+            conn.close()
+
+    @_synchronized
+    def complete_backfill_shard(self, backfill_id, after, stats):
+        """Mark a backfill shard done with its final counters."""
+        now = datetime.now().isoformat()
+        conn = self._get_conn()
+        try:
+            conn.execute(
+                """UPDATE backfill_shards SET status = 'done', threads_scanned = ?, threads_modified = ?,
+                       cost_usd = ?, completed_at = ?
+                   WHERE backfill_id = ? AND after_ts = ?""",
+                (stats.get("threads_scanned", 0), stats.get("threads_modified", 0),
+                 stats.get("total_cost_usd", 0.0), now, backfill_id, after)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    @_synchronized
+    def save_plan_entry(self, plan_id, thread_id, entry):
+        """
+        Record a dry-run decision for later --mode apply. entry holds
+        history_id, message_count, subject, last_sender, add_labels,
+        remove_labels, labels (the full proposed set), reason and the
+        tokens/cost paid for the classification.
+        """
+        now = datetime.now().isoformat()
+        conn = self._get_conn()
+        try:
+            conn.execute(
+                """INSERT OR REPLACE INTO label_plan
+                   (plan_id, thread_id, history_id, message_count, subject, last_sender, add_labels, remove_labels,
+                    labels, reason, prompt_tokens, completion_tokens, cost_usd, status, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?)""",
+                (plan_id, thread_id, entry.get("history_id"), entry["message_count"], entry.get("subject"),
+                 entry.get("last_sender"), json.dumps(entry["add_labels"]), json.dumps(entry["remove_labels"]),
+                 json.dumps(entry["labels"]), entry.get("reason"), entry.get("prompt_tokens", 0),
+                 entry.get("completion_tokens", 0), entry.get("cost_usd", 0.0), now)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_latest_plan_id(self):
+        """The plan with pending entries saved most recently, or None."""
+        conn = self._get_conn()
+        try:
+            row = conn.execute(
+                "SELECT plan_id FROM label_plan WHERE status = 'pending' ORDER BY created_at DESC LIMIT 1"
+            ).fetchone()
+            return row["plan_id"] if row else None
+        finally:
+            conn.close()
+
+    def get_plan_entries(self, plan_id, status="pending"):
+        """Entries of a plan with the given status, as dicts shaped like save_plan_entry's."""
+        conn = self._get_conn()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM label_plan WHERE plan_id = ? AND status = ? ORDER BY created_at",
+                (plan_id, status)
+            ).fetchall()
+            return [{
+                "thread_id": row["thread_id"],
+                "history_id": row["history_id"],
+                "message_count": row["message_count"],
+                "subject": row["subject"],
+                "last_sender": row["last_sender"],
+                "add_labels": json.loads(row["add_labels"]),
+                "remove_labels": json.loads(row["remove_labels"]),
+                "labels": json.loads(row["labels"]),
+                "reason": row["reason"],
+                "prompt_tokens": row["prompt_tokens"],
+                "completion_tokens": row["completion_tokens"],
+                "cost_usd": row["cost_usd"],
+            } for row in rows]
+        finally:
+            conn.close()
+
+    @_synchronized
+    def set_plan_status(self, plan_id, thread_ids, status):
+        """Mark plan entries 'applied' or 'stale' (their thread changed since planning)."""
+        conn = self._get_conn()
+        try:
+            conn.executemany(
+                "UPDATE label_plan SET status = ? WHERE plan_id = ? AND thread_id = ?",
+                [(status, plan_id, t_id) for t_id in thread_ids]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    @_synchronized
+    def enqueue_draft(self, thread_id, labels, reason, subject, message):
+        """
+        Publish a thread that needs a reply drafted to the outbox, with its
+        labels, the classifier's reason and a snapshot of the latest message.
+        A still-unclaimed entry for the same thread is refreshed in place.
+        """
+        now = datetime.now().isoformat()
+        conn = self._get_conn()
+        try:
+            conn.execute(
+                """INSERT INTO draft_outbox (thread_id, labels, reason, subject, message, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (thread_id) WHERE status = 'pending' DO UPDATE SET
+                       labels = excluded.labels, reason = excluded.reason, subject = excluded.subject,
+                       message = excluded.message, created_at = excluded.created_at""",
+                (thread_id, json.dumps(labels), reason, subject, json.dumps(message), now)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    @_synchronized
+    def claim_drafts(self, consumer, limit=10, lease_seconds=300):
+        """
+        Claim up to `limit` outbox entries for `consumer`, oldest first.
+        Entries whose lease expired without an ack are handed out again.
+        Returns a list of entry dicts (id, thread_id, labels, reason,
+        subject, message, created_at, attempts).
+        """
+        now = datetime.now()
+        conn = self._get_conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")  # other processes may consume the same DB
+            rows = conn.execute(
+                """SELECT * FROM draft_outbox
+                   WHERE status = 'pending' OR (status = 'claimed' AND lease_expires_at < ?)
+                   ORDER BY id LIMIT ?""",
+                (now.isoformat(), limit)
+            ).fetchall()
+            lease_expires_at = (now + timedelta(seconds=lease_seconds)).isoformat()
+            conn.executemany(
+                """UPDATE draft_outbox SET status = 'claimed', claimed_by = ?, lease_expires_at = ?,
+                       attempts = attempts + 1
+                   WHERE id = ?""",
+                [(consumer, lease_expires_at, row["id"]) for row in rows]
+            )
+            conn.commit()
+            return [{
+                "id": row["id"],
+                "thread_id": row["thread_id"],
+                "labels": json.loads(row["labels"]),
+                "reason": row["reason"],
+                "subject": row["subject"],
+                "message": json.loads(row["message"]),
+                "created_at": row["created_at"],
+                "attempts": row["attempts"] + 1,
+            } for row in rows]
+        finally:
+            conn.close()
+
+    @_synchronized
+    def ack_draft(self, outbox_id, consumer):
+        """Mark a claimed entry done. False if it is not (or no longer) claimed by consumer."""
+        now = datetime.now().isoformat()
+        conn = self._get_conn()
+        try:
+            cursor = conn.execute(
+                """UPDATE draft_outbox SET status = 'acked', acked_at = ?
+                   WHERE id = ? AND status = 'claimed' AND claimed_by = ?""",
+                (now, outbox_id, consumer)
+            )
+            conn.commit()
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def get_labeled_senders(self):
+        """Cached threads with a known sender and labels: [{sender, subject, applied_labels}]."""
+        conn = self._get_conn()
+        try:
+            rows = conn.execute(
+                "SELECT sender, subject, applied_labels FROM thread_cache WHERE sender IS NOT NULL AND applied_labels != '[]'"
+            ).fetchall()
+            return [{
+                "sender": row["sender"],
+                "subject": row["subject"],
+                "applied_labels": json.loads(row["applied_labels"]),
+            } for row in rows]
+        finally:
+            conn.close()
+
+    @_synchronized
+    def save_gmail_filter(self, gmail_filter):
+        """Track a Gmail filter ({gmail_filter_id, from, subject, labels}) that applies our labels."""
+        now = datetime.now().isoformat()
+        conn = self._get_conn()
+        try:
+            conn.execute(
+                """INSERT OR REPLACE INTO gmail_filters (gmail_filter_id, sender, subject, labels, created_at)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (gmail_filter["gmail_filter_id"], gmail_filter["from"], gmail_filter.get("subject"),
+                 json.dumps(gmail_filter["labels"]), now)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_gmail_filters(self):
+        """Tracked Gmail filters, as dicts shaped like save_gmail_filter's."""
+        conn = self._get_conn()
+        try:
+            rows = conn.execute("SELECT * FROM gmail_filters ORDER BY created_at").fetchall()
+            return [{
+                "gmail_filter_id": row["gmail_filter_id"],
+                "from": row["sender"],
+                "subject": row["subject"],
+                "labels": json.loads(row["labels"]),
+            } for row in rows]
+        finally:
+            conn.close()
+
     def get_stats(self):
         """Get summary stats about the state DB."""
         conn = self._get_conn()
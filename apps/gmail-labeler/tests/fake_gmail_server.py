@@ -0,0 +1,172 @@
+"""
+Local stand-in for the Gmail REST API, used by client tests.
+Serves a tiny in-memory mailbox over HTTP/1.1 keep-alive and counts the
+TCP connections it accepts, so tests can assert connection reuse.
+"""
+
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+API_PREFIX = "/gmail/v1/users/me"
+
+
+class FakeMailbox:
+    def __init__(self):
+        self.labels = {"Label_1": "STATUS/New"}
+        self.history_id = "1000"
+        self.threads = {}
+        self.thread_pages = []
+        self.history_expired = False
+        self.history_records = []
+        self.modify_calls = []
+        self.requests = []
+        self.rate_limit_next = 0  # answer this many requests with 429 + Retry-After
+
+    def add_thread(self, thread_id, messages=1, history_id="900"):
+        self.threads[thread_id] = {
+            "id": thread_id,
+            "historyId": history_id,
+            "messages": [
+                {
+                    "id": f"{thread_id}-m{i}",
+                    "threadId": thread_id,
+                    "labelIds": ["INBOX"],
+                    "snippet": f"message {i}",
+                    "payload": {"headers": [{"name": "Subject", "value": f"Subject {thread_id}"}]},
+                }
+                for i in range(messages)
+            ],
+        }
+
+
+class FakeGmailHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None):
+        payload = json.dumps(body if body is not None else {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _rate_limited(self):
+        mailbox = self.server.mailbox
+        with self.server.lock:
+            if mailbox.rate_limit_next <= 0:
+                return False
+            mailbox.rate_limit_next -= 1
+        payload = json.dumps({"error": {"code": 429, "errors": [{"reason": "rateLimitExceeded"}]}}).encode()
+        self.send_response(429)
+        self.send_header("Retry-After", "0")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        return True
+
+    def do_GET(self):
+        mailbox = self.server.mailbox
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        path = url.path[len(API_PREFIX):]
+        mailbox.requests.append(("GET", path, params))
+        if self._rate_limited():
+            return
+
+        if path == "/profile":
+            return self._send(200, {"historyId": mailbox.history_id})
+        if path == "/labels":
+            return self._send(200, {"labels": [{"id": i, "name": n} for i, n in mailbox.labels.items()]})
+        if path == "/history":
+            if mailbox.history_expired:
+                return self._send(404, {"error": {"code": 404, "message": "Requested entity was not found."}})
+            return self._send(200, {"history": mailbox.history_records, "historyId": mailbox.history_id})
+        if path == "/threads":
+            page = int(params.get("pageToken", ["0"])[0])
+            pages = mailbox.thread_pages or [list(mailbox.threads)]
+            body = {"threads": [
+                {"id": t_id, "historyId": mailbox.threads[t_id]["historyId"]} for t_id in pages[page]
+            ]}
+            if page + 1 < len(pages):
+                body["nextPageToken"] = str(page + 1)
+            return self._send(200, body)
+        match = re.fullmatch(r"/threads/([^/]+)", path)
+        if match:
+            thread = mailbox.threads.get(match.group(1))
+            if thread is None:
+                return self._send(404, {"error": {"code": 404, "message": "Not Found"}})
+            return self._send(200, thread)
+        match = re.fullmatch(r"/messages/([^/]+)", path)
+        if match:
+            for thread in mailbox.threads.values():
+                for message in thread["messages"]:
+                    if message["id"] == match.group(1):
+                        return self._send(200, message)
+            return self._send(404, {"error": {"code": 404, "message": "Not Found"}})
+        return self._send(404, {"error": {"code": 404, "message": "Unknown path"}})
+
+    def do_POST(self):
+        mailbox = self.server.mailbox
+        url = urlparse(self.path)
+        path = url.path[len(API_PREFIX):]
+        body = self._read_body()
+        mailbox.requests.append(("POST", path, body))
+
+        if path == "/labels":
+            label_id = f"Label_{len(mailbox.labels) + 1}"
+            mailbox.labels[label_id] = body["name"]
+            return self._send(200, {"id": label_id, "name": body["name"]})
+        if path == "/messages/batchModify":
+            mailbox.modify_calls.append(body)
+            return self._send(200, {})
+        match = re.fullmatch(r"/threads/([^/]+)/modify", path)
+        if match:
+            mailbox.modify_calls.append(body)
+            return self._send(200, {"id": match.group(1), "historyId": "2000"})
+        return self._send(404, {"error": {"code": 404, "message": "Unknown path"}})
+
+
+class FakeGmailServer:
+    """Runs FakeGmailHandler on an ephemeral localhost port in a background thread."""
+
+    def __init__(self):
+        self.mailbox = FakeMailbox()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeGmailHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.mailbox = self.mailbox
+        self.httpd.connections = 0
+        self.httpd.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    @property
+    def connections(self):
+        return self.httpd.connections
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,97 @@
+import unittest
+import os
+import sys
+
+# Add parent dir (and this dir, for the fake server) to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_gmail_server import FakeGmailServer
+
+
+class FakeCredentials:
+    """Always-valid credentials so no OAuth refresh is attempted."""
+    valid = True
+    token = "test-token"
+
+
+class TestAsyncGmailClient(unittest.IsolatedAsyncioTestCase):
+    """AsyncGmailClient against a local fake Gmail HTTP server."""
+
+    def setUp(self):
+        self.server = FakeGmailServer().start()
+        self.mailbox = self.server.mailbox
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _create_client(self):
+        from async_gmail_client import AsyncGmailClient
+        return AsyncGmailClient(base_url=self.server.base_url, credentials=FakeCredentials())
+
+    async def test_batch_fetch_reuses_pooled_connections(self):
+        for i in range(20):
+            self.mailbox.add_thread(f"t{i}")
+
+        async with self._create_client() as client:
+            results, errors = await client.get_thread_details_batch(
+                [f"t{i}" for i in range(20)] + ["missing"]
+            )
+            await client.get_current_history_id()
+
+        self.assertEqual(len(results), 20)
+        self.assertIn("missing", errors)
+        # 22 requests, but keep-alive means far fewer TCP connections
+        self.assertLessEqual(self.server.connections, 20)
+        _, _, params = self.mailbox.requests[0]
+        self.assertEqual(params["format"], ["metadata"])
+
+    async def test_sequential_requests_share_one_connection(self):
+        self.mailbox.add_thread("t1")
+
+        async with self._create_client() as client:
+            for _ in range(5):
+                await client.get_thread_details("t1")
+
+        self.assertEqual(self.server.connections, 1)
+
+    async def test_paginated_listing_and_expired_history(self):
+        for i in range(3):
+            self.mailbox.add_thread(f"t{i}")
+        self.mailbox.thread_pages = [["t0", "t1"], ["t2"]]
+        self.mailbox.history_expired = True
+
+        async with self._create_client() as client:
+            threads = await client.fetch_recent_threads(days_lookback=7)
+            changed = await client.fetch_changed_threads_since("10")
+
+        self.assertEqual([t["id"] for t in threads], ["t0", "t1", "t2"])
+        self.assertIsNone(changed)
+
+    async def test_message_batch_fetch(self):
+        self.mailbox.add_thread("t1", messages=2)
+
+        async with self._create_client() as client:
+            results, errors = await client.get_message_details_batch(["t1-m0", "t1-m1", "t1-m0", "missing"])
+
+        self.assertEqual(sorted(results), ["t1-m0", "t1-m1"])
+        self.assertEqual(results["t1-m1"]["threadId"], "t1")
+        self.assertIn("missing", errors)
+
+
+    async def test_rate_limited_requests_are_retried(self):
+        from rate_limiter import QuotaRateLimiter
+        from async_gmail_client import AsyncGmailClient
+        self.mailbox.rate_limit_next = 2
+        limiter = QuotaRateLimiter()
+
+        async with AsyncGmailClient(base_url=self.server.base_url, credentials=FakeCredentials(),
+                                    limiter=limiter) as client:
+            history_id = await client.get_current_history_id()
+
+        self.assertEqual(history_id, "1000")
+        self.assertEqual(limiter.metrics()["rate_limited_responses"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import os
+import sys
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from filters import filter_criteria, matching_filter, propose_filters, subject_pattern
+
+ORDER = ["STATUS/New", "TYPE/Order", "ACTION/No-action", "PRIORITY/Low"]
+INVOICE = ["STATUS/Processed", "TYPE/Finance", "FINANCE/Invoice-incoming", "ACTION/Archive", "PRIORITY/Normal"]
+
+
+def rows(sender, subject, labels, count):
+    return [{"sender": sender, "subject": f"{subject} {i}", "applied_labels": labels} for i in range(count)]
+
+
+class TestFilterProposals(unittest.TestCase):
+    def test_subject_pattern_drops_numbers_and_reply_prefixes(self):
+        self.assertEqual(subject_pattern("Re: Fwd: Nová objednávka č. 1042"), "Nová objednávka č.")
+        self.assertEqual(subject_pattern("Order 12/2026 shipped"), "Order shipped")
+
+    def test_consistent_senders_and_subjects(self):
+        history = (
+            rows("shop@example.com", "Nová objednávka", ORDER, 25)
+            # A mixed sender: only its invoice mails are consistent
+            + rows("billing@example.com", "Invoice", INVOICE, 20)
+            + rows("billing@example.com", "Question about", ["TYPE/General-inquiry", "ACTION/Prepare-reply"], 20)
+            # Agree on TYPE only: a filter would leave STATUS/ACTION/PRIORITY unset
+            + rows("reports@example.com", "Report", ["TYPE/Analytics"], 20)
+            # Too few threads
+            + rows("rare@example.com", "Report", ORDER, 3)
+        )
+
+        proposals = propose_filters(history, min_threads=20, min_agreement=0.95)
+
+        self.assertEqual(
+            [(p["from"], p["subject"], p["labels"]) for p in proposals],
+            [("shop@example.com", None, ORDER),
+             ("billing@example.com", "Invoice", INVOICE)]
+        )
+        self.assertEqual(filter_criteria(proposals[1]), {"from": "billing@example.com", "subject": "Invoice"})
+
+    def test_matching_filter_requires_sender_subject_and_labels(self):
+        filters = [{"from": "billing@example.com", "subject": "Invoice", "labels": ["TYPE/Finance"]}]
+
+        self.assertIsNotNone(matching_filter(filters, "Billing <Billing@example.com>", "Invoice 2026-01", {"TYPE/Finance"}))
+        self.assertIsNone(matching_filter(filters, "billing@example.com", "Invoice 2026-01", set()))
+        self.assertIsNone(matching_filter(filters, "billing@example.com", "Question", {"TYPE/Finance"}))
+        self.assertIsNone(matching_filter(filters, "other@example.com", "Invoice", {"TYPE/Finance"}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import json
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gemini_client import GeminiClient
+
+LABELS = {"status": "New", "type": "Order", "finance": None, "action": "No-action", "priority": "Low", "reason": "Order"}
+
+
+def response(payload, prompt_tokens, completion_tokens):
+    return SimpleNamespace(
+        text=json.dumps(payload),
+        usage_metadata=SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=completion_tokens),
+    )
+
+
+class TestBatchClassification(unittest.TestCase):
+    def setUp(self):
+        with patch('gemini_client.Config.GEMINI_API_KEY', "fake"), patch('gemini_client.genai'):
+            self.client = GeminiClient()
+        self.generate = self.client.client.models.generate_content
+        self.requests = [
+            {"thread_id": "t1", "subject": "Nová objednávka 1", "message_count": 1, "thread_text": "Order 1"},
+            {"thread_id": "t2", "subject": "Nová objednávka 2", "message_count": 1, "thread_text": "Order 2"},
+            {"thread_id": "t3", "subject": "Where is my order?", "new_message_text": "Any news?",
+             "current_labels": ["STATUS/Waiting-for-reply"], "last_sender": "us"},
+        ]
+
+    def test_one_request_with_per_thread_fallback_for_failed_entries(self):
+        self.generate.side_effect = [
+            # t2 lacks a required field and t3 is missing altogether
+            response([{"thread_id": "t1", **LABELS}, {"thread_id": "t2", "status": "New"}], 900, 90),
+            response({**LABELS, "reason": "Retried"}, 500, 30),
+            response({**LABELS, "status": "Action-required", "reason": "Customer asks"}, 200, 20),
+        ]
+
+        results = self.client.classify_threads_batch(self.requests)
+
+        self.assertEqual(self.generate.call_count, 3)
+        batch_prompt = self.generate.call_args_list[0].kwargs["contents"]
+        for marker in ("=== THREAD t1 ===", "=== THREAD t2 ===", "=== THREAD t3 (UPDATE) ==="):
+            self.assertIn(marker, batch_prompt)
+        self.assertEqual(self.generate.call_args_list[0].kwargs["config"]["system_instruction"],
+                         self.client.batch_system_prompt)
+        # Only the failed entries were asked again, each with its own prompt
+        self.assertIn("Order 2", self.generate.call_args_list[1].kwargs["contents"])
+        self.assertEqual(self.generate.call_args_list[2].kwargs["config"]["system_instruction"],
+                         self.client.update_system_prompt)
+
+        self.assertEqual(results["t1"][0], LABELS)
+        self.assertEqual(results["t2"][0]["reason"], "Retried")
+        self.assertEqual(results["t3"][0]["status"], "Action-required")
+        # The batch's usage is split across its threads; fallbacks add their own
+        self.assertEqual(sum(tokens["prompt_tokens"] for _, tokens in results.values()), 900 + 500 + 200)
+        self.assertEqual(sum(tokens["completion_tokens"] for _, tokens in results.values()), 90 + 30 + 20)
+
+    def test_unparseable_batch_reply_still_counts_its_usage(self):
+        truncated = SimpleNamespace(
+            text='[{"thread_id": "t1", "status": "New", "ty',
+            usage_metadata=SimpleNamespace(prompt_token_count=900, candidates_token_count=60),
+        )
+        self.generate.side_effect = [
+            truncated,
+            response(LABELS, 500, 30),
+            response(LABELS, 400, 20),
+            None,  # the update fallback fails too
+        ]
+
+        results = self.client.classify_threads_batch(self.requests)
+
+        self.assertEqual(self.generate.call_count, 4)
+        self.assertEqual([results[t_id][0] for t_id in ("t1", "t2")], [LABELS] * 2)
+        self.assertIsNone(results["t3"][0])
+        # Every thread keeps its share of the billed batch call; fallbacks add their own usage
+        self.assertEqual(sum(tokens["prompt_tokens"] for _, tokens in results.values()), 900 + 500 + 400)
+        self.assertEqual(sum(tokens["completion_tokens"] for _, tokens in results.values()), 60 + 30 + 20)
+
+    def test_token_budget_splits_packs(self):
+        self.generate.side_effect = [
+            response([{"thread_id": t_id, **LABELS} for t_id in ("t1", "t2")], 400, 40),
+            response(LABELS, 300, 20),
+        ]
+
+        results = self.client.classify_threads_batch(self.requests, max_prompt_tokens=60)
+
+        # t1 and t2 share a prompt; t3 alone is sent as a plain update request
+        self.assertEqual(self.generate.call_count, 2)
+        self.assertEqual(self.generate.call_args_list[1].kwargs["config"]["system_instruction"],
+                         self.client.update_system_prompt)
+        self.assertEqual([results[t_id][0] for t_id in ("t1", "t2", "t3")], [LABELS] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+import unittest
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeBatch:
+    """Minimal stand-in for googleapiclient's BatchHttpRequest."""
+
+    def __init__(self, callback, responses, executed):
+        self.callback = callback
+        self.responses = responses
+        self.executed = executed
+        self.request_ids = []
+
+    def add(self, request, request_id=None):
+        self.request_ids.append(request_id)
+
+    def execute(self):
+        self.executed.append(list(self.request_ids))
+        for request_id in self.request_ids:
+            response = self.responses.get(request_id)
+            if isinstance(response, Exception):
+                self.callback(request_id, None, response)
+            else:
+                self.callback(request_id, response, None)
+
+
+class TestGmailClientBatch(unittest.TestCase):
+    """Tests for GmailClient batch helpers with the discovery service mocked."""
+
+    def _create_client(self, responses):
+        with patch('gmail_client.build') as mock_build, \
+             patch('gmail_client.Credentials'):
+            from gmail_client import GmailClient
+            client = GmailClient()
+
+        self.executed = []
+        service = mock_build.return_value
+        service.new_batch_http_request.side_effect = (
+            lambda callback: FakeBatch(callback, responses, self.executed)
+        )
+        return client
+
+    def test_batch_splits_results_and_errors(self):
+        client = self._create_client({
+            "t1": {"id": "t1", "messages": []},
+            "t2": ValueError("boom"),
+        })
+
+        results, errors = client.get_thread_details_batch(["t1", "t2"])
+
+        self.assertEqual(list(results), ["t1"])
+        self.assertEqual(errors, {"t2": "boom"})
+
+    def test_batch_chunks_and_dedupes(self):
+        ids = [f"t{i}" for i in range(5)]
+        client = self._create_client({t: {"id": t} for t in ids})
+
+        results, errors = client.get_thread_details_batch(ids + ["t0"], batch_size=2)
+
+        self.assertEqual(self.executed, [["t0", "t1"], ["t2", "t3"], ["t4"]])
+        self.assertEqual(len(results), 5)
+        self.assertEqual(errors, {})
+
+    @patch('gmail_client.time.sleep')
+    def test_batch_retries_transport_errors(self, mock_sleep):
+        client = self._create_client({"t1": {"id": "t1"}, "t2": {"id": "t2"}})
+        calls = []
+
+        def flaky(callback):
+            batch = FakeBatch(callback, {"t1": {"id": "t1"}, "t2": {"id": "t2"}}, self.executed)
+            calls.append(batch)
+            if len(calls) == 1:
+                batch.execute = MagicMock(side_effect=ConnectionResetError("connection reset by peer"))
+            return batch
+
+        client.service.new_batch_http_request.side_effect = flaky
+        results, errors = client.get_thread_details_batch(["t1", "t2"])
+
+        self.assertEqual(sorted(results), ["t1", "t2"])
+        self.assertEqual(errors, {})
+        mock_sleep.assert_called_once()
+
+    @patch('gmail_client.time.sleep')
+    def test_batch_transport_errors_become_per_thread_errors(self, mock_sleep):
+        import socket
+        client = self._create_client({})
+        client.service.new_batch_http_request.side_effect = lambda callback: MagicMock(
+            execute=MagicMock(side_effect=socket.timeout("timed out"))
+        )
+
+        with patch('gmail_client.Config.GMAIL_MAX_RETRIES', 2):
+            results, errors = client.get_thread_details_batch(["t1", "t2"])
+
+        self.assertEqual(results, {})
+        self.assertEqual(errors, {"t1": "timed out", "t2": "timed out"})
+        self.assertEqual(mock_sleep.call_count, 2)
+
+
+    def test_thread_fetch_defaults_to_metadata(self):
+        from gmail_client import METADATA_HEADERS
+        client = self._create_client({})
+        threads = client.service.users.return_value.threads.return_value
+
+        client.get_thread_details("t1")
+        _, kwargs = threads.get.call_args
+        self.assertEqual(kwargs["format"], "metadata")
+        self.assertEqual(kwargs["metadataHeaders"], METADATA_HEADERS)
+        self.assertIn("fields", kwargs)
+
+        client.get_thread_details("t1", full=True)
+        _, kwargs = threads.get.call_args
+        self.assertEqual(kwargs["format"], "full")
+        self.assertNotIn("fields", kwargs)
+
+    def test_thread_listing_streams_pages_within_limit(self):
+        client = self._create_client({})
+        threads = client.service.users.return_value.threads.return_value
+        threads.list.return_value.execute.side_effect = [
+            {"threads": [{"id": f"a{i}"} for i in range(500)], "nextPageToken": "p2"},
+            {"threads": [{"id": f"b{i}"} for i in range(100)], "nextPageToken": "p3"},
+        ]
+
+        stream = client.iter_recent_threads(days_lookback=7, limit=600)
+        self.assertEqual(next(stream)["id"], "a0")
+        self.assertEqual(threads.list.call_args.kwargs["maxResults"], 500)
+
+        self.assertEqual(len(list(stream)), 599)
+        # Second page only asks for what the limit still needs
+        self.assertEqual(threads.list.call_args.kwargs["maxResults"], 100)
+        self.assertEqual(threads.list.return_value.execute.call_count, 2)
+
+    def test_history_changes_group_label_deltas_per_thread(self):
+        client = self._create_client({})
+        history = client.service.users.return_value.history.return_value
+        history.list.return_value.execute.return_value = {"history": [
+            {"messagesAdded": [{"message": {"id": "m2", "threadId": "t1"}}]},
+            {"labelsAdded": [{"labelIds": ["L1"], "message": {"id": "m1", "threadId": "t2"}}]},
+            {"labelsRemoved": [{"labelIds": ["L2"], "message": {"id": "m1", "threadId": "t2"}}]},
+        ]}
+
+        changes = client.fetch_history_changes("100")
+
+        self.assertEqual(changes["t1"]["messages_added"], ["m2"])
+        self.assertEqual(changes["t2"]["labels_added"], {"L1"})
+        self.assertEqual(changes["t2"]["labels_removed"], {"L2"})
+        self.assertEqual(changes["t2"]["label_records"], 2)
+        self.assertEqual(sorted(client.fetch_changed_threads_since("100")), ["t1", "t2"])
+
+
+class TestGmailClientLabelCache(unittest.TestCase):
+    """Label map persistence: labels.list only on a cold or stale cache."""
+
+    def setUp(self):
+        import tempfile
+        from state import StateDB
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.state = StateDB(os.path.join(self.temp_dir.name, "state.db"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _create_client(self):
+        with patch('gmail_client.build') as mock_build, \
+             patch('gmail_client.Credentials'):
+            from gmail_client import GmailClient
+            client = GmailClient(state=self.state)
+        labels = mock_build.return_value.users.return_value.labels.return_value
+        labels.list.return_value.execute.return_value = {
+            "labels": [{"id": "Label_1", "name": "STATUS/New"}]
+        }
+        labels.create.return_value.execute.side_effect = lambda: {"id": "Label_2"}
+        return client, labels
+
+    def test_persisted_map_avoids_relisting(self):
+        client, labels = self._create_client()
+        client.ensure_labels_exist(["STATUS/New", "STATUS/Closed"])
+        self.assertEqual(labels.list.call_count, 1)
+        self.assertEqual(self.state.get_label_map(), {"STATUS/New": "Label_1", "STATUS/Closed": "Label_2"})
+
+        # A new client (next scheduler tick) reuses the persisted map
+        client, labels = self._create_client()
+        client.ensure_labels_exist(["STATUS/New", "STATUS/Closed"])
+        client.resolve_label_ids(["STATUS/Closed"], ["STATUS/New"])
+        labels.list.assert_not_called()
+        labels.create.assert_not_called()
+
+    def test_lookup_miss_relists_once(self):
+        self.state.set_label_map({"STATUS/Closed": "Label_9"})
+        client, labels = self._create_client()
+
+        add_ids, _ = client.resolve_label_ids(["STATUS/New"], [])
+
+        self.assertEqual(add_ids, ["Label_1"])
+        self.assertEqual(labels.list.call_count, 1)
+
+
+class TestLabelApplyQueue(unittest.TestCase):
+    """Tests for grouped batchModify label application."""
+
+    def _create_queue(self):
+        from gmail_client import LabelApplyQueue
+        gmail = MagicMock()
+        label_map = {"STATUS/New": "L1", "TYPE/Order": "L2", "STATUS/Closed": "L3"}
+        gmail.resolve_label_ids.side_effect = lambda add, remove: (
+            [label_map[n] for n in add], [label_map[n] for n in remove]
+        )
+        return LabelApplyQueue(gmail), gmail
+
+    def test_groups_identical_label_sets(self):
+        queue, gmail = self._create_queue()
+        queue.enqueue("t1", ["m1", "m2"], ["STATUS/New", "TYPE/Order"], [])
+        queue.enqueue("t2", ["m3"], ["TYPE/Order", "STATUS/New"], [])
+        queue.enqueue("t3", ["m4"], ["STATUS/Closed"], ["STATUS/New"])
+
+        reports = queue.flush()
+
+        self.assertEqual(gmail.batch_modify_messages.call_count, 2)
+        self.assertEqual(len(reports), 2)
+        self.assertEqual(reports[0]["applied_threads"], ["t1", "t2"])
+        self.assertEqual(reports[0]["message_count"], 3)
+        self.assertEqual(len(queue), 0)
+
+    def test_chunks_and_reports_failures(self):
+        from googleapiclient.errors import HttpError
+        from gmail_client import BATCH_MODIFY_LIMIT
+        queue, gmail = self._create_queue()
+        queue.enqueue("t1", [f"a{i}" for i in range(BATCH_MODIFY_LIMIT)], ["STATUS/New"], [])
+        queue.enqueue("t2", ["b1"], ["STATUS/New"], [])
+        gmail.batch_modify_messages.side_effect = [
+            None, HttpError(MagicMock(status=500), b"backend error")
+        ]
+
+        report = queue.flush()[0]
+
+        self.assertEqual(report["api_calls"], 2)
+        self.assertEqual(report["applied_threads"], ["t1"])
+        self.assertEqual(report["failed_threads"], ["t2"])
+        self.assertIsNotNone(report["error"])
+
+    def test_flush_selected_threads_only(self):
+        """A backfill shard flushes its own threads; other shards' stay queued."""
+        queue, gmail = self._create_queue()
+        queue.enqueue("t1", ["m1"], ["STATUS/New"], [])
+        queue.enqueue("t2", ["m2"], ["STATUS/New"], [])
+        queue.enqueue("t3", ["m3"], ["STATUS/Closed"], [])
+
+        reports = queue.flush(["t1"])
+
+        self.assertEqual([r["applied_threads"] for r in reports], [["t1"]])
+        gmail.batch_modify_messages.assert_called_once_with(["m1"], ("L1",), ())
+        self.assertEqual(len(queue), 2)
+        self.assertEqual([r["applied_threads"] for r in queue.flush()], [["t2"], ["t3"]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+# Add parent dir (and this dir, for the fake server) to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from google.oauth2.credentials import Credentials
+from fake_gmail_server import FakeGmailServer
+
+
+class TestPooledGmailTransport(unittest.TestCase):
+    """GmailClient on the pooled requests transport against a local fake Gmail server."""
+
+    def setUp(self):
+        self.server = FakeGmailServer().start()
+        self.mailbox = self.server.mailbox
+        for i in range(10):
+            self.mailbox.add_thread(f"t{i}")
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _create_client(self, pool_size=4):
+        from gmail_client import GmailClient
+        from rate_limiter import QuotaRateLimiter
+        host, port = self.server.httpd.server_address
+        with patch('gmail_client.Config.GMAIL_POOLED_HTTP', True), \
+             patch('http_transport.Config.GMAIL_HTTP_POOL_SIZE', pool_size):
+            client = GmailClient(
+                limiter=QuotaRateLimiter(100000),
+                # An access token without expiry is always valid: no OAuth refresh
+                credentials=Credentials("test-token"),
+                api_endpoint=f"http://{host}:{port}/",
+            )
+        self.addCleanup(client.close)
+        return client
+
+    def test_sequential_calls_reuse_one_connection(self):
+        client = self._create_client()
+
+        for _ in range(5):
+            self.assertEqual(client.get_thread_details("t1")["id"], "t1")
+        self.assertEqual(client.get_current_history_id(), "1000")
+
+        self.assertEqual(self.server.connections, 1)
+
+    def test_one_client_shared_by_worker_threads(self):
+        client = self._create_client(pool_size=4)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            threads = list(pool.map(lambda i: client.get_thread_details(f"t{i % 10}"), range(80)))
+
+        self.assertEqual([t["id"] for t in threads], [f"t{i % 10}" for i in range(80)])
+        # 80 requests from 8 threads over a pool capped at 4 keep-alive connections
+        self.assertLessEqual(self.server.connections, 4)
+
+    def test_errors_and_retry_after_pass_through(self):
+        client = self._create_client()
+        self.mailbox.rate_limit_next = 1
+
+        self.assertEqual(client.get_thread_details("t2")["id"], "t2")
+        self.assertIsNone(client.get_thread_details("missing"))
+        self.assertEqual(client.limiter.metrics()["rate_limited_responses"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,12 +3,20 @@ import unittest
 import tempfile
 import os
 import sys
-from unittest.mock import MagicMock, patch, PropertyMock
+from unittest.mock import AsyncMock, MagicMock, patch, PropertyMock
 
 # Add parent dir to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 
+def _new_messages(*thread_ids):
+    """History changes where each thread received one new message."""
+    return {
+        t_id: {"messages_added": [f"m-{t_id}"], "labels_added": set(), "labels_removed": set(), "label_records": 0}
+        for t_id in thread_ids
+    }
+
+
 class TestLabelerModes(unittest.TestCase):
     """Tests for the Labeler incremental vs full-sweep logic with mocked dependencies."""
 
@@ -31,6 +39,8 @@ class TestLabelerModes(unittest.TestCase):
             labeler.gmail = MockGmail.return_value
             labeler.gemini = MockGemini.return_value
             labeler.state = MockState.return_value
+            # One Gemini prompt per thread; batched prompts have their own test
+            labeler.gemini_batch_size = 1
             
             return labeler
 
@@ -44,13 +54,13 @@ class TestLabelerModes(unittest.TestCase):
         """If no history ID exists, incremental should fall back to full sweep."""
         labeler = self._create_labeler()
         labeler.state.get_last_history_id.return_value = None
-        labeler.gmail.fetch_recent_threads.return_value = []
+        labeler.gmail.iter_recent_threads.return_value = []
         labeler.gmail.get_current_history_id.return_value = "99999"
         
         result = labeler.run_incremental(dry_run=True)
         
-        # Should have called fetch_recent_threads (full sweep fallback)
-        labeler.gmail.fetch_recent_threads.assert_called()
+        # Should have listed recent threads (full sweep fallback)
+        labeler.gmail.iter_recent_threads.assert_called()
 
     @patch.dict(os.environ, {
         "GOOGLE_CLIENT_ID": "fake",
@@ -62,14 +72,15 @@ class TestLabelerModes(unittest.TestCase):
         """If history shows no changes, should skip everything."""
         labeler = self._create_labeler()
         labeler.state.get_last_history_id.return_value = "1000"
-        labeler.gmail.fetch_changed_threads_since.return_value = []
+        labeler.gmail.fetch_history_changes.return_value = {}
         labeler.gmail.get_current_history_id.return_value = "1001"
         
         result = labeler.run_incremental(dry_run=True)
         
         self.assertEqual(result.get("threads_scanned"), 0)
-        # Should NOT call get_thread_details (nothing to process)
+        # Should NOT fetch any thread (nothing to process)
         labeler.gmail.get_thread_details.assert_not_called()
+        labeler.gmail.get_thread_details_batch.assert_not_called()
 
     @patch.dict(os.environ, {
         "GOOGLE_CLIENT_ID": "fake",
@@ -80,7 +91,7 @@ class TestLabelerModes(unittest.TestCase):
     def test_full_sweep_skips_unchanged(self):
         """Full sweep should skip threads with same message count."""
         labeler = self._create_labeler()
-        labeler.gmail.fetch_recent_threads.return_value = [{"id": "t1"}]
+        labeler.gmail.iter_recent_threads.return_value = [{"id": "t1"}]
         labeler.gmail.get_current_history_id.return_value = "99999"
         
         # Thread has 3 messages, cache says 3 → skip
@@ -91,9 +102,9 @@ class TestLabelerModes(unittest.TestCase):
             "last_processed_at": "2026-01-01",
             "history_id": "1000"
         }
-        labeler.gmail.get_thread_details.return_value = {
-            "messages": [{"labelIds": []}, {"labelIds": []}, {"labelIds": []}]
-        }
+        labeler.gmail.get_thread_details_batch.return_value = ({
+            "t1": {"messages": [{"labelIds": []}, {"labelIds": []}, {"labelIds": []}]}
+        }, {})
         
         result = labeler.run_full_sweep(dry_run=True)
         
@@ -110,22 +121,24 @@ class TestLabelerModes(unittest.TestCase):
     def test_dry_run_does_not_modify(self):
         """Dry run should NOT call modify_thread_labels."""
         labeler = self._create_labeler()
-        labeler.gmail.fetch_recent_threads.return_value = [{"id": "t1"}]
+        labeler.gmail.iter_recent_threads.return_value = [{"id": "t1"}]
         labeler.gmail.get_current_history_id.return_value = "99999"
         labeler.state.get_thread_state.return_value = None  # New thread
-        labeler.gmail.get_thread_details.return_value = {
-            "messages": [{
-                "labelIds": [],
-                "snippet": "Hello, I have a question about my order",
-                "payload": {
-                    "headers": [
-                        {"name": "From", "value": "customer@example.com"},
-                        {"name": "Date", "value": "2026-03-01"},
-                        {"name": "Subject", "value": "Order Question"},
-                    ]
-                }
-            }]
-        }
+        labeler.gmail.get_thread_details_batch.return_value = ({
+            "t1": {
+                "messages": [{
+                    "labelIds": [],
+                    "snippet": "Hello, I have a question about my order",
+                    "payload": {
+                        "headers": [
+                            {"name": "From", "value": "customer@example.com"},
+                            {"name": "Date", "value": "2026-03-01"},
+                            {"name": "Subject", "value": "Order Question"},
+                        ]
+                    }
+                }]
+            }
+        }, {})
         labeler.gmail.get_label_map.return_value = {}
         labeler.gemini.classify_thread.return_value = {
             "status": "New",
@@ -143,6 +156,955 @@ class TestLabelerModes(unittest.TestCase):
         labeler.gmail.modify_thread_labels.assert_not_called()
         # But should still report as modified
         self.assertEqual(result.get("threads_modified"), 0)
+        # A new thread was only ever fetched once, so no fetch was saved
+        self.assertEqual(result.get("thread_fetches_saved"), 0)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_incremental_uses_batch_fetch(self):
+        """Incremental run should fetch changed threads in one batch and count per-thread errors."""
+        labeler = self._create_labeler()
+        labeler.state.get_last_history_id.return_value = "1000"
+        labeler.gmail.fetch_history_changes.return_value = _new_messages("t1", "t2")
+        labeler.gmail.get_current_history_id.return_value = "1001"
+        labeler.state.get_thread_state.return_value = None
+        labeler.gmail.get_thread_details_batch.return_value = (
+            {"t1": {"messages": []}},
+            {"t2": "<HttpError 404>"},
+        )
+
+        result = labeler.run_incremental(dry_run=True)
+
+        labeler.gmail.get_thread_details_batch.assert_called_once_with(["t1", "t2"])
+        labeler.gmail.get_thread_details.assert_not_called()
+        self.assertEqual(result.get("errors"), 1)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_full_sweep_fetches_changed_thread_once(self):
+        """A cached thread with new messages is fetched and looked up only once."""
+        labeler = self._create_labeler()
+        labeler.gmail.iter_recent_threads.return_value = [{"id": "t1"}]
+        labeler.gmail.get_current_history_id.return_value = "99999"
+        labeler.state.get_thread_state.return_value = {
+            "thread_id": "t1",
+            "message_count": 1,
+            "applied_labels": ["STATUS/New"],
+            "last_processed_at": "2026-01-01",
+            "history_id": "1000"
+        }
+        message = {
+            "id": "m1",
+            "labelIds": [],
+            "snippet": "Any update?",
+            "payload": {"headers": [{"name": "Subject", "value": "Order"}]}
+        }
+        labeler.gmail.get_thread_details_batch.return_value = (
+            {"t1": {"messages": [message, message]}}, {}
+        )
+        labeler.gmail.get_label_map.return_value = {}
+        labeler.gemini.classify_thread_update.return_value = ({
+            "status": "New",
+            "type": "Order",
+            "finance": None,
+            "action": "No-action",
+            "priority": "Normal",
+            "reason": "Follow-up"
+        }, {"prompt_tokens": 10, "completion_tokens": 5})
+
+        result = labeler.run_full_sweep(dry_run=True)
+
+        labeler.gmail.get_thread_details.assert_not_called()
+        labeler.state.get_thread_state.assert_called_once_with("t1")
+        labeler.gemini.classify_thread_update.assert_called_once()
+        self.assertEqual(result.get("thread_fetches_saved"), 1)
+        self.assertEqual(result.get("state_lookups_saved"), 1)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_full_sweep_skips_matching_history_id_without_fetch(self):
+        """Threads whose listed historyId matches the cache are never fetched."""
+        labeler = self._create_labeler()
+        labeler.gmail.iter_recent_threads.return_value = [{"id": "t1", "historyId": "1000"}]
+        labeler.gmail.get_current_history_id.return_value = "99999"
+        labeler.state.get_thread_state.return_value = {
+            "thread_id": "t1",
+            "message_count": 3,
+            "applied_labels": ["STATUS/Processed"],
+            "last_processed_at": "2026-01-01",
+            "history_id": "1000"
+        }
+
+        result = labeler.run_full_sweep()
+
+        labeler.gmail.get_thread_details_batch.assert_not_called()
+        labeler.gmail.get_thread_details.assert_not_called()
+        self.assertEqual(result.get("threads_skipped"), 1)
+        self.assertEqual(result.get("history_id_skips"), 1)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_labels_applied_through_queue_at_end_of_run(self):
+        """Real runs queue label changes and record state only after the batch flush."""
+        labeler = self._create_labeler()
+        labeler.apply_queue = MagicMock()
+        labeler.apply_queue.enqueue.return_value = True
+        labeler.apply_queue.__len__.return_value = 1
+        labeler.apply_queue.flush.return_value = [{
+            "add_label_ids": ["L1"], "remove_label_ids": [], "message_count": 1,
+            "api_calls": 1, "applied_threads": ["t1"], "failed_threads": [], "error": None,
+        }]
+        labeler.gmail.iter_recent_threads.return_value = [{"id": "t1"}]
+        labeler.gmail.get_current_history_id.return_value = "99999"
+        labeler.state.get_thread_state.return_value = None
+        labeler.gmail.get_thread_details_batch.return_value = ({
+            "t1": {"historyId": "500", "messages": [{
+                "id": "m1",
+                "labelIds": [],
+                "snippet": "New order #123",
+                "payload": {"headers": [{"name": "Subject", "value": "Order"}]}
+            }]}
+        }, {})
+        labeler.gmail.get_label_map.return_value = {}
+        labeler.gemini.classify_thread.return_value = ({
+            "status": "New", "type": "Order", "finance": None,
+            "action": "No-action", "priority": "Low", "reason": "Order notification"
+        }, {"prompt_tokens": 10, "completion_tokens": 5})
+
+        result = labeler.run_full_sweep()
+
+        labeler.gmail.modify_thread_labels.assert_not_called()
+        labeler.apply_queue.enqueue.assert_called_once()
+        labeler.state.update_thread_state.assert_called_once()
+        self.assertEqual(labeler.state.update_thread_state.call_args.kwargs["history_id"], "500")
+        self.assertEqual(result.get("label_groups_applied"), 1)
+        self.assertEqual(result.get("threads_modified"), 1)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_correct_labels_skip_modify_call(self):
+        """Threads already carrying the proposed labels count as unchanged; others get only the missing ones."""
+        labeler = self._create_labeler()
+        labeler.apply_queue = None
+        proposed = {"STATUS/New": "L1", "TYPE/Order": "L2", "ACTION/No-action": "L3", "PRIORITY/Low": "L4"}
+        labeler.gmail.get_label_map.return_value = proposed
+        labeler.gmail.iter_recent_threads.return_value = [{"id": "t1"}, {"id": "t2"}]
+        labeler.gmail.get_current_history_id.return_value = "99999"
+        labeler.state.get_thread_state.return_value = None
+
+        def thread(*label_ids):
+            return {"historyId": "500", "messages": [{
+                "id": "m1", "labelIds": list(label_ids), "snippet": "New order #123",
+                "payload": {"headers": [{"name": "Subject", "value": "Order"}]}
+            }]}
+
+        labeler.gmail.get_thread_details_batch.return_value = ({
+            "t1": thread("L1", "L2", "L3", "L4", "INBOX"),
+            "t2": thread("L1", "L2", "L3"),
+        }, {})
+        labeler.gemini.classify_thread.return_value = ({
+            "status": "New", "type": "Order", "finance": None,
+            "action": "No-action", "priority": "Low", "reason": "Order notification"
+        }, {"prompt_tokens": 10, "completion_tokens": 5})
+
+        result = labeler.run_full_sweep()
+
+        labeler.gmail.modify_thread_labels.assert_called_once_with("t2", add_labels=["PRIORITY/Low"], remove_labels=[])
+        self.assertEqual(result.get("threads_unchanged"), 1)
+        self.assertEqual(result.get("threads_modified"), 1)
+        self.assertEqual(labeler.state.update_thread_state.call_count, 2)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_failed_label_write_is_not_recorded(self):
+        """A threads.modify that fails after its retries is an error: nothing is cached or published."""
+        from googleapiclient.errors import HttpError
+        labeler = self._create_labeler()
+        labeler.apply_queue = None
+        labeler.gmail.get_label_map.return_value = {}
+        labeler.gmail.iter_recent_threads.return_value = [{"id": "t1"}]
+        labeler.gmail.get_current_history_id.return_value = "99999"
+        labeler.state.get_thread_state.return_value = None
+        labeler.gmail.get_thread_details_batch.return_value = ({"t1": {"historyId": "500", "messages": [{
+            "id": "m1", "labelIds": [], "snippet": "Where is my parcel?",
+            "payload": {"headers": [{"name": "Subject", "value": "Order 42"}]}
+        }]}}, {})
+        labeler.gemini.classify_thread.return_value = ({
+            "status": "New", "type": "Shipping", "finance": None,
+            "action": "Prepare-reply", "priority": "Normal", "reason": "Customer asks"
+        }, {"prompt_tokens": 10, "completion_tokens": 5})
+        labeler.gmail.modify_thread_labels.side_effect = HttpError(MagicMock(status=503), b"backend error")
+
+        result = labeler.run_full_sweep()
+
+        labeler.state.update_thread_state.assert_not_called()
+        labeler.state.enqueue_draft.assert_not_called()
+        self.assertEqual(result.get("errors"), 1)
+        self.assertEqual(result.get("threads_modified"), 0)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_workers_aggregate_stats(self):
+        """With a worker pool, per-thread stats are merged into one run summary."""
+        labeler = self._create_labeler()
+        labeler.workers = 4
+        thread_ids = [f"t{i}" for i in range(10)]
+        labeler.state.get_last_history_id.return_value = "1000"
+        labeler.gmail.fetch_history_changes.return_value = _new_messages(*thread_ids)
+        labeler.gmail.get_current_history_id.return_value = "1001"
+        labeler.state.get_thread_state.return_value = None
+        message = {
+            "id": "m1",
+            "labelIds": [],
+            "snippet": "Order shipped",
+            "payload": {"headers": [{"name": "Subject", "value": "Shipping"}]}
+        }
+        labeler.gmail.get_thread_details_batch.side_effect = lambda ids: (
+            {t_id: {"messages": [message]} for t_id in ids}, {}
+        )
+        labeler.gmail.get_label_map.return_value = {}
+        labeler.gemini.classify_thread.return_value = ({
+            "status": "Processed", "type": "Shipping", "finance": None,
+            "action": "No-action", "priority": "Low", "reason": "Notification"
+        }, {"prompt_tokens": 100, "completion_tokens": 10})
+
+        result = labeler.run_incremental(dry_run=True)
+
+        self.assertEqual(result.get("threads_modified"), 10)
+        self.assertEqual(result.get("total_tokens_spent"), 1100)
+        self.assertEqual(result.get("errors"), 0)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_failed_batch_fetch_does_not_abort_incremental_run(self):
+        """A fetch that raises counts its threads as errors; the run goes on with the next batch."""
+        labeler = self._create_labeler()
+        labeler.state.get_last_history_id.return_value = "1000"
+        labeler.gmail.fetch_history_changes.return_value = _new_messages("t1", "t2")
+        labeler.gmail.get_current_history_id.return_value = "1001"
+        labeler.state.get_thread_state.return_value = None
+        labeler.gmail.get_label_map.return_value = {}
+        message = {"id": "m1", "labelIds": [], "snippet": "Order shipped",
+                   "payload": {"headers": [{"name": "Subject", "value": "Shipping"}]}}
+        labeler.gmail.get_thread_details_batch.side_effect = [
+            ConnectionResetError("connection reset by peer"),
+            ({"t2": {"messages": [message]}}, {}),
+        ]
+        labeler.gemini.classify_thread.return_value = ({
+            "status": "Processed", "type": "Shipping", "finance": None,
+            "action": "No-action", "priority": "Low", "reason": "Notification"
+        }, {"prompt_tokens": 100, "completion_tokens": 10})
+
+        with patch('labeler.Config.GMAIL_BATCH_SIZE', 1):
+            result = labeler.run_incremental(dry_run=True)
+
+        self.assertEqual(result.get("errors"), 1)
+        self.assertEqual(result.get("threads_modified"), 1)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_async_client_drives_thread_fetches(self):
+        """With the async client enabled, thread fetches run on the labeler's event loop."""
+        labeler = self._create_labeler()
+        labeler._start_async_loop()
+        labeler.async_gmail = AsyncMock()
+        labeler.async_gmail.get_thread_details_batch.return_value = ({"t1": {"messages": []}}, {})
+        labeler.state.get_last_history_id.return_value = "1000"
+        labeler.gmail.fetch_history_changes.return_value = _new_messages("t1")
+        labeler.gmail.get_current_history_id.return_value = "1001"
+        labeler.state.get_thread_state.return_value = None
+
+        result = labeler.run_incremental(dry_run=True)
+        labeler.close()
+
+        labeler.async_gmail.get_thread_details_batch.assert_awaited_once_with(["t1"])
+        labeler.gmail.get_thread_details_batch.assert_not_called()
+        self.assertEqual(result.get("errors"), 0)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_async_client_shared_by_parallel_workers(self):
+        """Parallel workers (e.g. backfill shards) fetch through the one async loop concurrently."""
+        import asyncio
+        from collections import Counter
+        from concurrent.futures import ThreadPoolExecutor
+        labeler = self._create_labeler()
+        labeler._start_async_loop()
+
+        async def fetch(ids):
+            await asyncio.sleep(0.05)
+            return {t_id: {"messages": [{"id": t_id}]} for t_id in ids}, {}
+
+        labeler.async_gmail = AsyncMock()
+        labeler.async_gmail.get_thread_details_batch.side_effect = fetch
+        stats = Counter()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            fetched = list(pool.map(lambda t_id: list(labeler._iter_thread_details([t_id], stats)), ["a", "b", "c", "d"]))
+        labeler.close()
+
+        self.assertEqual([[t_id for t_id, _ in pairs] for pairs in fetched], [["a"], ["b"], ["c"], ["d"]])
+        self.assertEqual(stats["errors"], 0)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_full_sweep_processes_pages_as_they_arrive(self):
+        """The first listing page is fetched before the second page is requested."""
+        labeler = self._create_labeler()
+        events = []
+
+        def pages(days_lookback=None, limit=None, query=None):
+            for page in (["t1", "t2"], ["t3", "t4"]):
+                events.append(f"list {page}")
+                for t_id in page:
+                    yield {"id": t_id}
+
+        def fetch(ids):
+            events.append(f"fetch {ids}")
+            return {t_id: {"messages": []} for t_id in ids}, {}
+
+        labeler.gmail.iter_recent_threads.side_effect = pages
+        labeler.gmail.get_thread_details_batch.side_effect = fetch
+        labeler.gmail.get_current_history_id.return_value = "99999"
+        labeler.state.get_thread_state.return_value = None
+
+        with patch('labeler.Config.GMAIL_BATCH_SIZE', 2):
+            result = labeler.run_full_sweep(dry_run=True)
+
+        self.assertEqual(events, [
+            "list ['t1', 't2']", "fetch ['t1', 't2']",
+            "list ['t3', 't4']", "fetch ['t3', 't4']",
+        ])
+        self.assertEqual(result.get("threads_scanned"), 4)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_incremental_suppresses_self_induced_label_changes(self):
+        """Label-only history records matching our last applied labels are dropped without a fetch."""
+        labeler = self._create_labeler()
+        labeler.state.get_last_history_id.return_value = "1000"
+        labeler.gmail.get_current_history_id.return_value = "1001"
+        labeler.gmail.get_label_map.return_value = {"STATUS/New": "L1", "TYPE/Order": "L2", "Archive": "L9"}
+        labeler.gmail.get_managed_label_ids.return_value = {"L1", "L2"}
+        labeler.gmail.fetch_history_changes.return_value = {
+            # Our own write from the previous run
+            "ours": {"messages_added": [], "labels_added": {"L1", "L2"}, "labels_removed": set(), "label_records": 2},
+            # A user-applied label outside the taxonomy
+            "foreign": {"messages_added": [], "labels_added": {"L9"}, "labels_removed": set(), "label_records": 1},
+        }
+        labeler.state.get_thread_state.return_value = {
+            "message_count": 1, "applied_labels": ["STATUS/New", "TYPE/Order"],
+            "last_processed_at": "2025-01-01", "history_id": "900",
+        }
+        labeler.gmail.get_thread_details_batch.return_value = ({"foreign": {"messages": []}}, {})
+
+        result = labeler.run_incremental(dry_run=True)
+
+        labeler.gmail.get_thread_details_batch.assert_called_once_with(["foreign"])
+        labeler.gemini.classify_thread.assert_not_called()
+        labeler.gemini.classify_thread_update.assert_not_called()
+        self.assertEqual(result.get("threads_scanned"), 2)
+        self.assertEqual(result.get("self_induced_skips"), 1)
+        self.assertEqual(result.get("history_records_suppressed"), 2)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_incremental_updates_from_new_messages_only(self):
+        """A labeled thread with stored context is updated from its new messages, not re-fetched whole."""
+        labeler = self._create_labeler()
+        labeler.state.get_last_history_id.return_value = "1000"
+        labeler.gmail.get_current_history_id.return_value = "1001"
+        labeler.gmail.get_label_map.return_value = {}
+        labeler.gmail.fetch_history_changes.return_value = _new_messages("t1")
+        labeler.state.get_thread_state.return_value = {
+            "message_count": 7, "applied_labels": ["STATUS/Waiting"], "last_processed_at": "2025-01-01",
+            "history_id": "900", "subject": "Order 42", "last_sender": "us",
+        }
+        labeler.gmail.get_message_details_batch.return_value = ({"m-t1": {
+            "id": "m-t1", "threadId": "t1", "historyId": "1001", "labelIds": ["INBOX"], "snippet": "Any update?",
+            "payload": {"headers": [{"name": "From", "value": "customer@example.com"}]}
+        }}, {})
+        labeler.gemini.classify_thread_update.return_value = ({
+            "status": "New", "type": "Order", "finance": None,
+            "action": "Prepare-reply", "priority": "High", "reason": "Customer follow-up"
+        }, {"prompt_tokens": 50, "completion_tokens": 10})
+
+        result = labeler.run_incremental(dry_run=True)
+
+        labeler.gmail.get_message_details_batch.assert_called_once_with(["m-t1"])
+        labeler.gmail.get_thread_details_batch.assert_not_called()
+        args, kwargs = labeler.gemini.classify_thread_update.call_args
+        self.assertEqual(args[0], "Order 42")
+        self.assertIn("Any update?", args[1])
+        self.assertEqual(kwargs["last_sender"], "us")
+        self.assertEqual(result.get("message_level_updates"), 1)
+        self.assertEqual(result.get("threads_modified"), 1)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_resumed_sweep_skips_completed_threads(self):
+        """--resume continues an interrupted sweep and reports both parts of it."""
+        from state import StateDB
+        labeler = self._create_labeler()
+        labeler.apply_queue = None
+        with tempfile.TemporaryDirectory() as temp_dir:
+            labeler.state = StateDB(os.path.join(temp_dir, "state.db"))
+            labeler.state.start_sweep("s1", {"days_lookback": 7, "force_rescan": False, "limit": None}, "run-a")
+            labeler.state.checkpoint_sweep("s1", {"threads_scanned": 2, "threads_modified": 2, "total_cost_usd": 0.5}, ["t1", "t2"])
+
+            labeler.gmail.iter_recent_threads.return_value = [{"id": "t1"}, {"id": "t2"}, {"id": "t3"}]
+            labeler.gmail.get_current_history_id.return_value = "99999"
+            labeler.gmail.get_label_map.return_value = {}
+            labeler.gmail.modify_thread_labels.return_value = {"id": "t3", "historyId": "600"}
+            labeler.gmail.get_thread_details_batch.return_value = ({
+                "t3": {"historyId": "500", "messages": [{
+                    "id": "m3", "labelIds": [], "snippet": "Invoice attached",
+                    "payload": {"headers": [{"name": "Subject", "value": "Invoice"}]}
+                }]}
+            }, {})
+            labeler.gemini.classify_thread.return_value = ({
+                "status": "New", "type": "Invoice", "finance": None,
+                "action": "No-action", "priority": "Low", "reason": "Invoice"
+            }, {"prompt_tokens": 10, "completion_tokens": 5})
+
+            result = labeler.run_full_sweep(resume=True)
+
+            labeler.gmail.iter_recent_threads.assert_called_once_with(days_lookback=7, limit=None, query=None)
+            labeler.gmail.get_thread_details_batch.assert_called_once_with(["t3"])
+            self.assertEqual(result.get("sweep_resume_skips"), 2)
+            self.assertEqual(result.get("threads_scanned"), 3)
+            self.assertEqual(result.get("threads_modified"), 3)
+            self.assertEqual(result.get("sweep_parts"), 2)
+            self.assertEqual([p["run_id"] for p in result["sweep"]["parts"]], ["run-a", labeler.logger.run_id])
+            self.assertIsNone(labeler.state.get_active_sweep())
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_failed_listing_leaves_sweep_open_and_resume_does_not_recount(self):
+        """A listing cut short keeps the sweep running; its skipped threads are not counted again on resume."""
+        from googleapiclient.errors import HttpError
+        from state import StateDB
+        labeler = self._create_labeler()
+        labeler.apply_queue = None
+        with tempfile.TemporaryDirectory() as temp_dir:
+            labeler.state = StateDB(os.path.join(temp_dir, "state.db"))
+            labeler.state.update_thread_state("t1", 1, ["STATUS/New"], "100")
+            labeler.gmail.get_current_history_id.return_value = "99999"
+
+            def broken_listing(**kwargs):
+                yield {"id": "t1", "historyId": "100"}
+                raise HttpError(MagicMock(status=500), b"backend error")
+
+            labeler.gmail.iter_recent_threads.side_effect = broken_listing
+            first = labeler.run_full_sweep(days_lookback=7)
+
+            self.assertTrue(first.get("sweep_incomplete"))
+            self.assertEqual(first.get("errors"), 1)
+            self.assertIsNotNone(labeler.state.get_active_sweep())
+            self.assertIsNone(labeler.state.get_last_full_sweep())
+            self.assertIsNone(labeler.state.get_last_history_id())
+
+            labeler.gmail.iter_recent_threads.side_effect = None
+            labeler.gmail.iter_recent_threads.return_value = [{"id": "t1", "historyId": "100"}]
+            result = labeler.run_full_sweep(resume=True)
+
+            self.assertEqual(result.get("sweep_resume_skips"), 1)
+            self.assertEqual(result.get("threads_scanned"), 1)
+            self.assertEqual(result.get("threads_skipped"), 1)
+            self.assertEqual(result.get("history_id_skips"), 1)
+            self.assertIsNone(labeler.state.get_active_sweep())
+            self.assertIsNotNone(labeler.state.get_last_full_sweep())
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_server_filter_pushes_exclusions_into_listing_query(self):
+        """With server_filter the sweep lists with exclusions and reports what Gmail filtered."""
+        labeler = self._create_labeler()
+        labeler.gmail.iter_recent_threads.return_value = []
+        labeler.gmail.get_current_history_id.return_value = "99999"
+        labeler.gmail.estimate_thread_count.side_effect = lambda query: 120 if query == "newer_than:14d" else 45
+
+        with patch('labeler.Config.SWEEP_EXCLUDE_CATEGORIES', ["promotions"]), \
+             patch('labeler.Config.SWEEP_EXTRA_QUERY', "-from:noreply@shop.example"):
+            result = labeler.run_full_sweep(days_lookback=14, dry_run=True, server_filter=True)
+
+        query = labeler.gmail.iter_recent_threads.call_args.kwargs["query"]
+        self.assertEqual(query, "newer_than:14d -label:STATUS-Closed -category:promotions -from:noreply@shop.example")
+        self.assertEqual(result.get("server_filtered_estimate"), 75)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_backfill_shards_adaptively_and_resumes(self):
+        """Backfill splits busy date ranges, processes every shard once and records completion."""
+        from datetime import date
+        from state import StateDB
+        labeler = self._create_labeler()
+        labeler.apply_queue = None
+        labeler.workers = 2
+
+        def estimate(query):
+            after, before = (int(term.split(":")[1]) for term in query.split())
+            return (before - after) // 86400 * 100  # 100 threads per day
+
+        listed = []
+
+        def shard_threads(query=None, **kwargs):
+            listed.append(query)
+            return [{"id": f"t-{query}"}]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            labeler.state = StateDB(os.path.join(temp_dir, "state.db"))
+            labeler.gmail.estimate_thread_count.side_effect = estimate
+            labeler.gmail.iter_recent_threads.side_effect = shard_threads
+            labeler.gmail.get_thread_details_batch.side_effect = lambda ids: ({t_id: {"messages": []} for t_id in ids}, {})
+
+            result = labeler.run_backfill(date(2024, 1, 1), date(2024, 1, 17))
+
+            shards = labeler.state.get_backfill_shards("2024-01-01..2024-01-17")
+            self.assertEqual(len(shards), 4)
+            self.assertTrue(all(shard["estimate"] <= 500 for shard in shards))
+            self.assertTrue(all(shard["status"] == "done" for shard in shards))
+            self.assertEqual(result.get("backfill_shards_done"), 4)
+            self.assertEqual(result.get("threads_scanned"), 4)
+            self.assertEqual(len(set(listed)), 4)
+
+            # Re-running the same range finds nothing left to do
+            result = labeler.run_backfill(date(2024, 1, 1), date(2024, 1, 17))
+            self.assertEqual(len(listed), 4)
+            self.assertEqual(result.get("backfill_shards_done"), 4)
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_backfill_without_until_resumes_on_a_later_day(self):
+        """A budget-capped backfill re-run the next day continues its plan instead of re-planning."""
+        from datetime import date, timedelta
+        from state import StateDB
+        labeler = self._create_labeler()
+        labeler.apply_queue = None
+        since = date.today() - timedelta(days=16)
+
+        class NextDay(date):
+            @classmethod
+            def today(cls):
+                return date.today() + timedelta(days=1)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            labeler.state = StateDB(os.path.join(temp_dir, "state.db"))
+            labeler.gmail.estimate_thread_count.return_value = 100
+            labeler.gmail.iter_recent_threads.side_effect = lambda query=None, **kwargs: [{"id": f"t-{query}"}]
+            labeler.gmail.get_thread_details_batch.side_effect = lambda ids: ({t_id: {"messages": []} for t_id in ids}, {})
+
+            # No budget: every shard stays pending
+            first = labeler.run_backfill(since, max_cost_usd=0)
+            self.assertEqual(first.get("backfill_shards_done"), 0)
+            estimates = labeler.gmail.estimate_thread_count.call_count
+
+            with patch('labeler.date', NextDay):
+                second = labeler.run_backfill(since)
+
+            self.assertEqual(second.get("backfill_id"), first.get("backfill_id"))
+            self.assertEqual(labeler.gmail.estimate_thread_count.call_count, estimates)
+            self.assertEqual(second.get("backfill_shards_done"), first.get("backfill_shards_total"))
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_rebuild_state_from_gmail_labels(self):
+        """rebuild-state repopulates thread_cache and the cursor from existing labels, without Gemini."""
+        from state import StateDB
+        labeler = self._create_labeler()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            labeler.state = StateDB(os.path.join(temp_dir, "state.db"))
+            labeler.gmail.get_label_map.return_value = {"STATUS/Waiting-for-reply": "L1", "TYPE/Order": "L2"}
+            labeler.gmail.get_current_history_id.return_value = "5000"
+            labeler.gmail.iter_recent_threads.return_value = [{"id": "t1", "historyId": "4900"}]
+            labeler.gmail.get_thread_details_batch.return_value = ({
+                "t1": {"historyId": "4900", "messages": [
+                    {"id": "m1", "labelIds": ["INBOX", "L1", "L2"], "snippet": "Where is my order?",
+                     "payload": {"headers": [{"name": "Subject", "value": "Order 42"}]}},
+                    {"id": "m2", "labelIds": ["SENT", "L1"], "snippet": "On its way",
+                     "payload": {"headers": [{"name": "Subject", "value": "Re: Order 42"}]}},
+                ]}
+            }, {})
+
+            result = labeler.run_rebuild_state()
+
+            query = labeler.gmail.iter_recent_threads.call_args.kwargs["query"]
+            self.assertEqual(query, "{label:STATUS-Waiting-for-reply label:TYPE-Order}")
+            self.assertEqual(labeler.state.get_last_history_id(), "5000")
+            cached = labeler.state.get_thread_state("t1")
+            self.assertEqual(cached["applied_labels"], ["STATUS/Waiting-for-reply", "TYPE/Order"])
+            self.assertEqual(cached["message_count"], 2)
+            self.assertEqual(cached["history_id"], "4900")
+            self.assertEqual((cached["subject"], cached["last_sender"]), ("Order 42", "us"))
+            self.assertEqual(result.get("threads_rebuilt"), 1)
+            self.assertEqual(result.get("total_tokens_spent"), 0)
+            labeler.gemini.classify_thread.assert_not_called()
+            labeler.gmail.modify_thread_labels.assert_not_called()
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_dry_run_plan_applied_without_reclassifying(self):
+        """A dry run saves its decisions; apply carries them out and skips threads that moved on."""
+        from state import StateDB
+        labeler = self._create_labeler()
+        labeler.apply_queue = None
+        with tempfile.TemporaryDirectory() as temp_dir:
+            labeler.state = StateDB(os.path.join(temp_dir, "state.db"))
+            labeler.gmail.get_label_map.return_value = {}
+            labeler.gmail.get_current_history_id.return_value = "99999"
+            labeler.gmail.iter_recent_threads.return_value = [{"id": "t1"}, {"id": "t2"}]
+
+            def threads(t2_history_id):
+                return ({
+                    t_id: {"historyId": history_id, "messages": [{
+                        "id": f"m-{t_id}", "labelIds": [], "snippet": "Invoice attached",
+                        "payload": {"headers": [{"name": "Subject", "value": "Invoice"}]}
+                    }]}
+                    for t_id, history_id in (("t1", "500"), ("t2", t2_history_id))
+                }, {})
+
+            labeler.gmail.get_thread_details_batch.return_value = threads("600")
+            labeler.gemini.classify_thread.return_value = ({
+                "status": "New", "type": "Invoice", "finance": None,
+                "action": "No-action", "priority": "Low", "reason": "Invoice"
+            }, {"prompt_tokens": 10, "completion_tokens": 5})
+
+            planned = labeler.run_full_sweep(dry_run=True)
+            self.assertEqual(planned.get("plan_entries"), 2)
+            self.assertEqual(labeler.state.get_latest_plan_id(), planned["plan_id"])
+
+            # t2 received a message after the dry run
+            labeler.gmail.get_thread_details_batch.return_value = threads("650")
+            labeler.gmail.modify_thread_labels.return_value = {"id": "t1", "historyId": "700"}
+            labeler.gemini.classify_thread.reset_mock()
+            result = labeler.run_apply_plan()
+
+            labeler.gemini.classify_thread.assert_not_called()
+            labeler.gmail.modify_thread_labels.assert_called_once()
+            self.assertEqual(labeler.gmail.modify_thread_labels.call_args[0][0], "t1")
+            self.assertEqual((result.get("plan_applied"), result.get("plan_stale")), (1, 1))
+            self.assertEqual(labeler.state.get_thread_state("t1")["applied_labels"][0], "STATUS/New")
+            self.assertIsNone(labeler.state.get_thread_state("t2"))
+            # Nothing left to apply
+            self.assertIsNone(labeler.state.get_latest_plan_id())
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_prepare_reply_published_to_outbox(self):
+        """Applied Prepare-reply decisions reach the draft outbox with the latest message."""
+        labeler = self._create_labeler()
+        labeler.apply_queue = None
+        labeler.gmail.iter_recent_threads.return_value = [{"id": "t1"}]
+        labeler.gmail.get_current_history_id.return_value = "99999"
+        labeler.gmail.get_label_map.return_value = {}
+        labeler.gmail.modify_thread_labels.return_value = {"id": "t1", "historyId": "600"}
+        labeler.state.get_thread_state.return_value = None
+        labeler.gmail.get_thread_details_batch.return_value = ({
+            "t1": {"historyId": "500", "messages": [{
+                "id": "m1", "labelIds": ["INBOX"], "snippet": "Where is my parcel?",
+                "payload": {"headers": [
+                    {"name": "From", "value": "customer@example.com"},
+                    {"name": "Subject", "value": "Parcel"},
+                ]}
+            }]}
+        }, {})
+        labeler.gemini.classify_thread.return_value = ({
+            "status": "New", "type": "Shipping", "finance": None,
+            "action": "Prepare-reply", "priority": "Normal", "reason": "Asks about delivery"
+        }, {"prompt_tokens": 10, "completion_tokens": 5})
+
+        labeler.run_full_sweep()
+
+        t_id, labels, reason, subject, message = labeler.state.enqueue_draft.call_args[0]
+        self.assertEqual((t_id, reason, subject), ("t1", "Asks about delivery", "Parcel"))
+        self.assertIn("ACTION/Prepare-reply", labels)
+        self.assertEqual((message["message_id"], message["from"]), ("m1", "customer@example.com"))
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_filters_compiled_tracked_and_skipped(self):
+        """Consistent senders become Gmail filters; threads those filters labeled are not classified."""
+        from state import StateDB
+        labeler = self._create_labeler()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            labeler.state = StateDB(os.path.join(temp_dir, "state.db"))
+            labels = ["STATUS/New", "TYPE/Order", "ACTION/No-action", "PRIORITY/Low"]
+            for i in range(20):
+                labeler.state.update_thread_state(f"old{i}", 1, labels, subject=f"Order {i}", sender="shop@example.com")
+            labeler.gmail.list_filters.return_value = []
+            labeler.gmail.create_filter.return_value = {"id": "F1"}
+
+            with patch('labeler.Config.GMAIL_MANAGE_FILTERS', True):
+                result = labeler.run_compile_filters(create=True)
+
+            labeler.gmail.create_filter.assert_called_once_with({"from": "shop@example.com"}, labels)
+            self.assertEqual(result.get("filters_created"), 1)
+            self.assertEqual(labeler.state.get_gmail_filters()[0]["gmail_filter_id"], "F1")
+            # Proposed once: a second run has nothing new
+            self.assertEqual(labeler.run_compile_filters().get("filter_proposals"), [])
+
+            # A new order arrives already labeled by the filter
+            labeler.gmail.get_label_map.return_value = {name: f"L{i}" for i, name in enumerate(labels)}
+            labeler._label_names_by_id = None
+            labeler.gmail.iter_recent_threads.return_value = [{"id": "t1"}]
+            labeler.gmail.get_current_history_id.return_value = "99999"
+            labeler.gmail.get_thread_details_batch.return_value = ({
+                "t1": {"historyId": "500", "messages": [{
+                    "id": "m1", "labelIds": ["INBOX", "L0", "L1", "L2", "L3"], "snippet": "New order",
+                    "payload": {"headers": [
+                        {"name": "From", "value": "Shop <shop@example.com>"},
+                        {"name": "Subject", "value": "Order 21"},
+                    ]}
+                }]}
+            }, {})
+
+            result = labeler.run_full_sweep()
+
+            labeler.gemini.classify_thread.assert_not_called()
+            labeler.gmail.modify_thread_labels.assert_not_called()
+            self.assertEqual(result.get("filter_skips"), 1)
+            cached = labeler.state.get_thread_state("t1")
+            self.assertEqual((cached["applied_labels"], cached["sender"]), (labels, "shop@example.com"))
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_partial_filter_does_not_suppress_classification(self):
+        """A tracked filter that sets only some categories leaves the thread to Gemini."""
+        labeler = self._create_labeler()
+        labeler.apply_queue = None
+        labeler.state.get_gmail_filters.return_value = [{
+            "gmail_filter_id": "F1", "from": "billing@example.com", "subject": None,
+            "labels": ["TYPE/Finance", "FINANCE/Invoice-incoming"],
+        }]
+        labeler.gmail.get_label_map.return_value = {"TYPE/Finance": "L1", "FINANCE/Invoice-incoming": "L2"}
+        labeler.gmail.iter_recent_threads.return_value = [{"id": "t1"}]
+        labeler.gmail.get_current_history_id.return_value = "99999"
+        labeler.state.get_thread_state.return_value = None
+        labeler.gmail.get_thread_details_batch.return_value = ({"t1": {"historyId": "500", "messages": [{
+            "id": "m1", "labelIds": ["INBOX", "L1", "L2"], "snippet": "Invoice attached",
+            "payload": {"headers": [
+                {"name": "From", "value": "billing@example.com"}, {"name": "Subject", "value": "Invoice 7"},
+            ]}
+        }]}}, {})
+        labeler.gemini.classify_thread.return_value = ({
+            "status": "Processed", "type": "Finance", "finance": "Invoice-incoming",
+            "action": "Archive", "priority": "Normal", "reason": "Incoming invoice"
+        }, {"prompt_tokens": 10, "completion_tokens": 5})
+        labeler.gmail.modify_thread_labels.return_value = {"id": "t1", "historyId": "501"}
+
+        result = labeler.run_full_sweep()
+
+        labeler.gemini.classify_thread.assert_called_once()
+        self.assertEqual(result.get("filter_skips"), 0)
+        # The filter's labels were already there: only the missing categories are added
+        labeler.gmail.modify_thread_labels.assert_called_once_with(
+            "t1", add_labels=["STATUS/Processed", "ACTION/Archive", "PRIORITY/Normal"], remove_labels=[]
+        )
+
+
+
+    @patch.dict(os.environ, {
+        "GOOGLE_CLIENT_ID": "fake",
+        "GOOGLE_CLIENT_SECRET": "fake",
+        "GOOGLE_REFRESH_TOKEN": "fake",
+        "GEMINI_API_KEY": "fake",
+    })
+    def test_incremental_threads_share_one_batched_prompt(self):
+        """New threads and message-level updates of one run are classified in a single batch call."""
+        labeler = self._create_labeler()
+        labeler.gemini_batch_size = 10
+        labeler.state.get_last_history_id.return_value = "1000"
+        labeler.gmail.get_current_history_id.return_value = "1001"
+        labeler.gmail.get_label_map.return_value = {}
+        labeler.gmail.fetch_history_changes.return_value = _new_messages("t1", "t2", "t3")
+        cached = {
+            "message_count": 2, "applied_labels": ["STATUS/Waiting-for-reply"], "last_processed_at": "2025-01-01",
+            "history_id": "900", "subject": "Order 42", "last_sender": "us",
+        }
+        labeler.state.get_thread_state.side_effect = lambda t_id: cached if t_id == "t1" else None
+        labeler.gmail.get_message_details_batch.return_value = ({"m-t1": {
+            "id": "m-t1", "threadId": "t1", "historyId": "1001", "labelIds": ["INBOX"], "snippet": "Any update?",
+            "payload": {"headers": [{"name": "From", "value": "customer@example.com"}]}
+        }}, {})
+        labeler.gmail.get_thread_details_batch.side_effect = lambda ids: ({
+            t_id: {"messages": [{
+                "id": f"m-{t_id}", "labelIds": [], "snippet": "Nová objednávka",
+                "payload": {"headers": [{"name": "Subject", "value": f"Order {t_id}"}]}
+            }]} for t_id in ids
+        }, {})
+        labels = {"status": "New", "type": "Order", "finance": None,
+                  "action": "No-action", "priority": "Low", "reason": "Order notification"}
+        labeler.gemini.classify_threads_batch.side_effect = lambda requests: {
+            request["thread_id"]: (labels, {"prompt_tokens": 40, "completion_tokens": 10}) for request in requests
+        }
+
+        result = labeler.run_incremental(dry_run=True)
+
+        labeler.gemini.classify_threads_batch.assert_called_once()
+        requests = {r["thread_id"]: r for r in labeler.gemini.classify_threads_batch.call_args.args[0]}
+        self.assertEqual(sorted(requests), ["t1", "t2", "t3"])
+        self.assertEqual(requests["t1"]["current_labels"], ["STATUS/Waiting-for-reply"])
+        self.assertEqual(requests["t2"]["thread_text"].count("Nová objednávka"), 1)
+        labeler.gemini.classify_thread.assert_not_called()
+        labeler.gemini.classify_thread_update.assert_not_called()
+        self.assertEqual(result.get("batched_classifications"), 3)
+        self.assertEqual(result.get("threads_modified"), 3)
+        self.assertEqual(result.get("total_tokens_spent"), 150)
+
+
+class TestWarmClients(unittest.TestCase):
+    """Long-lived processes reuse one set of clients across labeler runs."""
+
+    @patch.dict(os.environ, {"GEMINI_API_KEY": "fake"})
+    def test_scheduler_ticks_reuse_clients(self):
+        import scheduler
+        with patch('labeler.GmailClient') as MockGmail, \
+             patch('labeler.GeminiClient') as MockGemini, \
+             patch('labeler.StateDB') as MockState, \
+             patch('labeler.StructuredLogger') as MockLogger, \
+             patch.dict('scheduler._warm_clients', clear=True):
+            MockState.return_value.get_last_history_id.return_value = "1000"
+            MockGmail.return_value.fetch_history_changes.return_value = {}
+            MockGmail.return_value.get_current_history_id.return_value = "1001"
+            MockLogger.return_value.finish.side_effect = lambda stats: stats
+
+            labelers = []
+            original_init = scheduler.Labeler.__init__
+
+            def tracking_init(labeler, *args, **kwargs):
+                original_init(labeler, *args, **kwargs)
+                labelers.append(labeler)
+
+            with patch.object(scheduler.Labeler, '__init__', tracking_init):
+                scheduler.incremental_job()
+                scheduler.incremental_job()
+
+            # Gmail, Gemini and the state DB are built once; each tick gets a fresh logger
+            self.assertEqual(MockGmail.call_count, 1)
+            self.assertEqual(MockGemini.call_count, 1)
+            self.assertEqual(MockState.call_count, 1)
+            self.assertEqual(MockLogger.call_count, 2)
+            self.assertIs(labelers[0].gmail, labelers[1].gmail)
+            # Closing a run leaves the shared connection pool open
+            MockGmail.return_value.close.assert_not_called()
+
+            summary = MockLogger.return_value.finish.call_args[0][0]
+            self.assertIn("client_setup_saved_seconds", summary)
+            self.assertEqual(scheduler._warm_clients["default"].metrics()["jobs"], 2)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,114 @@
+import unittest
+import json
+import os
+import sys
+import tempfile
+import threading
+from unittest.mock import MagicMock, patch
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mailboxes import Mailbox, load_mailboxes
+
+
+class TestMailboxRegistry(unittest.TestCase):
+    def _write_registry(self, entries):
+        handle, path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(handle, "w") as f:
+            json.dump(entries, f)
+        self.addCleanup(os.remove, path)
+        return path
+
+    @patch.dict(os.environ, {"SHOP_A_TOKEN": "token-a"})
+    def test_load_registry(self):
+        path = self._write_registry([
+            {"name": "shop-a", "email": "a@example.com", "refresh_token_env": "SHOP_A_TOKEN"},
+            {"name": "shop-b", "refresh_token": "token-b", "state_db_path": "/tmp/b.db", "quota_units_per_second": 100},
+        ])
+
+        shop_a, shop_b = load_mailboxes(path)
+
+        self.assertEqual(shop_a.refresh_token, "token-a")
+        self.assertTrue(shop_a.state_db_path.endswith("labeler_state_shop-a.db"))
+        self.assertEqual(shop_b.state_db_path, "/tmp/b.db")
+        # Each mailbox paces its own quota
+        self.assertIsNot(shop_a.limiter, shop_b.limiter)
+        self.assertIs(shop_a.limiter, shop_a.limiter)
+        self.assertEqual(shop_b.limiter.rate, 100)
+
+    def test_rejects_missing_token_and_duplicates(self):
+        with self.assertRaises(ValueError):
+            load_mailboxes(self._write_registry([{"name": "shop-a", "refresh_token_env": "UNSET_TOKEN_VAR"}]))
+        with self.assertRaises(ValueError):
+            load_mailboxes(self._write_registry([
+                {"name": "shop-a", "refresh_token": "x"}, {"name": "shop-a", "refresh_token": "y"},
+            ]))
+
+
+class TestMailboxPool(unittest.TestCase):
+    def test_one_pending_job_per_mailbox_and_rotating_order(self):
+        from scheduler import MailboxPool
+        mailboxes = [Mailbox(name, "token") for name in ("a", "b", "c")]
+        release = threading.Event()
+        started = []
+
+        def fake_labeler(trigger, workers, clients):
+            started.append(clients.mailbox.name)
+            labeler = MagicMock()
+            labeler.run_incremental.side_effect = lambda: release.wait(5)
+            return labeler
+
+        def fake_clients(mailbox, gemini):
+            return MagicMock(mailbox=mailbox, setup_seconds=0.1)
+
+        with patch('scheduler.Labeler', side_effect=fake_labeler), \
+             patch('scheduler.LabelerClients', side_effect=fake_clients) as MockClients, \
+             patch.dict('scheduler._warm_clients', clear=True):
+            pool = MailboxPool(mailboxes, workers=1, gemini=MagicMock())
+            first = pool.submit_all("incremental")
+            # Every mailbox still has a job pending: nothing new is queued
+            self.assertEqual(pool.submit_all("incremental"), [])
+            release.set()
+            for future in first:
+                future.result(timeout=5)
+            second = pool.submit_all("incremental")
+            for future in second:
+                future.result(timeout=5)
+            pool.shutdown()
+
+        # Clients are built once per mailbox and kept across rounds
+        self.assertEqual(MockClients.call_count, 3)
+        self.assertEqual(len(first), 3)
+        # The third round starts one mailbox further along
+        self.assertEqual(started, ["a", "b", "c", "c", "a", "b"])
+
+    def test_sweep_deferred_behind_pending_incremental(self):
+        from scheduler import MailboxPool
+        mailbox = Mailbox("a", "token")
+        release = threading.Event()
+        runs = []
+
+        def fake_labeler(trigger, workers, clients):
+            labeler = MagicMock()
+            labeler.run_incremental.side_effect = lambda: (release.wait(5), runs.append("incremental"))
+            labeler.run_full_sweep.side_effect = lambda resume: runs.append("full_sweep")
+            return labeler
+
+        with patch('scheduler.Labeler', side_effect=fake_labeler), \
+             patch('scheduler.LabelerClients', return_value=MagicMock(setup_seconds=0.1)), \
+             patch.dict('scheduler._warm_clients', clear=True):
+            pool = MailboxPool([mailbox], workers=2, gemini=MagicMock())
+            incremental = pool.submit_all("incremental")
+            # The nightly sweep is not dropped: it waits for the incremental job
+            self.assertEqual(pool.submit_all("full_sweep"), [])
+            self.assertEqual(pool.submit_all("full_sweep"), [])
+            release.set()
+            incremental[0].result(timeout=5)
+            pool.shutdown()
+
+        self.assertEqual(runs, ["incremental", "full_sweep"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import json
+import os
+import sys
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from unittest.mock import patch
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from state import StateDB
+
+MESSAGE = {"message_id": "m2", "from": "customer@example.com", "date": "2026-03-01", "snippet": "Where is it?"}
+LABELS = ["STATUS/New", "TYPE/Shipping", "ACTION/Prepare-reply", "PRIORITY/Normal"]
+
+
+class TestDraftOutbox(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.state = StateDB(os.path.join(self.temp_dir.name, "state.db"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_claim_ack_and_lease_expiry(self):
+        self.state.enqueue_draft("t1", LABELS, "Asks about delivery", "Order 42", MESSAGE)
+        # A newer decision for an unclaimed thread refreshes its entry
+        self.state.enqueue_draft("t1", LABELS, "Asks again", "Order 42", {**MESSAGE, "message_id": "m3"})
+        self.state.enqueue_draft("t2", LABELS, "Complaint", "Broken item", MESSAGE)
+
+        first = self.state.claim_drafts("agent-a", limit=1)
+        self.assertEqual([(d["thread_id"], d["reason"], d["message"]["message_id"]) for d in first],
+                         [("t1", "Asks again", "m3")])
+        second = self.state.claim_drafts("agent-b", limit=5)
+        self.assertEqual([d["thread_id"] for d in second], ["t2"])
+        self.assertEqual(self.state.claim_drafts("agent-b"), [])
+
+        self.assertFalse(self.state.ack_draft(first[0]["id"], "agent-b"))
+        self.assertTrue(self.state.ack_draft(first[0]["id"], "agent-a"))
+
+        # agent-b's claim lapses without an ack: the entry is handed out again
+        with patch('state.datetime') as mock_datetime:
+            from datetime import datetime, timedelta
+            mock_datetime.now.return_value = datetime.now() + timedelta(seconds=301)
+            retried = self.state.claim_drafts("agent-c")
+        self.assertEqual([(d["thread_id"], d["attempts"]) for d in retried], [("t2", 2)])
+        self.assertFalse(self.state.ack_draft(second[0]["id"], "agent-b"))
+
+
+class TestOutboxEndpoint(unittest.TestCase):
+    """Claims and acks outbox entries through the scheduler's HTTP server."""
+
+    def setUp(self):
+        from scheduler import make_http_server
+        self.temp_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.temp_dir.name, "state.db")
+        StateDB(db_path).enqueue_draft("t1", LABELS, "Asks about delivery", "Order 42", MESSAGE)
+        patchers = [patch('scheduler.Config.OUTBOX_TOKEN', "secret"), patch('scheduler.Config.STATE_DB_PATH', db_path)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.server = make_http_server(host="127.0.0.1", port=0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def _post(self, path):
+        request = urllib.request.Request(self.base + path, data=b"", method="POST")
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, b""
+
+    def test_claim_then_ack(self):
+        self.assertEqual(self._post("/outbox/claim?consumer=agent&token=wrong")[0], 403)
+
+        status, body = self._post("/outbox/claim?consumer=agent&limit=5&token=secret")
+        self.assertEqual(status, 200)
+        drafts = json.loads(body)["drafts"]
+        self.assertEqual([d["thread_id"] for d in drafts], ["t1"])
+
+        self.assertEqual(self._post(f"/outbox/ack?consumer=other&id={drafts[0]['id']}&token=secret")[0], 409)
+        self.assertEqual(self._post(f"/outbox/ack?consumer=agent&id={drafts[0]['id']}&token=secret")[0], 204)
+        self.assertEqual(json.loads(self._post("/outbox/claim?consumer=agent&token=secret")[1])["drafts"], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import base64
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from unittest.mock import patch
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from push import PushDebouncer, parse_push_notification
+
+
+def push_body(history_id, email="shop@example.com"):
+    """Pub/Sub push envelope as Gmail would publish it."""
+    data = base64.b64encode(json.dumps({"emailAddress": email, "historyId": history_id}).encode()).decode()
+    return json.dumps({
+        "message": {"data": data, "messageId": "1", "publishTime": "2026-01-01T00:00:00Z"},
+        "subscription": "projects/p/subscriptions/gmail-labeler",
+    }).encode()
+
+
+class TestPushNotifications(unittest.TestCase):
+    def test_parse_notification(self):
+        self.assertEqual(parse_push_notification(push_body(12345)), ("shop@example.com", "12345"))
+        with self.assertRaises(ValueError):
+            parse_push_notification(b'{"message": {}}')
+
+    def test_debouncer_coalesces_bursts(self):
+        fired = []
+        done = threading.Event()
+        debouncer = PushDebouncer(lambda hid: (fired.append(hid), done.set()), delay=0.05)
+
+        for history_id in ("100", "105", "103"):
+            debouncer.notify(history_id)
+
+        self.assertTrue(done.wait(2))
+        time.sleep(0.1)
+        self.assertEqual(fired, ["105"])
+        self.assertEqual(debouncer.notifications, 3)
+        self.assertEqual(debouncer.triggers, 1)
+
+    def test_debouncer_fires_within_max_delay_of_steady_notifications(self):
+        fired = []
+        debouncer = PushDebouncer(lambda hid: fired.append(hid), delay=0.1, max_delay=0.3)
+
+        # A notification every 50 ms never leaves the 100 ms quiet gap
+        for history_id in range(100, 112):
+            debouncer.notify(str(history_id))
+            time.sleep(0.05)
+        debouncer.cancel()
+
+        self.assertGreaterEqual(debouncer.triggers, 1)
+        self.assertLess(int(fired[0]), 111)
+
+
+class TestPushReceiver(unittest.TestCase):
+    """POSTs Pub/Sub payloads to the scheduler's HTTP server as a local stand-in for Pub/Sub."""
+
+    def setUp(self):
+        from scheduler import make_http_server
+        self.fired = []
+        self.done = threading.Event()
+        self.debouncer = PushDebouncer(lambda hid: (self.fired.append(hid), self.done.set()), delay=0.05)
+        self.server = make_http_server(host="127.0.0.1", port=0, push_debouncer=self.debouncer)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/gmail/push"
+
+    def tearDown(self):
+        self.debouncer.cancel()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _post(self, body, query=""):
+        request = urllib.request.Request(self.url + query, data=body, method="POST")
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def test_burst_triggers_one_run(self):
+        statuses = [self._post(push_body(hid)) for hid in (200, 201, 202)]
+
+        self.assertEqual(statuses, [204, 204, 204])
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual(self.fired, ["202"])
+
+    def test_rejects_bad_token_and_malformed_payload(self):
+        with patch('scheduler.Config.PUSH_WEBHOOK_TOKEN', "secret"):
+            self.assertEqual(self._post(push_body(1), "?token=wrong"), 403)
+            self.assertEqual(self._post(b"not json", "?token=secret"), 400)
+            self.assertEqual(self._post(push_body(1), "?token=secret"), 204)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limiter import QuotaRateLimiter, backoff_delay, quota_cost
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestQuotaRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = QuotaRateLimiter(units_per_second=100, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_burst_then_paced_by_method_cost(self):
+        # 100-unit bucket covers 10 threads.get calls (10 units each)
+        for _ in range(10):
+            self.assertEqual(self.limiter.acquire('threads.get'), 0)
+        # The 11th has to wait for 10 units to refill at 100 units/s
+        self.assertAlmostEqual(self.limiter.acquire('threads.get'), 0.1)
+
+        metrics = self.limiter.metrics()
+        self.assertEqual(metrics["units_consumed"], 110)
+        self.assertEqual(metrics["calls_by_method"]["threads.get"], 11)
+        self.assertEqual(metrics["throttled_waits"], 1)
+
+    def test_requests_above_bucket_size_charged_in_full(self):
+        # A 20-call threads.get batch costs 200 units, twice the 100-unit bucket
+        self.assertAlmostEqual(self.limiter.acquire('threads.get', count=20), 1.0)
+        self.assertAlmostEqual(self.limiter.acquire('threads.get', count=20), 2.0)
+        self.assertEqual(self.limiter.metrics()["units_consumed"], 400)
+        # 400 units at 100 units/s: the second batch may only start 3 s in
+        self.assertAlmostEqual(self.clock.now, 3.0)
+
+    def test_cheap_methods_cost_less(self):
+        self.assertLess(quota_cost('history.list'), quota_cost('threads.get'))
+        self.assertGreater(quota_cost('messages.batchModify'), quota_cost('threads.modify'))
+
+    def test_rate_limit_pauses_all_callers(self):
+        self.limiter.record_retry(rate_limited=True, pause=2.0)
+        self.assertGreaterEqual(self.limiter.acquire('labels.list'), 2.0)
+        self.assertEqual(self.limiter.metrics()["rate_limited_responses"], 1)
+
+    def test_backoff_honours_retry_after(self):
+        self.assertEqual(backoff_delay(3, retry_after="7"), 7.0)
+        for attempt in range(6):
+            self.assertLessEqual(backoff_delay(attempt, cap=8.0), 8.0)
+
+
+class TestGmailClientRetry(unittest.TestCase):
+    def _create_client(self):
+        with patch('gmail_client.build'), patch('gmail_client.Credentials'):
+            from gmail_client import GmailClient
+            clock = FakeClock()
+            limiter = QuotaRateLimiter(units_per_second=1000, clock=clock, sleep=clock.sleep)
+            return GmailClient(limiter=limiter)
+
+    def _http_error(self, status, retry_after=None):
+        from googleapiclient.errors import HttpError
+        resp = MagicMock(status=status)
+        resp.get.side_effect = lambda key, default=None: retry_after if key == 'retry-after' else default
+        return HttpError(resp, b'{"error": {"errors": [{"reason": "rateLimitExceeded"}]}}')
+
+    @patch('gmail_client.time.sleep')
+    def test_execute_retries_rate_limit_with_retry_after(self, mock_sleep):
+        client = self._create_client()
+        request = MagicMock()
+        request.execute.side_effect = [self._http_error(429, retry_after="3"), {"historyId": "5"}]
+
+        self.assertEqual(client._execute(request, 'users.getProfile'), {"historyId": "5"})
+        mock_sleep.assert_called_once_with(3.0)
+        self.assertEqual(client.limiter.metrics()["rate_limited_responses"], 1)
+
+    @patch('gmail_client.time.sleep')
+    def test_execute_does_not_retry_client_errors(self, mock_sleep):
+        from googleapiclient.errors import HttpError
+        client = self._create_client()
+        request = MagicMock()
+        request.execute.side_effect = self._http_error(404)
+
+        with self.assertRaises(HttpError):
+            client._execute(request, 'threads.get')
+        mock_sleep.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -78,6 +78,49 @@ class TestStateDB(unittest.TestCase):
         self.assertEqual(result["message_count"], 4)
         self.assertEqual(result["applied_labels"], ["STATUS/Closed", "TYPE/Order"])
 
+    # ── Sweep Checkpoints ───────────────────────
+
+    def test_sweep_checkpoint_lifecycle(self):
+        self.assertIsNone(self.state.get_active_sweep())
+        self.state.start_sweep("s1", {"days_lookback": 14}, "run-a")
+        self.state.checkpoint_sweep("s1", {"threads_modified": 3}, ["t1", "t2"])
+        self.state.add_sweep_part("s1", "run-b")
+
+        sweep = self.state.get_active_sweep()
+        self.assertEqual(sweep["params"], {"days_lookback": 14})
+        self.assertEqual([p["run_id"] for p in sweep["parts"]], ["run-a", "run-b"])
+        self.assertEqual(sweep["parts"][0]["stats"], {"threads_modified": 3})
+        self.assertEqual(self.state.get_sweep_completed_threads("s1"), {"t1", "t2"})
+
+        self.state.finish_sweep("s1")
+        self.assertIsNone(self.state.get_active_sweep())
+        self.assertEqual(self.state.get_sweep_completed_threads("s1"), set())
+
+    def test_thread_context_kept_when_not_given(self):
+        self.state.update_thread_state("t1", 2, ["STATUS/New"], subject="Order 42", last_sender="them")
+        self.state.update_thread_state("t1", 3, ["STATUS/Waiting"], last_sender="us")
+
+        result = self.state.get_thread_state("t1")
+        self.assertEqual(result["subject"], "Order 42")
+        self.assertEqual(result["last_sender"], "us")
+
+    def test_unchanged_thread_state_not_rewritten(self):
+        self.assertTrue(self.state.update_thread_state("t1", 2, ["STATUS/New"], "h1", subject="Order 42"))
+        written_at = self.state.get_thread_state("t1")["last_processed_at"]
+
+        self.assertFalse(self.state.update_thread_state("t1", 2, ["STATUS/New"], "h1"))
+        self.assertEqual(self.state.get_thread_state("t1")["last_processed_at"], written_at)
+        # Spent tokens are still accounted for
+        self.assertTrue(self.state.update_thread_state("t1", 2, ["STATUS/New"], "h1", prompt_tokens=10))
+
+    def test_set_thread_history_id(self):
+        self.state.update_thread_state("t1", 2, ["STATUS/New"], "h1")
+        self.state.set_thread_history_id("t1", "h2")
+
+        result = self.state.get_thread_state("t1")
+        self.assertEqual(result["history_id"], "h2")
+        self.assertEqual(result["message_count"], 2)
+
     def test_reset_thread_message_count(self):
         self.state.update_thread_state("t1", 5, ["STATUS/New"])
         self.state.reset_thread_message_count("t1", 0)
@@ -87,6 +130,28 @@ class TestStateDB(unittest.TestCase):
         # Labels should be preserved
         self.assertEqual(result["applied_labels"], ["STATUS/New"])
 
+    def test_concurrent_thread_updates(self):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            for i in range(40):
+                pool.submit(self.state.update_thread_state, f"t{i % 10}", i, ["STATUS/New"], prompt_tokens=1)
+
+        stats = self.state.get_stats()
+        self.assertEqual(stats["cached_threads"], 10)
+        self.assertEqual(stats["total_tokens_used"], 40)
+
+    # ── Label Cache ─────────────────────────────
+
+    def test_label_map_round_trip_and_ttl(self):
+        self.assertIsNone(self.state.get_label_map())
+        self.state.set_label_map({"STATUS/New": "Label_1"})
+
+        self.assertEqual(self.state.get_label_map(max_age_hours=1), {"STATUS/New": "Label_1"})
+        self.assertIsNone(self.state.get_label_map(max_age_hours=0))
+
+        self.state.set_label_map({})
+        self.assertIsNone(self.state.get_label_map())
+
     # ── Stats ───────────────────────────────────
 
     def test_stats(self):